@@ -1,7 +1,7 @@
 import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}/..")
 import json
-from utils import api, prompt, vision, common
+from utils import api, prompt, vision, common, tracing
 from tool_pool import landcover_type_api
 from tool_pool import population_density_api
 
@@ -10,9 +10,12 @@ class geographer_agent:
         self.landcover_type_api = landcover_type_api()
         self.population_density_api = population_density_api()
 
+    @tracing.traced("geographer.get_knowledge")
     def get_knowledge(self, min_lon, min_lat, max_lon, max_lat):
-        landcover_distribution = self.landcover_type_api.get_landcover_distribution(min_lon, min_lat, max_lon, max_lat)
-        population_density = self.population_density_api.get_population_density(min_lon, min_lat, max_lon, max_lat)
+        with tracing.span("tool.landcover_type_api", category="tool"):
+            landcover_distribution = self.landcover_type_api.get_landcover_distribution(min_lon, min_lat, max_lon, max_lat)
+        with tracing.span("tool.population_density_api", category="tool"):
+            population_density = self.population_density_api.get_population_density(min_lon, min_lat, max_lon, max_lat)
         geographical_data = {
             "landcover_distribution": landcover_distribution, 
             "population_density": population_density,
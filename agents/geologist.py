@@ -2,28 +2,52 @@ import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}/..")
 import cv2
 import json
-from utils import api, prompt, vision, common
+from utils import api, prompt, vision, common, scheduler, tracing
 from tool_pool import k2_knowledge_db, geological_knwoledge_type
 from tool_pool import map_component_detector
 from tool_pool import map_legend_detector
 from tool_pool import rock_type_and_age_db
 
 class geologist_agent:
-    def __init__(self):
-        self.map_component_detector = map_component_detector()
-        self.map_legend_detector = map_legend_detector()
+    def __init__(self, ocr_mode=None, ocr_pack_size=None, ocr_max_workers=None):
+        self.ocr_mode = ocr_mode or common.ocr_mode
+        self.ocr_pack_size = ocr_pack_size or common.ocr_pack_size
+        self.ocr_max_workers = ocr_max_workers or common.max_workers
         #self.k2_knowledge_db = k2_knowledge_db()
-        self.rock_type_db = rock_type_and_age_db("type")
-        self.rock_age_db = rock_type_and_age_db("age")
 
-    def get_map_layout(self, map_image_path):
-        components = self.map_component_detector.detect(map_image_path)
+    # detectors and knowledge bases are loaded on first use.
+    @common.lazy_property
+    def map_component_detector(self):
+        return map_component_detector(backend=common.component_detector_backend)
+
+    @common.lazy_property
+    def map_legend_detector(self):
+        return map_legend_detector(backend=common.legend_detector_backend)
+
+    @common.lazy_property
+    def rock_type_db(self):
+        return rock_type_and_age_db("type")
+
+    @common.lazy_property
+    def rock_age_db(self):
+        return rock_type_and_age_db("age")
+
+    def warmup(self):
+        return self.map_component_detector, self.map_legend_detector, self.rock_type_db, self.rock_age_db
+
+    @tracing.traced("geologist.get_map_layout")
+    def get_map_layout(self, map_image):
+        # map_image is a path or a decoded BGR array.
+        with tracing.span("tool.map_component_detector", category="tool"):
+            components = self.map_component_detector.detect(vision.load_image(map_image))
         map_layout = {"regions": components}
         return map_layout
 
+    @tracing.traced("geologist.get_legend_metadata")
     def get_legend_metadata(self, legend_image_path, legend_bndbox):
-        legend_image = cv2.imread(legend_image_path)
-        legends = self.map_legend_detector.detect(legend_image_path)
+        legend_image = vision.load_image(legend_image_path)
+        with tracing.span("tool.map_legend_detector", category="tool"):
+            legends = self.map_legend_detector.detect(legend_image)
 
         # calculate text bndbox in legend.
         legend_units = legends.values()
@@ -47,7 +71,9 @@ class geologist_agent:
         legend_metadata = {"legend": legends}
         return legend_metadata
 
+    @tracing.traced("geologist.extract_legend_color")
     def extract_legend_color(self, image, legends):
+        colored = list()
         for legend in legends:
             bndbox = legend.get("color_bndbox", list())
             if len(bndbox) == 0 or not common.is_valid_bndbox(*bndbox, image.shape[1], image.shape[0]):
@@ -55,32 +81,85 @@ class geologist_agent:
                 legend["color_name"] = "White"
                 continue
             cropped_image = vision.crop_image(image, bndbox)
-            color = vision.calc_image_rgb(cropped_image)
+            color = vision.calc_image_rgb(cropped_image, common.legend_color_mode)
             legend["color"] = list(map(int, color))
-            legend["color_name"] = vision.rgb_to_color_name(color)
+            colored.append((legend, color))
+        # all legends of the map are named in one call.
+        if len(colored) > 0:
+            for (legend, _), color_name in zip(colored, vision.rgb_to_color_name([color for _, color in colored])):
+                legend["color_name"] = color_name
+
+    def polish_legend_text(self, text):
+        if text is not None:
+            text = str(text).split(":")[-1].split("：")[-1].strip().strip("-")
+        return text
 
+    def ocr_legend_unit(self, unit_image):
+        #text = vision.image_ocr(unit_image)
+        instructions = list()
+        instructions.append({"type": "image_url", "image_url": {"url": api.input_image_to_data_url(unit_image, is_bgr=True)}})
+        instructions.append({"type": "text", "text": "Only output the OCR result of the given image."})
+        messages = [
+            {"role": "system", "content": "You are an OCR expert."},
+            {"role": "user", "content": instructions},
+        ]
+        text = api.answer_wrapper(messages, structured=False, label="hie.legend_ocr")
+        return self.polish_legend_text(text)
+
+    def ocr_legend_units(self, unit_images):
+        # ocr of several legend units in one multi-image request.
+        instructions = list()
+        for i, unit_image in enumerate(unit_images):
+            instructions.append({"type": "text", "text": f"Image {i}:"})
+            instructions.append({"type": "image_url", "image_url": {"url": api.input_image_to_data_url(unit_image, is_bgr=True)}})
+        examples = {str(i): "XXX" for i in range(min(2, len(unit_images)))}
+        instructions.append({"type": "text", "text": f"Only output the OCR result of each given image in JSON format, the keys are the image indexes, for example: {json.dumps(examples)}"})
+        messages = [
+            {"role": "system", "content": "You are an OCR expert."},
+            {"role": "user", "content": instructions},
+        ]
+        answer = api.answer_wrapper(messages, structured=True, label="hie.legend_ocr_packed")
+        try:
+            texts = json.loads(answer)
+        except:
+            texts = dict()
+        if not isinstance(texts, dict):
+            texts = dict()
+
+        results = list()
+        for i, unit_image in enumerate(unit_images):
+            text = texts.get(str(i))
+            if not isinstance(text, str):
+                # fall back to a single request for units missing in the response or not answered with a text.
+                results.append(self.ocr_legend_unit(unit_image))
+            else:
+                results.append(self.polish_legend_text(text))
+        return results
+
+    @tracing.traced("geologist.extract_legend_text")
     def extract_legend_text(self, image, legends):
         h, w, _ = image.shape
+        units = list()
         for legend in legends:
             x0, y0, x1, y1 = legend["text_bndbox"]
             if not common.is_valid_bndbox(x0, y0, x1, y1, w, h):
                 legend["text"] = "unknown"
                 continue
-            unit_image = image[y0:y1, x0:x1]
-            unit_image_rgb = cv2.cvtColor(unit_image, cv2.COLOR_BGR2RGB)
-            #text = vision.image_ocr(unit_image)
-            instructions = list()
-            instructions.append({"type": "image_url", "image_url": {"url": api.input_image_to_data_url(unit_image_rgb)}})
-            instructions.append({"type": "text", "text": "Only output the OCR result of the given image."})
-            messages = [
-                {"role": "system", "content": "You are an OCR expert."},
-                {"role": "user", "content": instructions},
-            ]
-            text = api.answer_wrapper(messages, structured=False)
-            if text is not None:
-                text = text.split(":")[-1].split("：")[-1].strip().strip("-")
+            # BGR view of the map, encoded without a color conversion.
+            units.append((legend, image[y0:y1, x0:x1]))
+
+        # requests are sent concurrently, bounded by ocr_max_workers.
+        unit_images = [unit_image for _, unit_image in units]
+        if self.ocr_mode == "packed":
+            packs = [unit_images[i:i+self.ocr_pack_size] for i in range(0, len(unit_images), self.ocr_pack_size)]
+            texts = [text for pack_texts in scheduler.parallel_map(self.ocr_legend_units, packs, self.ocr_max_workers) for text in pack_texts]
+        else:
+            texts = scheduler.parallel_map(self.ocr_legend_unit, unit_images, self.ocr_max_workers)
+
+        for (legend, _), text in zip(units, texts):
             legend["text"] = text
     
+    @tracing.traced("geologist.get_knowledge")
     def get_knowledge(self, type, query):
         if type == geological_knwoledge_type.Rock_Type:
             rock_type = self.rock_type_db.get_rock_type_or_age(query)
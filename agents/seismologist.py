@@ -1,18 +1,29 @@
 import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}/..")
 import json
-from utils import api, prompt, vision, common
+from utils import api, prompt, vision, common, tracing
 from tool_pool import history_earthquake_db
 from tool_pool import active_fault_db
 
 class seismologist_agent:
-    def __init__(self):
-        self.active_fault_db = active_fault_db()
-        self.history_earthquake_db = history_earthquake_db()
+    # fault and earthquake databases are loaded on first use.
+    @common.lazy_property
+    def active_fault_db(self):
+        return active_fault_db()
 
+    @common.lazy_property
+    def history_earthquake_db(self):
+        return history_earthquake_db()
+
+    def warmup(self):
+        return self.active_fault_db, self.history_earthquake_db
+
+    @tracing.traced("seismologist.get_knowledge")
     def get_knowledge(self, min_lon, min_lat, max_lon, max_lat):
-        active_faults = self.active_fault_db.get_active_faults(min_lon, min_lat, max_lon, max_lat)
-        earthquake_history = self.history_earthquake_db.get_earthquake_history(min_lon, min_lat, max_lon, max_lat)
+        with tracing.span("tool.active_fault_db", category="tool"):
+            active_faults = self.active_fault_db.get_active_faults(min_lon, min_lat, max_lon, max_lat)
+        with tracing.span("tool.history_earthquake_db", category="tool"):
+            earthquake_history = self.history_earthquake_db.get_earthquake_history(min_lon, min_lat, max_lon, max_lat)
         seismic_data = {
             "active_faults": active_faults,
             "earthquake_history": earthquake_history,
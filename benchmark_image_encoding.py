@@ -0,0 +1,77 @@
+"""
+图像编码微基准：旧的 PIL 路径 (BGR->RGB, PIL PNG, BytesIO, base64) 对比 cv2.imencode 共享编码器
+使用方法:
+    python benchmark_image_encoding.py                       # 合成的图例单元与主图裁剪
+    python benchmark_image_encoding.py --image map.jpg       # 使用真实地质图
+"""
+import os
+import sys
+import time
+import base64
+import argparse
+from io import BytesIO
+import numpy as np
+import cv2
+from PIL import Image
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import vision
+
+def pil_data_url(image_bgr):
+    # the path replaced in api.input_image_to_data_url.
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    buffered = BytesIO()
+    Image.fromarray(image_rgb).save(buffered, format="PNG")
+    return f"data:image/png;base64,{base64.b64encode(buffered.getvalue()).decode('utf-8')}"
+
+def synthetic_map(height, width, seed=0):
+    # flat colored polygons, lines and text, compresses like a scanned map rather than like noise.
+    rng = np.random.default_rng(seed)
+    image = np.full((height, width, 3), 245, dtype=np.uint8)
+    for _ in range(max(1, height * width // 40000)):
+        points = rng.integers(0, (width, height), size=(6, 2)).astype(np.int32)
+        cv2.fillPoly(image, [cv2.convexHull(points)], tuple(int(c) for c in rng.integers(40, 250, 3)))
+    for _ in range(max(1, height * width // 200000)):
+        x0, y0, x1, y1 = (int(v) for v in rng.integers(0, (width, height, width, height)))
+        cv2.line(image, (x0, y0), (x1, y1), (0, 0, 0), 2)
+    for y in range(20, height, 60):
+        cv2.putText(image, "Qp3 al-pl gravel sand", (10, y), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (20, 20, 20), 1)
+    return image
+
+def measure(func, image, repeat):
+    func(image)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        url = func(image)
+    return (time.perf_counter() - start) / repeat * 1000, len(url)
+
+def cold_encode(image):
+    vision.encoded_urls.urls.clear()
+    vision.encoded_urls.size = 0
+    return vision.encode_data_url(image)
+
+def main():
+    parser = argparse.ArgumentParser(description="Image encoding micro-benchmark")
+    parser.add_argument("--image", type=str, default="", help="Geologic map to crop from, synthetic when empty")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    image = cv2.imread(args.image) if args.image else synthetic_map(6000, 8000)
+    height, width = image.shape[:2]
+    crops = {
+        # views of the map, as cut by the pipeline.
+        "legend_unit (60x300)": image[height // 2:height // 2 + 60, width // 2:width // 2 + 300],
+        "legend (1500x800)": image[:1500, width - 800:],
+        "main_map (4000x5000)": image[:4000, :5000],
+    }
+    print(f"{'crop':<24}{'pil_ms':>10}{'cv2_ms':>10}{'cached_ms':>11}{'speedup':>9}{'pil_kb':>9}{'cv2_kb':>9}")
+    for name, crop in crops.items():
+        repeat = args.repeat if crop.size < 10_000_000 else max(1, args.repeat // 10)
+        pil_ms, pil_size = measure(pil_data_url, crop, repeat)
+        cv2_ms, cv2_size = measure(cold_encode, crop, repeat)
+        cached_ms, _ = measure(vision.encode_data_url, crop, repeat)
+        print(f"{name:<24}{pil_ms:>10.2f}{cv2_ms:>10.2f}{cached_ms:>11.2f}{pil_ms / cv2_ms:>9.2f}{pil_size / 1024:>9.0f}{cv2_size / 1024:>9.0f}")
+
+
+if __name__ == "__main__":
+    main()
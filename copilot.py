@@ -1,41 +1,65 @@
 import os
+import copy
 import json
-from utils import api, prompt, vision, common
+import time
+import logging
+import threading
+import contextlib
+import collections
+from utils import api, prompt, vision, common, scheduler, metrics, tracing
 from modules import hierarchical_information_extraction, domain_knowledge_injection, prompt_enhanced_QA
 
-hie = hierarchical_information_extraction()
-dki = domain_knowledge_injection()
-peqa = prompt_enhanced_QA()
+# Modules are built on first use, warmup() builds them ahead of time, e.g. in the background at GUI startup.
+module_factories = {
+    "hie": hierarchical_information_extraction,
+    "dki": domain_knowledge_injection,
+    "peqa": prompt_enhanced_QA,
+}
+module_instances = dict()
+module_locks = {name: threading.Lock() for name in module_factories}
 
-def copilot(image_path, question, question_type, copilot_modes=["HIE", "DKI", "PEQA"], progress_callback=None):
-    # Content filter.
-    if common.rai_filter(question):# debug
-        return "I can't help you with that."
+def get_module(name):
+    if name not in module_instances:
+        with module_locks[name]:
+            if name not in module_instances:
+                module_instances[name] = module_factories[name]()
+    return module_instances[name]
 
-    # Hierarchical information extraction module.
-    if "HIE" in copilot_modes:
-        if progress_callback:
-            progress_callback("📊 [HIE] 开始加载图像文件...")
-        information = hie.digitalize(image_path, progress_callback)
-    else:
-        information = None
+def get_hie():
+    return get_module("hie")
 
-    # Domain knowledge injection module.
-    if "DKI" in copilot_modes:
-        if progress_callback:
-            progress_callback("🧠 [DKI] 开始分析问题并匹配知识...")
-        knowledge = dki.consult(question, information, progress_callback)
-    else:
-        knowledge = None
+def get_dki():
+    return get_module("dki")
 
-    # Prompt-enhanced QA module.
-    if "PEQA" in copilot_modes:
-        if progress_callback:
-            progress_callback("🤖 [PEQA] 开始构建提示词并调用模型...")
-        answer = peqa.answer(information, knowledge, True, image_path, question, question_type, progress_callback)
-    else:
-        answer = peqa.answer(information, knowledge, False, image_path, question, question_type, progress_callback)
+def get_peqa():
+    return get_module("peqa")
+
+def __getattr__(name):
+    # copilot.hie, copilot.dki and copilot.peqa keep working.
+    if name in module_factories:
+        return get_module(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def warmup(copilot_modes=["HIE", "DKI", "PEQA"], background=True):
+    # Build the modules and load their models and knowledge bases,
+    # with background=True in a daemon thread that is returned.
+    def load():
+        for mode in copilot_modes:
+            try:
+                with tracing.span(f"warmup.{mode}"):
+                    get_module(mode.lower()).warmup()
+            except Exception as e:
+                logging.warning(f"{type(e).__name__}: {e}. Warmup of {mode} failed...")
+    if background:
+        thread = threading.Thread(target=load, name="warmup", daemon=True)
+        thread.start()
+        return thread
+    load()
+    return None
+
+refusal = "I can't help you with that."
 
+def finalize_answer(answer, question_type, knowledge):
     try:
         answer = json.loads(answer)
         final_answer = prompt.get_final_answer(answer, question_type)
@@ -49,6 +73,140 @@ def copilot(image_path, question, question_type, copilot_modes=["HIE", "DKI", "P
         print("======================================================")
     return final_answer
 
+def trace_session(name):
+    # One trace session per request when PEACE_TRACE is set, unless the caller already opened one.
+    if not common.trace_folder or tracing.current_session.get() is not None:
+        return None
+    return tracing.session(name)
+
+def save_trace(session):
+    trace_path = os.path.join(common.trace_folder, f"{session.name}_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    session.save(trace_path)
+    logging.info(f"Trace saved to {trace_path}:\n{session.format_timings()}")
+    if common.echo:
+        print(session.format_timings())
+
+def copilot(image_path, question, question_type, copilot_modes=["HIE", "DKI", "PEQA"], progress_callback=None, return_metrics=False, stream=False):
+    # With return_metrics=True the answer is returned together with the latency and token summary of the request.
+    # With stream=True the partial answers are sent to progress_callback (prefixed with common.partial_answer_prefix).
+    session = trace_session(common.path2name(image_path))
+    with metrics.collect() as collector, session or contextlib.nullcontext():
+        with tracing.span("copilot", image=common.path2name(image_path), question_type=question_type):
+            answer = run_copilot(image_path, question, question_type, copilot_modes, progress_callback, stream)
+    if session is not None:
+        save_trace(session)
+    summary = collector.summary()
+    # process-wide rate limiter, endpoint and cache stats so far.
+    summary["components"] = metrics.components_summary()
+    logging.info(f"copilot metrics of {common.path2name(image_path)}:\n{metrics.format_summary(summary)}")
+    if common.echo:
+        print(metrics.format_summary(summary))
+    return (answer, summary) if return_metrics else answer
+
+def run_copilot(image_path, question, question_type, copilot_modes, progress_callback, stream=False):
+    # Stages run as soon as their inputs are ready: the content filter, HIE and PEQA component
+    # selection do not depend on each other, DKI waits for HIE and the final answer waits for all.
+    def digitalize():
+        # Hierarchical information extraction module.
+        if "HIE" not in copilot_modes:
+            return None
+        if progress_callback:
+            progress_callback("📊 [HIE] 开始加载图像文件...")
+        # a rejected question stops HIE between its model calls, it does not write the meta of the map.
+        return get_hie().digitalize(image_path, progress_callback, pipeline.cancelled)
+
+    def select_components():
+        if "PEQA" not in copilot_modes:
+            return None
+        return get_peqa().select(question, question_type)
+
+    def consult(rejected, information):
+        # Domain knowledge injection module.
+        if "DKI" not in copilot_modes:
+            return None
+        if progress_callback:
+            progress_callback("🧠 [DKI] 开始分析问题并匹配知识...")
+        return get_dki().consult(question, information, progress_callback)
+
+    def answer(rejected, information, knowledge, selected_components):
+        # Prompt-enhanced QA module.
+        if "PEQA" in copilot_modes:
+            if progress_callback:
+                progress_callback("🤖 [PEQA] 开始构建提示词并调用模型...")
+            return get_peqa().answer(information, knowledge, True, image_path, question, question_type, progress_callback, selected_components, stream)
+        else:
+            return get_peqa().answer(information, knowledge, False, image_path, question, question_type, progress_callback, stream=stream)
+
+    pipeline = scheduler.stage_scheduler()
+    # Content filter, a rejected question cancels DKI and PEQA.
+    pipeline.add_stage("rai", lambda: common.rai_filter(question), stop_if=lambda rejected: rejected)
+    pipeline.add_stage("hie", digitalize)
+    pipeline.add_stage("components", select_components)
+    pipeline.add_stage("dki", consult, deps=("rai", "hie"))
+    pipeline.add_stage("peqa", answer, deps=("rai", "hie", "dki", "components"))
+    results = pipeline.run()
+    if pipeline.stopped_by == "rai":# debug
+        return refusal
+
+    return finalize_answer(results["peqa"], question_type, results["dki"])
+
+def copilot_batch(queries, copilot_modes=["HIE", "DKI", "PEQA"], progress_callback=None, answer_callback=None):
+    # queries: list of (image_path, question, question_type), answers keep the same order.
+    # answer_callback(i, answer) is called once per query when it is done, answer is None when it failed.
+    session = trace_session("batch")
+    with session or contextlib.nullcontext():
+        answers = run_copilot_batch(queries, copilot_modes, progress_callback, answer_callback)
+    if session is not None:
+        save_trace(session)
+    return answers
+
+def run_copilot_batch(queries, copilot_modes, progress_callback, answer_callback=None):
+    # Each map is digitalized and its knowledge fetched once, then shared by all of its questions.
+    queries = list(queries)
+    answers = [None] * len(queries)
+    image2queries = collections.OrderedDict()
+    for i, (image_path, question, question_type) in enumerate(queries):
+        image2queries.setdefault(image_path, list()).append((i, question, question_type))
+
+    rai_results = dict()
+    for image_path, image_queries in image2queries.items():
+        if progress_callback:
+            progress_callback(f"📚 [Batch] 处理地图 {common.path2name(image_path)}，共 {len(image_queries)} 个问题")
+
+        try:
+            # Hierarchical information extraction module, once per map.
+            information = get_hie().digitalize(image_path, progress_callback) if "HIE" in copilot_modes else None
+            # Domain knowledge injection module, knowledge fetched once per map.
+            knowledge = get_dki().fetch(information, progress_callback) if "DKI" in copilot_modes else None
+        except Exception as e:
+            logging.warning(f"{type(e).__name__}: {e}. Skipping {image_path}...")
+            if answer_callback:
+                for i, _, _ in image_queries:
+                    answer_callback(i, None)
+            continue
+
+        for i, question, question_type in image_queries:
+            try:
+                with tracing.span("copilot", image=common.path2name(image_path), question_type=question_type):
+                    # Content filter, identical questions are only checked once.
+                    if question not in rai_results:
+                        rai_results[question] = common.rai_filter(question)
+                    if rai_results[question]:
+                        answers[i] = refusal
+                        continue
+
+                    selected_knowledge = get_dki().select(question, knowledge) if knowledge is not None else None
+
+                    # Prompt-enhanced QA module, PEQA polishes the information in place.
+                    answer = get_peqa().answer(copy.deepcopy(information), selected_knowledge, "PEQA" in copilot_modes, image_path, question, question_type, progress_callback)
+                    answers[i] = finalize_answer(answer, question_type, selected_knowledge)
+            except Exception as e:
+                logging.warning(f"{type(e).__name__}: {e}. Skipping question {i}...")
+            finally:
+                if answer_callback:
+                    answer_callback(i, answers[i])
+    return answers
+
 
 if __name__ == "__main__":
     image_path = "images/sample_usgs.jpg"
@@ -47,7 +47,7 @@ from ultralytics.utils import DEFAULT_CFG, LOGGER, MACOS, WINDOWS, callbacks, co
 from ultralytics.utils.checks import check_imgsz, check_imshow
 from ultralytics.utils.files import increment_path
 from ultralytics.utils.torch_utils import select_device, smart_inference_mode
-from ultralytics.engine.results import Results
+from ultralytics.engine.results import Results, detection_keys
 
 STREAM_WARNING = """
 WARNING ⚠️ inference results will accumulate in RAM unless `stream=True` is passed, causing potential out-of-memory
@@ -61,76 +61,6 @@ Example:
         probs = r.probs  # Class probabilities for classification outputs
 """
 
-def calculate_area(box):
-    x_min, y_min, x_max, y_max = box
-    return (x_max - x_min) * (y_max - y_min)
-
-def calculate_intersection_area(box1, box2):
-    x_min1, y_min1, x_max1, y_max1 = box1
-    x_min2, y_min2, x_max2, y_max2 = box2
-
-    x_min_inter = max(x_min1, x_min2)
-    y_min_inter = max(y_min1, y_min2)
-    x_max_inter = min(x_max1, x_max2)
-    y_max_inter = min(y_max1, y_max2)
-
-    if x_min_inter < x_max_inter and y_min_inter < y_max_inter:
-        return calculate_area([x_min_inter, y_min_inter, x_max_inter, y_max_inter])
-    return 0
-
-def process_boxes(result):
-    cls = result.boxes.cls
-    xyxy = result.boxes.xyxy
-    xywh = result.boxes.xywh
-    xywhn = result.boxes.xywhn
-    xyxyn = result.boxes.xyxyn
-
-    # Step 1: Filter class 2 boxes
-    class_2_indices = (cls == 2).nonzero(as_tuple=True)[0]
-    class_2_boxes = xyxy[class_2_indices]
-    class_2_xywh = xywh[class_2_indices]
-    class_2_xywhn = xywhn[class_2_indices]
-    class_2_xyxyn = xyxyn[class_2_indices]
-
-    if len(class_2_boxes) < 2:
-        # If there are less than 2 boxes, no filtering is needed
-        return result
-
-    # Filter class 1 boxes
-    class_1_indices = (cls == 1).nonzero(as_tuple=True)[0]
-    class_1_boxes = xyxy[class_1_indices]
-
-    # Step 2: Calculate intersection areas
-    intersection_areas = []
-    for box in class_2_boxes:
-        areas = [calculate_intersection_area(box, b) for b in class_1_boxes]
-        intersection_areas.append(max(areas, default=0))
-
-    min_intersection_index = torch.argmin(torch.tensor(intersection_areas))
-    min_intersection_area = intersection_areas[min_intersection_index]
-
-    if min_intersection_area > 0:
-        # If there is an intersection, keep the box with the smallest intersection
-        selected_index = min_intersection_index
-    else:
-        # If there is no intersection, keep the box with the largest area
-        areas = [calculate_area(box) for box in class_2_boxes]
-        selected_index = torch.argmax(torch.tensor(areas))
-
-    # Create new tensors with the selected class 2 box
-    result.cls = cls[selected_index].unsqueeze(0)
- 
-    result.boxes.xyxy = class_2_boxes[selected_index].unsqueeze(0)
-    result.boxes.xywh = class_2_xywh[selected_index].unsqueeze(0)
-    result.boxes.xywhn = class_2_xywhn[selected_index].unsqueeze(0)
-    result.boxes.xyxyn = class_2_xyxyn[selected_index].unsqueeze(0)
-
-    result.boxes.data = result.boxes.data[selected_index].unsqueeze(0)
-    result.boxes.conf = result.boxes.conf[selected_index].unsqueeze(0)
-    # Create a new Result object with updated data
-    
-    return result
-
 class BasePredictor:
     """
     BasePredictor.
@@ -405,7 +335,6 @@ class BasePredictor:
         string += "%gx%g " % im.shape[2:]
         result = self.results[i]
         #pdb.set_trace()
-        #result = process_boxes(self.results[i])
         #pdb.set_trace()
         result.save_dir = self.save_dir.__str__()  # used in other locations
         string += result.verbose() + f"{result.speed['inference']:.1f}ms"
@@ -420,8 +349,8 @@ class BasePredictor:
                 im_gpu=None if self.args.retina_masks else im[i],
             )
 
-        # Save results
-        det_result = result.save_txt(f"{self.txt_path}.json", save_conf=self.args.save_conf)
+        # Structured regions or legends, built from the box tensors.
+        det_result = self.structure(result)
         return det_result
         if self.args.save_txt:
             result.save_txt(f"{self.txt_path}.json", save_conf=self.args.save_conf)
@@ -434,6 +363,10 @@ class BasePredictor:
 
         return string
 
+    def structure(self, result):
+        """Regions or legends of a result, keyed by the classes of the model (see Results.to_structure)."""
+        return result.to_structure(detection_keys(self.model.names))
+
     def save_predicted_images(self, save_path="", frame=0):
         """Save video predictions as mp4 at specified path."""
         im = self.plotted_img
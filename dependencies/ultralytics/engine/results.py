@@ -15,25 +15,11 @@ import os
 from functools import cmp_to_key
 
 from ultralytics.data.augment import LetterBox
+from ultralytics.engine.structure import region_keys, legend_keys, detection_keys, group_boxes
 from ultralytics.utils import LOGGER, SimpleClass, ops
 from ultralytics.utils.plotting import Annotator, colors, save_one_box
 from ultralytics.utils.torch_utils import smart_inference_mode
 
-region_keys = {
-    0: "title", 
-    1: "main_map", 
-    2: "legend", 
-    3: "scale", 
-    4: "index_map", 
-    5: "cross_section", 
-    6: "stratigraphic_column", 
-    7: "others",
-}
-
-legend_keys = {
-    0: 'color_bndbox',
-    1: 'text_bndbox',
-}
 
 class BaseTensor(SimpleClass):
     """Base tensor class with additional methods for easy manipulation and device handling."""
@@ -344,6 +330,18 @@ class Results(SimpleClass):
                 log_string += f"{n} {self.names[int(c)]}{'s' * (n > 1)}, "
         return log_string
 
+    def to_structure(self, keys):
+        """
+        Group the detected boxes by class, straight from the box tensors.
+
+        Args:
+            keys (dict): class index to output key, region_keys or legend_keys (see detection_keys).
+
+        Returns:
+            (dict): {key: [[x1, y1, x2, y2], ...]} in pixels of the original image, in detection order.
+        """
+        return group_boxes(self.boxes, keys)
+
     def save_txt(self, txt_file, save_conf=False):
         """
         Save predictions into txt file.
@@ -0,0 +1,62 @@
+import numpy as np
+
+# 版面检测模型的类别，与 cfg/datasets/dcc.yaml 一致
+region_keys = {
+    0: "title",
+    1: "main_map",
+    2: "legend",
+    3: "scale",
+    4: "index_map",
+    5: "cross_section",
+    6: "stratigraphic_column",
+    7: "others",
+}
+
+# 图例检测模型的类别: 0 为颜色块，1 为图例文字
+legend_keys = {
+    0: "color_bndbox",
+    1: "text_bndbox",
+}
+
+
+def detection_keys(names):
+    """
+    Output keys of a PEACE detection model, read from the class names in its metadata.
+
+    Args:
+        names (dict): class index to class name, model.names.
+
+    Returns:
+        (dict): region_keys for the layout model, legend_keys for the legend model, whose two classes are the color
+            swatch and the text of a legend (e.g. color_bndbox, text_bndbox).
+    """
+    labels = [str(names[i]).lower() for i in sorted(names)]
+    if labels == list(region_keys.values()):
+        return region_keys
+    if len(labels) == len(legend_keys) and "color" in labels[0] and "text" in labels[1]:
+        return legend_keys
+    raise ValueError(f"Unknown classes {names}, expected the layout classes {region_keys} or the legend classes {legend_keys}")
+
+
+def group_boxes(boxes, keys):
+    """
+    Group the detected boxes by class, in one numpy pass.
+
+    Args:
+        boxes (Boxes | None): detections with xyxy and cls tensors.
+        keys (dict): class index to output key, region_keys or legend_keys.
+
+    Returns:
+        (dict): {key: [[x1, y1, x2, y2], ...]} in pixels of the original image, in detection order. Boxes without area
+            are dropped and coordinates truncated to integers, like the former save_txt parsing.
+    """
+    structure = {key: [] for key in keys.values()}
+    if boxes is None or len(boxes) == 0:
+        return structure
+    xyxy = boxes.xyxy.cpu().numpy()
+    cls = boxes.cls.cpu().numpy().astype(int)
+    valid = (xyxy[:, 0] < xyxy[:, 2]) & (xyxy[:, 1] < xyxy[:, 3])
+    xyxy = xyxy.astype(int)
+    for index, key in keys.items():
+        structure[key] = xyxy[valid & (cls == index)].tolist()
+    return structure
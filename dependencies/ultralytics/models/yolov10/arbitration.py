@@ -0,0 +1,66 @@
+import torch
+
+# 这些类别的框全部保留，不参与仲裁
+KEEP_ALL_CLASSES = (4, 5, 6, 7)
+
+
+def box_iou(boxes1, boxes2):
+    """IoU matrix of two sets of xyxy boxes, the same arithmetic as torchvision.ops.box_iou."""
+    area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+    area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+    lt = torch.max(boxes1[:, None, :2], boxes2[:, :2])
+    rb = torch.min(boxes1[:, None, 2:], boxes2[:, 2:])
+    wh = (rb - lt).clamp(min=0)
+    inter = wh[:, :, 0] * wh[:, :, 1]
+    union = area1[:, None] + area2 - inter
+    return inter / union
+
+
+def process_boxes(pred):
+    """
+    Class-wise box arbitration of one image in a single pass.
+
+    For every class outside KEEP_ALL_CLASSES one box is kept: the box whose smallest IoU with the boxes of the other
+    classes is the lowest, or the largest box when no other class was detected. Ties go to the first box, boxes with
+    the same class and coordinates as a kept box are kept too, all boxes of KEEP_ALL_CLASSES are kept. A NaN IoU
+    (a zero-area box against another one) counts as the lowest, as it did with torch.argmin.
+
+    Args:
+        pred (torch.Tensor): (N, 6) detections, xyxy, conf, cls.
+
+    Returns:
+        (torch.Tensor): the kept rows of pred, on the CPU and in their original order.
+    """
+    pred = pred.cpu()
+    cls = pred[:, -1]
+    keep_all = torch.isin(cls, torch.tensor(KEEP_ALL_CLASSES, dtype=cls.dtype))
+    arbitrated = ~keep_all
+    if not arbitrated.any():
+        # 没有需要仲裁的类别，返回原始的pred
+        return pred
+
+    boxes = pred[:, :4]
+    n = pred.shape[0]
+    labels = cls.long()
+    num_classes = int(labels.max()) + 1
+    if len(cls.unique()) > 1:
+        # 每个框与其他类别框的最小IoU，取最小者
+        ious = box_iou(boxes, boxes)
+        ious = ious.masked_fill(labels[:, None] == labels[None, :], float("inf"))
+        scores = ious.min(dim=1).values
+        # 零面积框与其他零面积框的IoU为NaN，与torch.argmin一样视为最小
+        scores = torch.where(scores.isnan(), torch.full_like(scores, float("-inf")), scores)
+    else:
+        # 只有一个类别，取面积最大者
+        scores = -(boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    best_scores = torch.full((num_classes,), float("inf"), dtype=scores.dtype)
+    best_scores = best_scores.scatter_reduce(0, labels[arbitrated], scores[arbitrated], reduce="amin")
+    candidates = arbitrated & (scores == best_scores[labels])
+    index = torch.where(candidates, torch.arange(n), torch.full((n,), n))
+    first = torch.full((num_classes,), n, dtype=torch.long).scatter_reduce(0, labels, index, reduce="amin")
+
+    # the first best box of each class and its exact duplicates.
+    selected = first[labels].clamp(max=n - 1)
+    keep_mask = arbitrated & (first[labels] < n) & (boxes == boxes[selected]).all(dim=1)
+    return pred[keep_mask | keep_all]
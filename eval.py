@@ -2,8 +2,8 @@ import os
 import argparse
 import pandas as pd
 from tqdm import tqdm
-from copilot import copilot
-from utils import prompt, common
+from copilot import copilot_batch
+from utils import prompt, common, metrics
 
 def eval_copilot(args, image_folder, q_path, qa_path, overwrite=False):
     # load data.
@@ -13,25 +13,30 @@ def eval_copilot(args, image_folder, q_path, qa_path, overwrite=False):
     if "model_answer" not in bench_qa.columns:
         bench_qa["model_answer"] = ""
 
-    # answer question.
-    for i, meta in tqdm(bench_qa.iterrows(), total=len(bench_qa)):
+    # answer question, questions of the same map share one digitalization.
+    queries = list()
+    for i, meta in bench_qa.iterrows():
         image_path = os.path.join(image_folder, os.path.basename(meta["img_path"]))
         question = meta["question"]
         question = prompt.remove_format_requirement(question)
         question = prompt.format_question(question, meta)
         question_type = meta["type"]
-        
-        try:
-            model_answer = copilot(image_path, question, question_type, args.copilot_mode.split(","))
-        except:
-            model_answer = ""
-        bench_qa.loc[i, "model_answer"] = model_answer
+        queries.append((image_path, question, question_type))
+
+    # the bar advances as questions are answered, maps are digitalized once in between.
+    with tqdm(total=len(queries)) as progress:
+        model_answers = copilot_batch(queries, args.copilot_mode.split(","), answer_callback=lambda i, answer: progress.update(1))
+    for i, model_answer in enumerate(model_answers):
+        bench_qa.loc[i, "model_answer"] = model_answer if model_answer is not None else ""
 
     # save model answer.
     new_order = ["img_path", "type", "question", "answer", "model_answer", "mcq", "A", "B", "C", "D"]
     bench_qa = bench_qa[new_order]
     bench_qa.to_csv(qa_path, index=False)
 
+    # latency and token usage per stage of the whole run.
+    print(metrics.format_summary(metrics.process_summary()))
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="GeoMap-Agent: evaluation script")
@@ -0,0 +1,78 @@
+"""
+将版面检测 (det_component) 与图例检测 (det_legend) 模型导出为 ONNX / OpenVINO，用于纯CPU推理
+YOLOv10 的 one2one 头端到端输出 (B, 300, 6)，不需要 NMS，导出后仍由 YOLOv10DetectionPredictor 后处理
+使用方法:
+    python export_detectors.py                                  # 导出 onnx 与 openvino
+    python export_detectors.py --formats onnx --check map.jpg   # 导出并与 PyTorch 对比框与耗时
+导出的模型写在权重旁 (best.onnx, best_openvino_model/)，PEACE_DETECTOR_BACKEND=auto 时自动加载
+"""
+import os
+import time
+import argparse
+import cv2
+
+from tool_pool.detector_backend import exported_path
+from tool_pool.map_component_detector import map_component_detector
+from tool_pool.map_legend_detector import map_legend_detector
+
+models = {
+    "det_component": "./dependencies/models/det_component/weights/best.pt",
+    "det_legend": "./dependencies/models/det_legend/weights/best.pt",
+}
+detectors = {
+    "det_component": map_component_detector,
+    "det_legend": map_legend_detector,
+}
+
+def export(model_path, backend, half=False, simplify=True):
+    # dynamic batch, so detect_batch can send several maps per inference.
+    from dependencies.ultralytics import YOLOv10
+    model = YOLOv10(model_path)
+    if backend == "onnx":
+        path = model.export(format="onnx", dynamic=True, simplify=simplify, half=half, device="cpu")
+    else:
+        path = model.export(format="openvino", dynamic=True, half=half, device="cpu")
+    assert os.path.normpath(path) == os.path.normpath(exported_path(model_path, backend)), path
+    return path
+
+def timed_detect(detector, image, runs):
+    detector.detect(image)  # warmup
+    start = time.perf_counter()
+    for _ in range(runs):
+        result = detector.detect(image)
+    return result, (time.perf_counter() - start) / runs
+
+def result_boxes(result):
+    # (key, box) of every detection: regions are {key: [box, ...]}, legends {idx: {"color_bndbox": box, "text_bndbox": box, ...}}.
+    boxes = list()
+    for key, value in result.items():
+        if isinstance(value, dict):
+            boxes += [(f"{key}.{k}", tuple(value[k])) for k in ("color_bndbox", "text_bndbox")]
+        else:
+            boxes += [(key, tuple(box)) for box in value]
+    return sorted(boxes)
+
+def check(name, backend, image_path, runs):
+    image = cv2.imread(image_path)
+    reference, reference_time = timed_detect(detectors[name](models[name], backend="pytorch"), image, runs)
+    result, backend_time = timed_detect(detectors[name](models[name], backend=backend), image, runs)
+    same = result_boxes(reference) == result_boxes(result)
+    print(f"{name:<14}{backend:<10}pytorch {reference_time * 1000:8.1f} ms  {backend} {backend_time * 1000:8.1f} ms  same boxes: {same}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the map detectors for CPU inference")
+    parser.add_argument("--models", type=str, nargs="+", default=list(models), choices=list(models))
+    parser.add_argument("--formats", type=str, nargs="+", default=["onnx", "openvino"], choices=["onnx", "openvino"])
+    parser.add_argument("--half", action="store_true", help="FP16 weights (OpenVINO only benefits on supported CPUs)")
+    parser.add_argument("--check", type=str, default="", help="Map image to compare boxes and latency against PyTorch")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    for name in args.models:
+        for backend in args.formats:
+            print(f"{name}: {export(models[name], backend, half=args.half)}")
+    if args.check:
+        for name in args.models:
+            for backend in args.formats:
+                check(name, backend, args.check, args.runs)
@@ -79,6 +79,7 @@ class ProcessingThread(QThread):
     """处理线程，用于在后台执行地质图分析"""
     progress_signal = pyqtSignal(str)
     result_signal = pyqtSignal(str)
+    partial_signal = pyqtSignal(str)
     error_signal = pyqtSignal(str)
     
     def __init__(self, image_path, question, question_type, copilot_modes):
@@ -95,10 +96,14 @@ class ProcessingThread(QThread):
             # 延迟导入copilot以避免启动时的依赖问题
             try:
                 from copilot import copilot
+                from utils import common, prompt
                 
-                # 定义进度回调函数
+                # 定义进度回调函数，流式输出的部分回答单独显示
                 def progress_callback(message):
-                    self.progress_signal.emit(message)
+                    if message.startswith(common.partial_answer_prefix):
+                        self.partial_signal.emit(prompt.get_partial_answer(message[len(common.partial_answer_prefix):]))
+                    else:
+                        self.progress_signal.emit(message)
                 
                 self.progress_signal.emit("🎯 正在调用分析引擎...")
                 answer = copilot(
@@ -106,7 +111,8 @@ class ProcessingThread(QThread):
                     self.question, 
                     self.question_type, 
                     self.copilot_modes,
-                    progress_callback
+                    progress_callback,
+                    stream=True,
                 )
                 self.progress_signal.emit("🎉 分析完成！结果已生成")
                 self.result_signal.emit(str(answer))
@@ -181,6 +187,7 @@ class GeoMapAnalyzerGUI(QMainWindow):
         
         self.current_image_path = ""
         self.setup_ui()
+        self.start_warmup()
         
     def setup_ui(self):
         """设置用户界面"""
@@ -585,6 +592,18 @@ class GeoMapAnalyzerGUI(QMainWindow):
             self.api_status_label.setText("🔑 API状态: 未配置")
             self.api_status_label.setStyleSheet("QLabel { font-size: 11px; color: #dc3545; }")
     
+    def start_warmup(self):
+        """后台预加载检测模型和知识库，界面启动不再等待"""
+        import threading
+        def warmup():
+            try:
+                import copilot
+                # PEQA的组件关系可能需要调用模型，首次分析时再加载
+                copilot.warmup(["HIE", "DKI"], background=False)
+            except Exception as e:
+                print(f"预加载失败: {str(e)}")
+        threading.Thread(target=warmup, name="warmup", daemon=True).start()
+    
     def check_api_config(self):
         """检查API配置"""
         settings = QSettings("PEACE", "APIConfig")
@@ -706,6 +725,7 @@ class GeoMapAnalyzerGUI(QMainWindow):
         # 连接信号
         self.processing_thread.progress_signal.connect(self.update_progress)
         self.processing_thread.result_signal.connect(self.show_result)
+        self.processing_thread.partial_signal.connect(self.show_partial_result)
         self.processing_thread.error_signal.connect(self.show_error)
         
         # 开始处理
@@ -863,6 +883,11 @@ class GeoMapAnalyzerGUI(QMainWindow):
             }
         """)
     
+    def show_partial_result(self, text):
+        """逐步显示正在生成的回答"""
+        self.result_display.setPlainText(text)
+        self.result_display.moveCursor(QTextCursor.MoveOperation.End)
+    
     def show_result(self, result):
         """显示分析结果"""
         formatted_result = self.format_result_display(result)
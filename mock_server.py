@@ -0,0 +1,256 @@
+"""
+OpenAI兼容的本地模拟服务 (chat completions)，用于离线压测和性能分析
+使用方法:
+    python mock_server.py --cassette .cache/cassette.json --port 8765
+    export PEACE_API_BASE_URL=http://127.0.0.1:8765/v1
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from cache import request_key
+
+default_upstream = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+
+class cassette:
+    # Recorded responses keyed by the same request hash as the response cache.
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.interactions = dict()
+        if path and os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                self.interactions = json.loads(f.read()).get("interactions", dict())
+
+    def get(self, key):
+        interaction = self.interactions.get(key)
+        return None if interaction is None else interaction["response"]
+
+    def put(self, key, body, response):
+        with self.lock:
+            self.interactions[key] = {
+                "request": {"model": body.get("model"), "max_tokens": body.get("max_tokens"), "temperature": body.get("temperature")},
+                "response": response,
+            }
+            if self.path:
+                folder = os.path.dirname(self.path)
+                if folder:
+                    os.makedirs(folder, exist_ok=True)
+                with open(self.path + ".tmp", "w", encoding="utf-8") as f:
+                    f.write(json.dumps({"version": 1, "interactions": self.interactions}, indent=4, ensure_ascii=False))
+                os.replace(self.path + ".tmp", self.path)
+
+def body_key(body):
+    # Streamed and non-streamed requests share recordings.
+    structured = body.get("response_format", dict()).get("type") == "json_object"
+    return request_key(body.get("model"), body.get("messages"), body.get("max_tokens"), body.get("temperature"), structured, body.get("tools"))
+
+def completion(body, content, finish_reason="stop"):
+    return {
+        "id": f"chatcmpl-mock-{uuid.uuid4().hex[:12]}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "mock"),
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": finish_reason}],
+        "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4},
+    }
+
+def synthetic_answer(body):
+    # Deterministic answer for requests missing in the cassette.
+    if body.get("response_format", dict()).get("type") == "json_object":
+        return json.dumps({"answer": "mock", "reason": "mock response"})
+    return "mock"
+
+class mock_handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.options.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, status, payload, headers=None):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or dict()).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_stream(self, body, response):
+        # Server-sent events in the chat.completion.chunk format, the connection closes at the end.
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        content = response["choices"][0]["message"]["content"] or ""
+        size = self.server.options.chunk_size
+        pieces = [content[i:i+size] for i in range(0, len(content), size)] or [""]
+        for i, piece in enumerate(pieces):
+            finish_reason = response["choices"][0]["finish_reason"] if i == len(pieces) - 1 else None
+            chunk = {
+                "id": response["id"], "object": "chat.completion.chunk", "created": response["created"], "model": response["model"],
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": piece}, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+            time.sleep(self.server.options.chunk_delay)
+        if body.get("stream_options", dict()).get("include_usage"):
+            chunk = {"id": response["id"], "object": "chat.completion.chunk", "created": response["created"], "model": response["model"], "choices": [], "usage": response.get("usage")}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def send_error_json(self, status, message, type, code, headers=None):
+        self.send_json(status, {"error": {"message": message, "type": type, "code": code}}, headers)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            self.send_json(200, self.server.stats())
+        elif self.path.rstrip("/").endswith("/models"):
+            self.send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+        else:
+            self.send_error_json(404, f"Unknown path {self.path}", "invalid_request_error", "not_found")
+
+    def do_POST(self):
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_error_json(404, f"Unknown path {self.path}", "invalid_request_error", "not_found")
+            return
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        options = self.server.options
+        self.server.count("requests")
+
+        # injected latency and errors.
+        time.sleep(self.server.latency())
+        error = self.server.error()
+        if error == "rate_limit":
+            self.server.count("rate_limit")
+            self.send_error_json(429, "Mock rate limit exceeded.", "rate_limit_error", "rate_limit_exceeded", {"Retry-After": str(options.retry_after)})
+            return
+        if error == "timeout":
+            self.server.count("timeout")
+            time.sleep(options.timeout_delay)
+            self.send_error_json(504, "Mock upstream timeout.", "server_error", "timeout")
+            return
+        if error == "content_filter":
+            self.server.count("content_filter")
+            self.send_error_json(400, "Mock content filter triggered.", "invalid_request_error", "content_filter")
+            return
+
+        key = body_key(body)
+        response = self.server.cassette.get(key)
+        if response is not None:
+            self.server.count("replayed")
+        elif options.mode == "record":
+            status, response = self.server.forward({key: value for key, value in body.items() if key not in ("stream", "stream_options")})
+            if status != 200:
+                self.server.count("upstream_errors")
+                self.send_json(status, response)
+                return
+            self.server.cassette.put(key, body, response)
+            self.server.count("recorded")
+        elif options.miss == "error":
+            self.server.count("missed")
+            self.send_error_json(404, "Request not found in cassette.", "invalid_request_error", "cassette_miss")
+            return
+        else:
+            self.server.count("synthetic")
+            response = completion(body, synthetic_answer(body))
+        if body.get("stream"):
+            self.send_stream(body, response)
+        else:
+            self.send_json(200, response)
+
+class mock_server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, options):
+        super().__init__((options.host, options.port), mock_handler)
+        self.options = options
+        self.cassette = cassette(options.cassette)
+        self.random = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.counters = dict()
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            return dict(self.counters)
+
+    def latency(self):
+        with self.lock:
+            return max(0.0, self.random.gauss(self.options.latency, self.options.latency_std))
+
+    def error(self):
+        with self.lock:
+            p = self.random.random()
+        for name, rate in (("rate_limit", self.options.rate_limit_rate), ("timeout", self.options.timeout_rate), ("content_filter", self.options.content_filter_rate)):
+            if p < rate:
+                return name
+            p -= rate
+        return None
+
+    def forward(self, body):
+        request = urllib.request.Request(
+            self.options.upstream.rstrip("/") + "/chat/completions",
+            data=json.dumps(body).encode("utf-8"),
+            headers={"Content-Type": "application/json", "Authorization": f"Bearer {os.getenv('DASHSCOPE_API_KEY', '')}"},
+        )
+        try:
+            with urllib.request.urlopen(request, timeout=600) as response:
+                return response.status, json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read() or b"{}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible mock server with record/replay")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--cassette", type=str, default="", help="JSON file of recorded responses")
+    parser.add_argument("--mode", type=str, default="replay", choices=["replay", "record"], help="replay: answer from the cassette, record: forward misses to --upstream and record them")
+    parser.add_argument("--miss", type=str, default="synthetic", choices=["synthetic", "error"], help="What to answer in replay mode when a request is not recorded")
+    parser.add_argument("--upstream", type=str, default=default_upstream)
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean injected latency in seconds")
+    parser.add_argument("--latency_std", type=float, default=0.0, help="Standard deviation of injected latency in seconds")
+    parser.add_argument("--rate_limit_rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--retry_after", type=float, default=1.0, help="Retry-After seconds sent with 429")
+    parser.add_argument("--timeout_rate", type=float, default=0.0, help="Fraction of requests that hang and then fail with 504")
+    parser.add_argument("--timeout_delay", type=float, default=30.0, help="Seconds a timed out request hangs")
+    parser.add_argument("--content_filter_rate", type=float, default=0.0, help="Fraction of requests rejected by the content filter")
+    parser.add_argument("--chunk_size", type=int, default=8, help="Characters per chunk of streamed responses")
+    parser.add_argument("--chunk_delay", type=float, default=0.0, help="Seconds between chunks of streamed responses")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--verbose", action="store_true")
+    return parser.parse_args(argv)
+
+def start_mock_server(argv=None):
+    # Start in a background thread, e.g. for benchmarks: server = start_mock_server(["--port", "0"]).
+    server = mock_server(parse_args(argv))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = mock_server(args)
+    print(f"Mock server ({args.mode}) listening on http://{args.host}:{server.server_address[1]}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -1,7 +1,7 @@
 import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}/..")
 import json
-from utils import api, prompt, vision, common
+from utils import api, prompt, vision, common, tracing
 from agents import geographer_agent, seismologist_agent
 
 class domain_knowledge_injection:
@@ -9,6 +9,10 @@ class domain_knowledge_injection:
         self.seismologist = seismologist_agent()
         self.geographer = geographer_agent()
 
+    def warmup(self):
+        self.seismologist.warmup()
+
+    @tracing.traced("DKI.select")
     def select(self, question, knowledge):
         knowledge_types = list(knowledge.keys())
         examples = '{"required_knowledge_types": %s}' % knowledge_types
@@ -21,7 +25,7 @@ class domain_knowledge_injection:
             {"role": "system", "content": prompt.system_prompt},
             {"role": "user", "content": instructions},
         ]
-        answer = api.answer_wrapper(messages, structured=True)
+        answer = api.answer_wrapper(messages, structured=True, label="dki.select")
         try:
             answer = eval(answer)
             keys = answer["required_knowledge_types"]
@@ -34,7 +38,8 @@ class domain_knowledge_injection:
                 selected_knowledge[key] = knowledge[key]
         return selected_knowledge
 
-    def consult(self, question, meta, progress_callback=None):
+    @tracing.traced("DKI.fetch")
+    def fetch(self, meta, progress_callback=None):
         if meta is None:
             if progress_callback:
                 progress_callback("❌ [DKI] 缺少元数据")
@@ -91,7 +96,13 @@ class domain_knowledge_injection:
             common.create_folder_by_file_path(knowledge_path)
             with open(knowledge_path, "w", encoding="utf-8") as f:
                 f.write(json.dumps(knowledge, indent=4, ensure_ascii=False))
-        
+        return knowledge
+
+    def consult(self, question, meta, progress_callback=None):
+        knowledge = self.fetch(meta, progress_callback)
+        if knowledge is None:
+            return None
+
         if progress_callback:
             progress_callback("🧠 [DKI] 正在选择相关知识...")
             
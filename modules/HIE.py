@@ -4,20 +4,32 @@ import cv2
 import json
 import collections
 from tool_pool import geological_knwoledge_type
-from utils import api, prompt, vision, common
+from utils import api, prompt, vision, common, scheduler, tracing
 from agents import geologist_agent
 
 class hierarchical_information_extraction:
     def __init__(self):
         self.geologist = geologist_agent()
 
-    def digitalize(self, image_path, progress_callback=None):
+    def warmup(self):
+        self.geologist.warmup()
+
+    @tracing.traced("HIE.digitalize")
+    def digitalize(self, image_path, progress_callback=None, cancel=None):
+        # cancel (threading.Event) is checked between the model calls, a cancelled run releases its crops and
+        # returns None without writing the meta of the map.
         if progress_callback:
             progress_callback("📊 [HIE] 正在加载图像文件...")
         
-        image = cv2.imread(image_path)
         name = common.path2name(image_path)
         meta_path = os.path.join(common.cache_path(), "meta", name + ".json")
+        crop_folder = os.path.join(common.cache_path(), "det", name)
+
+        def cancelled():
+            if cancel is None or not cancel.is_set():
+                return False
+            vision.crops.release_folder(crop_folder)
+            return True
         
         if progress_callback:
             progress_callback("📊 [HIE] 检查缓存文件...")
@@ -29,6 +41,9 @@ class hierarchical_information_extraction:
                 progress_callback("✅ [HIE] 从缓存加载完成")
             return meta
 
+        # the map is decoded once, detectors and crops share the array.
+        image = vision.load_image(image_path)
+
         if progress_callback:
             progress_callback("📊 [HIE] 初始化元数据结构...")
             
@@ -48,36 +63,41 @@ class hierarchical_information_extraction:
             progress_callback("📊 [HIE] 正在分析地图布局结构...")
             
         # get layout of geologic map.
-        map_layout = self.geologist.get_map_layout(image_path)
+        map_layout = self.geologist.get_map_layout(image)
         regions = map_layout["regions"]
         meta["regions"] = regions
+        if cancelled():
+            return None
 
         if progress_callback:
             progress_callback("📊 [HIE] 正在裁剪和保存地图组件...")
             
         # crop each component in geologic map.
         region_path_and_bbox = collections.defaultdict(list)
-        for region_name, region_bndboxes in regions.items():
-            if progress_callback:
-                progress_callback(f"📊 [HIE] 处理组件: {region_name}")
+        with tracing.span("HIE.crop_components"):
+            for region_name, region_bndboxes in regions.items():
+                if progress_callback:
+                    progress_callback(f"📊 [HIE] 处理组件: {region_name}")
                 
-            for i, region_bndbox in enumerate(region_bndboxes):
-                region_path = os.path.join(common.cache_path(), "det", name, f"{region_name}_{i}.png")
-                common.create_folder_by_file_path(region_path)
-                vision.crop_and_save_image(image, region_bndbox, region_path)
-                region_path_and_bbox[region_name].append((region_path, region_bndbox))
-
-                if "main_map" == region_name:
-                    # crop latitude and longitude region of geologic map.
-                    lonlat_name = "lonlat"
-                    lonlat_region_path = os.path.join(common.cache_path(), "det", name, f"{lonlat_name}_{i}.png")
-                    common.create_folder_by_file_path(lonlat_region_path)
-                    vision.crop_corners_and_save_image(region_path, lonlat_region_path)
-                    region_path_and_bbox[lonlat_name].append((lonlat_region_path, None))
-                elif "index_map" == region_name:
-                    # extend index map and add vision prompt.
-                    vision.annotate_image_with_directions(region_path, region_path)
+                for i, region_bndbox in enumerate(region_bndboxes):
+                    region_path = os.path.join(common.cache_path(), "det", name, f"{region_name}_{i}.png")
+                    common.create_folder_by_file_path(region_path)
+                    region_image = vision.crop_and_save_image(image, region_bndbox, region_path)
+                    region_path_and_bbox[region_name].append((region_path, region_bndbox))
+
+                    if "main_map" == region_name:
+                        # crop latitude and longitude region of geologic map.
+                        lonlat_name = "lonlat"
+                        lonlat_region_path = os.path.join(common.cache_path(), "det", name, f"{lonlat_name}_{i}.png")
+                        common.create_folder_by_file_path(lonlat_region_path)
+                        vision.crop_corners_and_save_image(region_image, lonlat_region_path)
+                        region_path_and_bbox[lonlat_name].append((lonlat_region_path, None))
+                    elif "index_map" == region_name:
+                        # extend index map and add vision prompt.
+                        vision.annotate_image_with_directions(region_image, region_path)
 
+        if cancelled():
+            return None
         if len(region_path_and_bbox["legend"]) > 0:
             if progress_callback:
                 progress_callback("📊 [HIE] 正在提取图例信息...")
@@ -85,57 +105,66 @@ class hierarchical_information_extraction:
             legend_path, legend_bndbox = region_path_and_bbox["legend"][0]
             legend_metadata = self.geologist.get_legend_metadata(legend_path, legend_bndbox)
             legends = legend_metadata["legend"]
+            if cancelled():
+                return None
             
             if progress_callback:
                 progress_callback("📊 [HIE] 正在匹配岩石类型和地层年代...")
                 
-            for legend in legends.values():
-                legend["lithology"] = self.geologist.get_knowledge(geological_knwoledge_type.Rock_Type, legend["text"])["rock_type"]
-                legend["stratigraphic_age"] = self.geologist.get_knowledge(geological_knwoledge_type.Rock_Age, legend["text"])["rock_age"]
+            with tracing.span("HIE.match_rock_knowledge"):
+                for legend in legends.values():
+                    legend["lithology"] = self.geologist.get_knowledge(geological_knwoledge_type.Rock_Type, legend["text"])["rock_type"]
+                    legend["stratigraphic_age"] = self.geologist.get_knowledge(geological_knwoledge_type.Rock_Age, legend["text"])["rock_age"]
             meta["legend"] = legends
 
+        if cancelled():
+            return None
         if progress_callback:
             progress_callback("📊 [HIE] 正在提取基本信息（标题、比例尺等）...")
             
-        # get basic information of geologic map.
-        region_names = ["title", "scale", "lonlat", "index_map"]
-        for region_name in region_names:
-            if region_name not in region_path_and_bbox:
-                continue
+        # get basic information of geologic map, components are extracted concurrently.
+        region_names = [region_name for region_name in ["title", "scale", "lonlat", "index_map"] if region_name in region_path_and_bbox]
+        def extract_component(region_name):
             if progress_callback:
                 progress_callback(f"📊 [HIE] 分析{region_name}信息...")
                 
             region_path, region_bndbox = region_path_and_bbox[region_name][0]
             keys, instruction = prompt.get_component_instruction(region_name)
             prompt_content = [
-                {"type": "image_url", "image_url": {"url": api.local_image_to_data_url(region_path)}},
+                {"type": "image_url", "image_url": {"url": api.image_to_data_url(region_path, prompt.get_image_policy(component=region_name))[0]}},
                 {"type": "text", "text": instruction},
             ]
             messages = [
                 {"role": "system", "content": prompt.system_prompt},
                 {"role": "user", "content": prompt_content},
             ]
+            return api.answer_wrapper(messages, structured=True, label=f"hie.{region_name}")
 
-            answer = api.answer_wrapper(messages, structured=True)
+        answers = scheduler.parallel_map(extract_component, region_names)
+        for region_name, answer in zip(region_names, answers):
             infos = eval(answer)
             key_value_pairs = prompt.get_basic_information(region_name, infos)
             for key, value in key_value_pairs:
                 meta["information"][key] = value
 
+        if cancelled():
+            return None
         if len(region_path_and_bbox["main_map"]) > 0:
             if progress_callback:
                 progress_callback("📊 [HIE] 正在进行岩石区域分割...")
                 
             main_map_path, main_map_bndbox = region_path_and_bbox["main_map"][0]
-            vision.rock_region_seg(main_map_path, list(meta["legend"].values()))
+            with tracing.span("vision.rock_region_seg"):
+                seg_path = os.path.join(common.cache_path(), "seg", name + ".npz")
+                vision.rock_region_seg(main_map_path, list(meta["legend"].values()), seg_path)
 
         if progress_callback:
             progress_callback("📊 [HIE] 正在保存数字化结果...")
             
         # output digitalization result of geologic map.
-        common.create_folder_by_file_path(meta_path)
-        with open(meta_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(meta, indent=4, ensure_ascii=False))
+        common.save_json(meta_path, meta)
+        # the crops of this map are read from disk from now on.
+        vision.crops.release_folder(crop_folder)
             
         if progress_callback:
             progress_callback("✅ [HIE] 分层信息提取完成")
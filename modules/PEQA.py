@@ -1,35 +1,44 @@
 import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}/..")
 import json
-from utils import api, prompt, vision, common
+from utils import api, prompt, vision, common, tracing
 
 class prompt_enhanced_QA:
     def __init__(self):
-        relation_path = os.path.join(common.cache_path(), "component", "relations.json")
         self.components = list(prompt.components)
+
+    # component relations are loaded (or asked from the model) on first use.
+    @common.lazy_property
+    def component_relations(self):
+        relation_path = os.path.join(common.cache_path(), "component", "relations.json")
         if os.path.exists(relation_path):
             with open(relation_path, "r", encoding="utf-8") as f:
-                self.component_relations = json.loads(f.read())
-        else:
-            examples = [
-                {"component1": "main_map", "component2": "legend", "relation": "XXX"},
-                {"component1": "scale", "component2": "title", "relation": "XXX"},
-            ]
-            instructions = [
-                {"type": "text", "text": f"The components of geologic map are {', '.join(self.components)}."},
-                {"type": "text", "text": f'What are the relations for all the component pairs in geologic map, the example is {examples}, only respond with JSON format.\n'},
-            ]
-            messages = [
-                {"role": "system", "content": prompt.system_prompt},
-                {"role": "user", "content": instructions},
-            ]
-            self.component_relations = api.answer_wrapper(messages, structured=True)
+                return json.loads(f.read())
+
+        examples = [
+            {"component1": "main_map", "component2": "legend", "relation": "XXX"},
+            {"component1": "scale", "component2": "title", "relation": "XXX"},
+        ]
+        instructions = [
+            {"type": "text", "text": f"The components of geologic map are {', '.join(self.components)}."},
+            {"type": "text", "text": f'What are the relations for all the component pairs in geologic map, the example is {examples}, only respond with JSON format.\n'},
+        ]
+        messages = [
+            {"role": "system", "content": prompt.system_prompt},
+            {"role": "user", "content": instructions},
+        ]
+        component_relations = api.answer_wrapper(messages, structured=True, label="peqa.relations")
+
+        # output component relations of geologic map.
+        common.create_folder_by_file_path(relation_path)
+        with open(relation_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(component_relations, indent=4, ensure_ascii=False))
+        return component_relations
 
-            # output component relations of geologic map.
-            common.create_folder_by_file_path(relation_path)
-            with open(relation_path, "w", encoding="utf-8") as f:
-                f.write(json.dumps(self.component_relations, indent=4, ensure_ascii=False))
+    def warmup(self):
+        return self.component_relations
 
+    @tracing.traced("PEQA.select")
     def select(self, question, question_type):
         component_path = os.path.join(common.cache_path(), "component", question_type + ".json")
         if os.path.exists(component_path):
@@ -46,7 +55,7 @@ class prompt_enhanced_QA:
             {"role": "system", "content": prompt.system_prompt},
             {"role": "user", "content": instructions},
         ]
-        answer = api.answer_wrapper(messages, structured=True)
+        answer = api.answer_wrapper(messages, structured=True, label="peqa.select")
         try:
             selected_components = eval(answer)
             selected_components = list(map(lambda x: x[1], sorted(selected_components.items(), key=lambda x: x[0])))
@@ -54,16 +63,18 @@ class prompt_enhanced_QA:
             selected_components = None
 
         # output selected components of geologic map.
-        common.create_folder_by_file_path(component_path)
-        with open(component_path, "w", encoding="utf-8") as f:
-            f.write(json.dumps(selected_components, indent=4, ensure_ascii=False))
+        common.save_json(component_path, selected_components)
         return selected_components
     
-    def answer(self, information, knowledge, enhance_prompt, image_path, question, question_type, progress_callback=None):
+    @tracing.traced("PEQA.answer")
+    def answer(self, information, knowledge, enhance_prompt, image_path, question, question_type, progress_callback=None, selected_components=None, stream=False):
         if progress_callback:
             progress_callback("🤖 [PEQA] 开始构建回答...")
             
         instructions = list()
+        # images follow the policy of the question type, grounding boxes are mapped back by the scale of the full image.
+        image_policy = prompt.get_image_policy(question_type=question_type)
+        image_scale = 1.0
 
         # Context enhancement.
         if information is not None:
@@ -80,8 +91,9 @@ class prompt_enhanced_QA:
             if progress_callback:
                 progress_callback("🤖 [PEQA] 正在选择相关组件...")
                 
-            # Component selection.
-            selected_components = self.select(question, question_type)
+            # Component selection, may be done ahead of time by the caller.
+            if selected_components is None:
+                selected_components = self.select(question, question_type)
             if selected_components is not None:
                 if information is not None:
                     if progress_callback:
@@ -89,27 +101,30 @@ class prompt_enhanced_QA:
                         
                     for selected_component in selected_components:
                         selected_image_path = os.path.join(common.cache_path(), "det", information["name"], f"{selected_component}_0.png")
-                        if os.path.exists(selected_image_path):
-                            instructions.append({"type": "image_url", "image_url": {"url": api.local_image_to_data_url(selected_image_path)}})
+                        if vision.image_exists(selected_image_path):
+                            instructions.append({"type": "image_url", "image_url": {"url": api.image_to_data_url(selected_image_path, image_policy)[0]}})
                     if len(instructions) == 0:
                         if len(selected_components) > 0:
                             instructions.append({"type": "text", "text": f"Let's focus more on {', '.join(selected_components)}"})
-                        instructions.append({"type": "image_url", "image_url": {"url": api.local_image_to_data_url(image_path)}})
+                        image_url, image_scale = api.image_to_data_url(image_path, image_policy)
+                        instructions.append({"type": "image_url", "image_url": {"url": image_url}})
                 else:
                     if len(selected_components) > 0:
                         instructions.append({"type": "text", "text": f"Let's focus more on {', '.join(selected_components)}"})
-                    instructions.append({"type": "image_url", "image_url": {"url": api.local_image_to_data_url(image_path)}})
+                    image_url, image_scale = api.image_to_data_url(image_path, image_policy)
+                    instructions.append({"type": "image_url", "image_url": {"url": image_url}})
             
             if progress_callback:
                 progress_callback("🤖 [PEQA] 正在构建提示词...")
                 
             # Both COT and JSON format + few-shot.
-            question_instruction = prompt.ability2instruction(question_type, vision.image_size(image_path))
+            question_instruction = prompt.ability2instruction(question_type, vision.scaled_size(*vision.image_size(image_path), image_scale))
             instructions.append({"type": "text", "text": f"Instruction: {question_instruction}\n"})
         else:
-            instructions.append({"type": "image_url", "image_url": {"url": api.local_image_to_data_url(image_path)}})
+            image_url, image_scale = api.image_to_data_url(image_path, image_policy)
+            instructions.append({"type": "image_url", "image_url": {"url": image_url}})
             # JSON format + few-shot.
-            question_instruction = prompt.ability2instruction(question_type, vision.image_size(image_path))
+            question_instruction = prompt.ability2instruction(question_type, vision.scaled_size(*vision.image_size(image_path), image_scale))
             question_instruction = question_instruction[:question_instruction.find('{"answer":')] + '{"answer": "XXX"}'
             instructions.append({"type": "text", "text": f"Instruction: {question_instruction}\n"})
 
@@ -131,7 +146,13 @@ class prompt_enhanced_QA:
             print("Question Instruction:", question_instruction, flush=True)
             print("Question:", question, flush=True)
             
-        answer = api.answer_wrapper(messages, structured=True)
+        # with stream=True partial answers are forwarded while the model is still generating, prefixed with
+        # common.partial_answer_prefix, each carries the whole answer so far.
+        stream = stream and progress_callback is not None
+        stream_callback = (lambda text: progress_callback(common.partial_answer_prefix + text)) if stream else None
+        answer = api.answer_wrapper(messages, structured=True, stream=stream, stream_callback=stream_callback, label="peqa.answer")
+        if prompt.is_grounding(question_type) and image_scale != 1.0:
+            answer = prompt.rescale_grounding_answer(answer, image_scale)
         
         if progress_callback:
             progress_callback("🤖 [PEQA] 正在处理模型响应...")
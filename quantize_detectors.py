@@ -0,0 +1,286 @@
+"""
+版面检测 (det_component) 与图例检测 (det_legend) 模型的 INT8 训练后量化，以我们自己的地质图作为校准集
+输出逐类 mAP 的精度差异报告与延迟报告，逐个模型决定是否采用量化模型
+使用方法:
+    python quantize_detectors.py --calibration maps/                                   # OpenVINO (nncf) 量化，留出 20% 的图评估
+    python quantize_detectors.py --calibration maps/ --eval held_out/ --labels labels/  # 以人工标注评估
+    python quantize_detectors.py --calibration maps/ --backend onnx --report .cache/quantization.json
+评估图不参与校准: 由 --eval 指定，未指定时从 --calibration 中按 --holdout 比例留出
+精度参照: 有 YOLO 格式标注 (--labels 下的 <图名>.txt) 时为标注，否则为 FP32 模型 conf>=0.25 的检测结果
+比较的是端到端检测头的原始输出，不经过 YOLOv10DetectionPredictor 的后处理 (置信度阈值与类别仲裁)，只反映量化本身的影响
+接受后设置 PEACE_COMPONENT_DETECTOR_BACKEND 或 PEACE_LEGEND_DETECTOR_BACKEND 为 openvino_int8 / onnx_int8
+"""
+import os
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import cv2
+
+from export_detectors import models, export
+from tool_pool.detector_backend import exported_path
+
+image_suffixes = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp")
+backend_variables = {
+    "det_component": "PEACE_COMPONENT_DETECTOR_BACKEND",
+    "det_legend": "PEACE_LEGEND_DETECTOR_BACKEND",
+}
+iouv = np.linspace(0.5, 0.95, 10)  # mAP@0.5:0.95
+
+def list_images(folder, limit=0):
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.lower().endswith(image_suffixes))
+    return paths[:limit] if limit > 0 else paths
+
+def split_holdout(paths, fraction):
+    # every n-th map is held out for the reports, the rest calibrates, both spread over the sorted folder.
+    if fraction <= 0 or len(paths) < 2:
+        return paths, []
+    step = max(2, int(round(1 / fraction)))
+    return [p for i, p in enumerate(paths) if i % step != step - 1], [p for i, p in enumerate(paths) if i % step == step - 1]
+
+def letterboxed(paths, imgsz, stride=32):
+    # the predictor's input of exported models: square letterbox, RGB, CHW, kept as uint8 to hold hundreds of maps.
+    from dependencies.ultralytics import YOLOv10  # puts the vendored ultralytics on sys.path
+    from ultralytics.data.augment import LetterBox
+    letterbox = LetterBox(imgsz, auto=False, stride=stride)
+    inputs = list()
+    for path in paths:
+        image = cv2.imread(path)
+        if image is None:
+            print(f"Failed to decode {path}. Skipping...")
+            continue
+        inputs.append((path, image.shape[:2], np.ascontiguousarray(letterbox(image=image)[..., ::-1].transpose(2, 0, 1))))
+    return inputs
+
+def to_float(array):
+    return array[None].astype(np.float32) / 255.0
+
+def load_backend(path):
+    from dependencies.ultralytics import YOLOv10
+    from ultralytics.nn.autobackend import AutoBackend
+    return AutoBackend(path, verbose=False)
+
+def head_name(model_path):
+    # name of the detection head in the converted graph, e.g. model.23, like the exporter's INT8 path.
+    from dependencies.ultralytics import YOLOv10
+    return f"model.{len(YOLOv10(model_path).model.model) - 1}"
+
+def quantize_openvino(model_path, inputs):
+    # nncf post-training quantization of the FP32 IR, the box decoding of the head stays in floating point.
+    import nncf
+    import openvino as ov
+    fp32_dir = exported_path(model_path, "openvino")
+    int8_dir = exported_path(model_path, "openvino_int8")
+    xml = next(name for name in os.listdir(fp32_dir) if name.endswith(".xml"))
+    head = head_name(model_path)
+    ignored_scope = nncf.IgnoredScope(
+        patterns=[f".*{head}/.*/Add", f".*{head}/.*/Sub*", f".*{head}/.*/Mul*", f".*{head}/.*/Div*", f".*{head}\\.dfl.*"],
+        types=["Sigmoid"],
+        validate=False,
+    )
+    dataset = nncf.Dataset([array for _, _, array in inputs], to_float)
+    quantized = nncf.quantize(
+        ov.Core().read_model(os.path.join(fp32_dir, xml)),
+        dataset,
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=len(inputs),
+        ignored_scope=ignored_scope,
+    )
+    os.makedirs(int8_dir, exist_ok=True)
+    ov.save_model(quantized, os.path.join(int8_dir, xml), compress_to_fp16=False)
+    shutil.copy(os.path.join(fp32_dir, "metadata.yaml"), int8_dir)
+    return int8_dir
+
+class calibration_reader:
+    # onnxruntime CalibrationDataReader protocol over the letterboxed maps.
+    def __init__(self, inputs, input_name="images"):
+        self.inputs = inputs
+        self.input_name = input_name
+        self.index = 0
+
+    def get_next(self):
+        if self.index >= len(self.inputs):
+            return None
+        self.index += 1
+        return {self.input_name: to_float(self.inputs[self.index - 1][2])}
+
+    def rewind(self):
+        self.index = 0
+
+def quantize_onnx(model_path, inputs):
+    # static QDQ quantization of the convolutions, per channel weights, the head arithmetic stays in floating point.
+    import onnx
+    from onnxruntime.quantization import quantize_static, QuantFormat, QuantType
+    fp32_path = exported_path(model_path, "onnx")
+    int8_path = exported_path(model_path, "onnx_int8")
+    quantize_static(
+        fp32_path,
+        int8_path,
+        calibration_reader(inputs),
+        quant_format=QuantFormat.QDQ,
+        op_types_to_quantize=["Conv"],
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    # AutoBackend reads stride, imgsz and names from the metadata, the quantizer does not keep it.
+    model = onnx.load(int8_path)
+    onnx.helper.set_model_props(model, {prop.key: prop.value for prop in onnx.load(fp32_path).metadata_props})
+    onnx.save(model, int8_path)
+    return int8_path
+
+def predict(backend, inputs):
+    # Raw (300, 6) outputs of the end-to-end head of every image, in original image pixels (xyxy, score, class), and the
+    # inference times. The forked postprocess (conf threshold, class arbitration) is not applied, it is the same code
+    # for FP32 and INT8 and would hide low score differences from the AP.
+    import torch
+    from ultralytics.utils.ops import scale_boxes
+    backend(torch.from_numpy(to_float(inputs[0][2])))  # warmup
+    detections, times = list(), list()
+    for _, shape, array in inputs:
+        x = torch.from_numpy(to_float(array))
+        start = time.perf_counter()
+        y = backend(x)
+        times.append(time.perf_counter() - start)
+        y = (y[0] if isinstance(y, (list, tuple)) else y)[0].clone()
+        y[:, :4] = scale_boxes(x.shape[2:], y[:, :4], shape)
+        detections.append(y.numpy())
+    return detections, np.array(times)
+
+def load_labels(folder, inputs):
+    # YOLO labels (class cx cy w h, normalized) of each image as (M, 5) class, xyxy in pixels, empty when missing.
+    targets = list()
+    for path, (height, width), _ in inputs:
+        label_path = os.path.join(folder, os.path.splitext(os.path.basename(path))[0] + ".txt")
+        labels = np.loadtxt(label_path, ndmin=2).reshape(-1, 5) if os.path.exists(label_path) else np.zeros((0, 5))
+        cx, cy, w, h = labels[:, 1] * width, labels[:, 2] * height, labels[:, 3] * width, labels[:, 4] * height
+        targets.append(np.stack([labels[:, 0], cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1))
+    return targets
+
+def pseudo_labels(detections, conf=0.25):
+    # reference boxes: the raw FP32 outputs above the predictor's default conf, before class arbitration.
+    return [d[d[:, 4] >= conf][:, [5, 0, 1, 2, 3]] for d in detections]
+
+def match(pred, target):
+    # (N, 10) correct matrix of pred against target at the IoU thresholds, the greedy matching of BaseValidator.
+    from ultralytics.utils.metrics import box_iou
+    import torch
+    correct = np.zeros((len(pred), len(iouv)), dtype=bool)
+    if len(pred) == 0 or len(target) == 0:
+        return correct
+    iou = box_iou(torch.from_numpy(target[:, 1:5]).float(), torch.from_numpy(pred[:, :4]).float()).numpy()
+    iou = iou * (target[:, :1] == pred[None, :, 5])
+    for i, threshold in enumerate(iouv):
+        matches = np.array(np.nonzero(iou >= threshold)).T
+        if matches.shape[0] > 1:
+            matches = matches[iou[matches[:, 0], matches[:, 1]].argsort()[::-1]]
+            matches = matches[np.unique(matches[:, 1], return_index=True)[1]]
+            matches = matches[np.unique(matches[:, 0], return_index=True)[1]]
+        correct[matches[:, 1].astype(int), i] = True
+    return correct
+
+def per_class_map(detections, targets, names, conf=0.001):
+    # {class name: {"map50", "map"}} and "all", through ap_per_class of the vendored metrics.
+    from ultralytics.utils.metrics import ap_per_class
+    target_cls = np.concatenate([target[:, 0] for target in targets])
+    if len(target_cls) == 0:
+        return dict()
+    detections = [d[d[:, 4] > conf] for d in detections]
+    tp = np.concatenate([match(d, target) for d, target in zip(detections, targets)])
+    scores = np.concatenate([d[:, 4] for d in detections])
+    pred_cls = np.concatenate([d[:, 5] for d in detections])
+    ap, classes = ap_per_class(tp, scores, pred_cls, target_cls, names=names)[5:7]
+    result = {names[c]: {"map50": float(ap[i, 0]), "map": float(ap[i].mean())} for i, c in enumerate(classes)}
+    result["all"] = {"map50": float(ap[:, 0].mean()), "map": float(ap.mean())}
+    return result
+
+def latency(times):
+    return {"mean_ms": float(times.mean() * 1000), "p50_ms": float(np.median(times) * 1000)}
+
+def evaluate(name, model_path, backend, calibration_paths, eval_paths, labels):
+    fp32_path = exported_path(model_path, backend)
+    if not os.path.exists(fp32_path):
+        print(f"{name}: {export(model_path, backend)}")
+    fp32 = load_backend(fp32_path)
+    imgsz, stride, names = fp32.imgsz, int(fp32.stride), fp32.names
+
+    calibration = letterboxed(calibration_paths, imgsz, stride)
+    print(f"{name}: quantizing with {len(calibration)} calibration maps...")
+    int8_path = (quantize_openvino if backend == "openvino" else quantize_onnx)(model_path, calibration)
+    int8 = load_backend(int8_path)
+
+    inputs = letterboxed(eval_paths, imgsz, stride)
+    fp32_detections, fp32_times = predict(fp32, inputs)
+    int8_detections, int8_times = predict(int8, inputs)
+    targets = load_labels(labels, inputs) if labels else pseudo_labels(fp32_detections)
+    fp32_map = per_class_map(fp32_detections, targets, names)
+    int8_map = per_class_map(int8_detections, targets, names)
+
+    classes = dict()
+    for key in fp32_map:
+        classes[key] = {
+            "fp32_map50": fp32_map[key]["map50"], "int8_map50": int8_map.get(key, {"map50": 0.0})["map50"],
+            "fp32_map": fp32_map[key]["map"], "int8_map": int8_map.get(key, {"map": 0.0})["map"],
+        }
+        classes[key]["delta_map50"] = classes[key]["int8_map50"] - classes[key]["fp32_map50"]
+        classes[key]["delta_map"] = classes[key]["int8_map"] - classes[key]["fp32_map"]
+    return {
+        "fp32_model": fp32_path,
+        "int8_model": int8_path,
+        "reference": "labels" if labels else "fp32",
+        "images": len(inputs),
+        "calibration_images": len(calibration),
+        "classes": classes,
+        "latency": {"fp32": latency(fp32_times), "int8": latency(int8_times), "speedup": float(fp32_times.mean() / int8_times.mean())},
+        "accept": f"{backend_variables[name]}={backend}_int8",
+    }
+
+def format_report(name, report):
+    lines = [f"{name}  ({report['images']} held-out maps, {report['calibration_images']} calibration maps, reference: {report['reference']})"]
+    lines.append(f"{'class':<24}{'fp32 mAP50':>12}{'int8 mAP50':>12}{'delta':>9}{'fp32 mAP':>10}{'int8 mAP':>10}{'delta':>9}")
+    for key, value in report["classes"].items():
+        lines.append(
+            f"{key:<24}{value['fp32_map50']:>12.3f}{value['int8_map50']:>12.3f}{value['delta_map50']:>+9.3f}"
+            f"{value['fp32_map']:>10.3f}{value['int8_map']:>10.3f}{value['delta_map']:>+9.3f}"
+        )
+    fp32, int8 = report["latency"]["fp32"], report["latency"]["int8"]
+    lines.append(f"latency fp32 {fp32['mean_ms']:.1f} ms (p50 {fp32['p50_ms']:.1f})  int8 {int8['mean_ms']:.1f} ms (p50 {int8['p50_ms']:.1f})  speedup {report['latency']['speedup']:.2f}x")
+    lines.append(f"to accept: export {report['accept']}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="INT8 post-training quantization of the map detectors with accuracy and latency reports")
+    parser.add_argument("--calibration", type=str, required=True, help="Folder of our own maps used for calibration")
+    parser.add_argument("--calibration_size", type=int, default=300, help="Maps used for calibration, 0 for all")
+    parser.add_argument("--eval", type=str, default="", help="Folder of held-out maps for the reports")
+    parser.add_argument("--holdout", type=float, default=0.2, help="Fraction of the calibration folder held out for the reports when --eval is not given")
+    parser.add_argument("--labels", type=str, default="", help="Folder of YOLO labels (<map name>.txt) of the eval maps, FP32 detections are the reference otherwise")
+    parser.add_argument("--models", type=str, nargs="+", default=list(models), choices=list(models))
+    parser.add_argument("--backend", type=str, default="openvino", choices=["openvino", "onnx"])
+    parser.add_argument("--report", type=str, default="", help="JSON file to write the reports to")
+    args = parser.parse_args()
+
+    if args.eval:
+        calibration_paths = list_images(args.calibration, args.calibration_size)
+        eval_paths = list_images(args.eval)
+        overlap = set(map(os.path.basename, calibration_paths)) & set(map(os.path.basename, eval_paths))
+        if overlap:
+            print(f"WARNING: {len(overlap)} eval maps are also calibration maps, their accuracy is optimistic.")
+    else:
+        calibration_paths, eval_paths = split_holdout(list_images(args.calibration), args.holdout)
+        if args.calibration_size > 0:
+            calibration_paths = calibration_paths[:args.calibration_size]
+    if len(eval_paths) == 0:
+        parser.error("no held-out maps for the reports, pass --eval or a --holdout above 0 with at least 2 maps")
+    reports = dict()
+    for name in args.models:
+        reports[name] = evaluate(name, models[name], args.backend, calibration_paths, eval_paths, args.labels)
+        print(format_report(name, reports[name]))
+    if args.report:
+        folder = os.path.dirname(args.report)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(args.report, "w", encoding="utf-8") as f:
+            f.write(json.dumps(reports, indent=4, ensure_ascii=False))
@@ -0,0 +1,111 @@
+"""
+测试copilot的阶段调度与批量问答 (copilot.py)，HIE/DKI/PEQA 为桩模块，不调用模型
+"""
+import os
+import sys
+import threading
+import contextlib
+import collections
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "dummy")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+import copilot
+
+@contextlib.contextmanager
+def stub_modules(**modules):
+    previous = dict(copilot.module_instances)
+    copilot.module_instances.clear()
+    copilot.module_instances.update(modules)
+    try:
+        yield
+    finally:
+        copilot.module_instances.clear()
+        copilot.module_instances.update(previous)
+
+@contextlib.contextmanager
+def stub_rai_filter(rejected):
+    previous = copilot.common.rai_filter
+    copilot.common.rai_filter = rejected
+    try:
+        yield
+    finally:
+        copilot.common.rai_filter = previous
+
+class stub_peqa:
+    def select(self, question, question_type):
+        return None
+
+def test_rejected_question_cancels_hie():
+    started, done = threading.Event(), threading.Event()
+    seen = list()
+    class stub_hie:
+        def digitalize(self, image_path, progress_callback=None, cancel=None):
+            started.set()
+            # stands in for the model calls, HIE stops at its next check of cancel.
+            seen.append(cancel.wait(1.0))
+            done.set()
+            return None
+
+    def rejected(question):
+        started.wait(1.0)
+        return True
+
+    with stub_modules(hie=stub_hie(), peqa=stub_peqa()), stub_rai_filter(rejected):
+        assert copilot.copilot("map.jpg", "question", "extracting-sheet_name") == copilot.refusal
+        assert done.wait(1.0) and seen == [True]
+
+def test_batch_digitalizes_each_map_once():
+    calls = collections.Counter()
+    class stub_hie:
+        def digitalize(self, image_path, progress_callback=None):
+            calls["digitalize", image_path] += 1
+            if image_path == "broken.jpg":
+                raise ValueError("not a map")
+            return {"name": image_path, "polished": False}
+
+    class stub_dki:
+        def fetch(self, information, progress_callback=None):
+            calls["fetch", information["name"]] += 1
+            return {"knowledge": information["name"]}
+
+        def select(self, question, knowledge):
+            return knowledge
+
+    class stub_batch_peqa:
+        def answer(self, information, knowledge, enhance_prompt, image_path, question, question_type, progress_callback=None):
+            # PEQA polishes the information in place, every question gets a fresh copy.
+            assert not information["polished"]
+            information["polished"] = True
+            if question == "fail":
+                raise RuntimeError("no answer")
+            return f"{question}@{knowledge['knowledge']}"
+
+    def rejected(question):
+        calls["rai", question] += 1
+        return question == "reject"
+
+    queries = [
+        ("a.jpg", "q0", "t"),
+        ("b.jpg", "q1", "t"),
+        ("a.jpg", "reject", "t"),
+        ("broken.jpg", "q3", "t"),
+        ("a.jpg", "fail", "t"),
+        ("b.jpg", "reject", "t"),
+        ("a.jpg", "q6", "t"),
+    ]
+    callbacks = list()
+    with stub_modules(hie=stub_hie(), dki=stub_dki(), peqa=stub_batch_peqa()), stub_rai_filter(rejected):
+        answers = copilot.copilot_batch(queries, answer_callback=lambda i, answer: callbacks.append((i, answer)))
+
+    assert answers == ["q0@a.jpg", "q1@b.jpg", copilot.refusal, None, None, copilot.refusal, "q6@a.jpg"]
+    # one callback per query, failed and skipped ones with None.
+    assert sorted(callbacks) == list(enumerate(answers))
+    assert all(calls["digitalize", path] == 1 for path in ("a.jpg", "b.jpg", "broken.jpg"))
+    assert calls["fetch", "a.jpg"] == 1 and calls["fetch", "b.jpg"] == 1
+    # identical questions are filtered once.
+    assert calls["rai", "reject"] == 1
+
+if __name__ == "__main__":
+    test_rejected_question_cancels_hie()
+    test_batch_digitalizes_each_map_once()
+    print("[OK] copilot调度测试通过")
@@ -0,0 +1,89 @@
+"""
+测试版面与图例检测的批量推理 (tool_pool/map_component_detector.py, tool_pool/map_legend_detector.py)，YOLO 模型为桩对象
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from tool_pool.map_component_detector import map_component_detector
+from tool_pool.map_legend_detector import map_legend_detector
+
+class stub_model:
+    # YOLOv10.predict of the forked predictor: one structure per image, tagged with the image's first pixel.
+    def __init__(self):
+        self.batches = list()
+
+    def predict(self, source, batch):
+        assert batch == len(source) and all(isinstance(image, np.ndarray) for image in source)
+        self.batches.append([int(image[0, 0, 0]) for image in source])
+        return [self.structure(int(image[0, 0, 0])) for image in source]
+
+    def structure(self, tag):
+        # a color swatch and its text on the row of the tag, the text is black on white.
+        y = 10 + tag
+        return {"color_bndbox": [[10, y, 20, y + 8]], "text_bndbox": [[22, y, 60, y + 8]], "tag": tag}
+
+def new_detector(cls):
+    # the weights are not needed, the model is replaced.
+    detector = cls.__new__(cls)
+    detector.model = stub_model()
+    return detector
+
+def inputs(folder, n):
+    # arrays and paths mixed, image i is filled with i.
+    images = list()
+    for i in range(n):
+        image = np.full((80, 100, 3), 255, dtype=np.uint8)
+        image[0, 0] = i
+        image[10 + i:18 + i, 30:40] = 0
+        if i % 3 == 1:
+            path = os.path.join(folder, f"map_{i}.png")
+            cv2.imwrite(path, image)
+            images.append(path)
+        else:
+            images.append(image)
+    return images
+
+def test_component_batches_keep_the_input_order():
+    with tempfile.TemporaryDirectory() as folder:
+        detector = new_detector(map_component_detector)
+        regions = detector.detect_batch(inputs(folder, 7), batch_size=3)
+        assert [region["tag"] for region in regions] == list(range(7))
+        assert detector.model.batches == [[0, 1, 2], [3, 4, 5], [6]]
+        assert detector.detect(inputs(folder, 2)[1])["tag"] == 1
+
+def test_legends_are_paired_per_image():
+    with tempfile.TemporaryDirectory() as folder:
+        detector = new_detector(map_legend_detector)
+        paired = list()
+        pair_legends = detector.pair_legends
+        def spy(image, objs):
+            paired.append((int(image[0, 0, 0]), objs["tag"]))
+            return pair_legends(image, objs)
+        detector.pair_legends = spy
+        legends = detector.detect_batch(inputs(folder, 5), batch_size=2)
+        assert paired == [(i, i) for i in range(5)]
+        assert detector.model.batches == [[0, 1], [2, 3], [4]]
+        # each text box is shrunk on its own image, around the dark pixels of that image.
+        for i, image_legends in enumerate(legends):
+            assert list(image_legends) == [0] and image_legends[0]["color_bndbox"] == [10, 10 + i, 20, 18 + i]
+            assert tuple(image_legends[0]["text_bndbox"]) == (29, 10 + i, 40, 18 + i)
+
+def test_undecodable_path_raises():
+    with tempfile.TemporaryDirectory() as folder:
+        detector = new_detector(map_component_detector)
+        try:
+            detector.detect_batch([np.zeros((8, 8, 3), dtype=np.uint8), os.path.join(folder, "missing.png")])
+        except ValueError:
+            assert detector.model.batches == []
+            return
+        raise AssertionError("missing image was not reported")
+
+if __name__ == "__main__":
+    test_component_batches_keep_the_input_order()
+    test_legends_are_paired_per_image()
+    test_undecodable_path_raises()
+    print("[OK] 批量检测测试通过")
@@ -0,0 +1,63 @@
+"""
+测试检测结果按类别分组 (dependencies/ultralytics/engine/structure.py)，使用伪造的 Boxes 张量，不需要模型权重
+"""
+import os
+import importlib.util
+import torch
+
+# loaded by path, the ultralytics package itself needs the full detection environment.
+root = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location("structure", os.path.join(root, "dependencies", "ultralytics", "engine", "structure.py"))
+structure = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(structure)
+
+class fake_boxes:
+    # the xyxy and cls tensors of ultralytics Boxes.
+    def __init__(self, data):
+        self.data = torch.tensor(data, dtype=torch.float32).reshape(-1, 6)
+        self.xyxy = self.data[:, :4]
+        self.cls = self.data[:, 5]
+
+    def __len__(self):
+        return len(self.data)
+
+layout_names = {0: "title", 1: "main_map", 2: "legend", 3: "scale", 4: "index_map", 5: "cross_section", 6: "stratigraphic_column", 7: "others"}
+
+def test_keys_come_from_the_class_names():
+    assert structure.detection_keys(layout_names) is structure.region_keys
+    assert structure.detection_keys({0: "color_bndbox", 1: "text_bndbox"}) is structure.legend_keys
+    assert structure.detection_keys({0: "Color", 1: "Text"}) is structure.legend_keys
+    # a two class model is not a legend model because of its class count.
+    for names in ({0: "title", 1: "main_map"}, {0: "text", 1: "color"}, {0: "0", 1: "1"}):
+        try:
+            structure.detection_keys(names)
+        except ValueError:
+            continue
+        raise AssertionError(names)
+
+def test_boxes_grouped_by_class():
+    boxes = fake_boxes([
+        [10.9, 20.2, 100.7, 80.99, 0.9, 1],
+        [0.5, 0.5, 50.5, 10.5, 0.8, 0],
+        [30, 30, 30, 60, 0.7, 2],     # no width
+        [40, 70, 90, 70, 0.7, 3],     # no height
+        [60, 10, 20, 40, 0.6, 0],     # inverted
+        [200.2, 300.8, 250.1, 310.9, 0.5, 1],
+    ])
+    result = structure.group_boxes(boxes, structure.region_keys)
+    assert list(result) == list(structure.region_keys.values())
+    # invalid boxes are dropped, coordinates truncated, detection order kept.
+    assert result["main_map"] == [[10, 20, 100, 80], [200, 300, 250, 310]]
+    assert result["title"] == [[0, 0, 50, 10]]
+    assert result["legend"] == [] and result["scale"] == [] and result["others"] == []
+    assert all(isinstance(v, int) for box in result["main_map"] for v in box)
+
+def test_empty_results():
+    assert structure.group_boxes(None, structure.legend_keys) == {"color_bndbox": [], "text_bndbox": []}
+    assert structure.group_boxes(fake_boxes([]), structure.region_keys) == {key: [] for key in structure.region_keys.values()}
+
+if __name__ == "__main__":
+    test_keys_come_from_the_class_names()
+    test_boxes_grouped_by_class()
+    test_empty_results()
+    print("[OK] 检测结果分组测试通过")
@@ -0,0 +1,180 @@
+"""
+测试端点熔断、对冲请求与重试 (utils/endpoint.py, utils/api.py)，请求发往本地模拟服务 (mock_server.py)
+"""
+import os
+import sys
+import time
+import threading
+import tempfile
+import contextlib
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "dummy")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import api
+import cache
+import metrics
+import endpoint
+import ratelimit
+from mock_server import start_mock_server
+
+messages = [{"role": "user", "content": "What is the title of this map?"}]
+
+def new_endpoint(name, base_url="http://127.0.0.1:1/v1", model="mock", **breaker):
+    return endpoint.endpoint(name, base_url, "dummy", model, endpoint.circuit_breaker(**breaker) if breaker else None)
+
+def server_url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+@contextlib.contextmanager
+def patched(module, **values):
+    previous = {name: getattr(module, name) for name in values}
+    for name, value in values.items():
+        setattr(module, name, value)
+    try:
+        yield
+    finally:
+        for name, value in previous.items():
+            setattr(module, name, value)
+
+def test_breaker_opens_and_lets_one_probe_through():
+    breaker = endpoint.circuit_breaker(window=4, min_calls=4, failure_rate=0.5, cooldown=0.1)
+    for success in (True, False, True, False):
+        breaker.record(success)
+    assert breaker.state == "open" and not breaker.allow()
+    time.sleep(0.12)
+    assert breaker.state == "half_open"
+    assert breaker.allow() and not breaker.allow()
+    # a failed probe opens the breaker again, a successful one closes it.
+    breaker.record(False)
+    assert breaker.state == "open"
+    time.sleep(0.12)
+    assert breaker.allow()
+    breaker.record(True)
+    assert breaker.state == "closed" and breaker.allow() and breaker.allow()
+
+def test_unsent_probe_expires():
+    breaker = endpoint.circuit_breaker(window=1, min_calls=1, cooldown=0.05)
+    breaker.record(False)
+    time.sleep(0.06)
+    assert breaker.allow() and not breaker.allow()
+    time.sleep(0.06)
+    assert breaker.allow()
+
+def test_hedge_delay_per_label():
+    primary = new_endpoint("primary")
+    pool = endpoint.endpoint_pool([primary, new_endpoint("backup")], hedge_delay=20.0, hedge_min_delay=0.0, hedge_min_samples=5)
+    for _ in range(10):
+        primary.record(True, 0.01, "hie.title")
+        primary.record(True, 1.0, "peqa.answer")
+    assert pool.hedge_delay(primary, "hie.title") == 0.01
+    assert pool.hedge_delay(primary, "peqa.answer") == 1.0
+    assert pool.hedge_delay(primary, "dki.consult") == 20.0
+    assert primary.latency_percentile(50) in (0.01, 1.0)
+
+def test_hedge_goes_through_acquire():
+    primary, backup = new_endpoint("primary"), new_endpoint("backup")
+    pool = endpoint.endpoint_pool([primary, backup], hedge_delay=0.05)
+    acquired = list()
+    def func(api_endpoint):
+        time.sleep(0.3 if api_endpoint is primary else 0.0)
+        return api_endpoint.name
+    assert pool.call(func, label="peqa.answer", acquire=lambda: acquired.append(1)) == "backup"
+    assert len(acquired) == 1 and pool.stats()["hedges"] == 1 and pool.stats()["hedge_wins"] == 1
+    # no duplicate when the backup is open.
+    for _ in range(5):
+        backup.breaker.record(False)
+    assert pool.call(func, label="peqa.answer", acquire=lambda: acquired.append(1)) == "primary"
+    assert len(acquired) == 1
+
+def test_half_open_endpoint_takes_one_call():
+    primary = new_endpoint("primary", window=1, min_calls=1, cooldown=0.05)
+    pool = endpoint.endpoint_pool([primary, new_endpoint("backup")], hedge_percentile=0)
+    primary.breaker.record(False)
+    time.sleep(0.06)
+    started = threading.Event()
+    release = threading.Event()
+    def probe(api_endpoint):
+        started.set()
+        release.wait(1.0)
+        return api_endpoint.name
+    thread = threading.Thread(target=lambda: pool.call(probe))
+    thread.start()
+    started.wait(1.0)
+    # the probe is in flight, other calls go to the backup.
+    assert pool.call(lambda api_endpoint: api_endpoint.name) == "backup"
+    release.set()
+    thread.join()
+
+def test_failover_to_backup_and_cache_model():
+    server = start_mock_server(["--port", "0"])
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            pool = endpoint.endpoint_pool([new_endpoint("primary", model="main"), new_endpoint("backup", server_url(server), model="backup")], hedge_percentile=0)
+            responses = cache.response_cache(os.path.join(folder, "responses.sqlite"))
+            with patched(api, endpoints=pool, limiter=ratelimit.rate_limiter(), backoff_base=0.01, response_cache=responses):
+                call = metrics.call_record("test.failover")
+                assert api.request_answer(messages, call=call) == "mock"
+                # the connection error of the primary is retried on the backup, which answered.
+                assert call.attempts == 2 and call.model == "backup"
+                # answers are cached under the model that produced them.
+                assert api.answer_wrapper(messages, label="test.failover") == "mock"
+                assert responses.get(responses.key("backup", messages, 2048, 0.0, False, None)) is not None
+                assert responses.get(responses.key("main", messages, 2048, 0.0, False, None)) is None
+                requests = server.stats()["requests"]
+                assert api.answer_wrapper(messages, label="test.failover") == "mock"
+                assert server.stats()["requests"] == requests
+    finally:
+        server.shutdown()
+
+def test_retry_after_pauses_the_limiter():
+    server = start_mock_server(["--port", "0", "--rate_limit_rate", "1.0", "--retry_after", "0.2"])
+    try:
+        pool = endpoint.endpoint_pool([new_endpoint("primary", server_url(server))], hedge_percentile=0)
+        limiter = ratelimit.rate_limiter()
+        with patched(api, endpoints=pool, limiter=limiter, max_attempts=2):
+            call = metrics.call_record("test.rate_limit")
+            start = time.monotonic()
+            assert api.request_answer(messages, call=call) is None
+            # the retry waits for Retry-After instead of the backoff, other requests are held by the limiter.
+            assert call.attempts == 2 and time.monotonic() - start >= 0.2
+            assert limiter.blocked_until >= start + 0.2
+            assert server.stats()["rate_limit"] == 2
+    finally:
+        server.shutdown()
+
+def test_content_filter_is_not_retried():
+    server = start_mock_server(["--port", "0", "--content_filter_rate", "1.0"])
+    try:
+        pool = endpoint.endpoint_pool([new_endpoint("primary", server_url(server))], hedge_percentile=0)
+        with patched(api, endpoints=pool, limiter=ratelimit.rate_limiter()):
+            call = metrics.call_record("test.content_filter")
+            assert api.request_answer(messages, call=call) is None
+            assert call.attempts == 1 and server.stats()["content_filter"] == 1
+    finally:
+        server.shutdown()
+
+def test_slow_primary_is_hedged_through_the_limiter():
+    slow = start_mock_server(["--port", "0", "--latency", "0.5"])
+    fast = start_mock_server(["--port", "0"])
+    try:
+        pool = endpoint.endpoint_pool([new_endpoint("primary", server_url(slow)), new_endpoint("backup", server_url(fast))], hedge_delay=0.05)
+        limiter = ratelimit.rate_limiter()
+        with patched(api, endpoints=pool, limiter=limiter):
+            assert api.request_answer(messages, call=metrics.call_record("test.hedge")) == "mock"
+            assert limiter.stats()["acquired"] == 2 and pool.stats()["hedge_wins"] == 1
+    finally:
+        slow.shutdown()
+        fast.shutdown()
+
+if __name__ == "__main__":
+    test_breaker_opens_and_lets_one_probe_through()
+    test_unsent_probe_expires()
+    test_hedge_delay_per_label()
+    test_hedge_goes_through_acquire()
+    test_half_open_endpoint_takes_one_call()
+    test_failover_to_backup_and_cache_model()
+    test_retry_after_pauses_the_limiter()
+    test_content_filter_is_not_retried()
+    test_slow_primary_is_hedged_through_the_limiter()
+    print("[OK] 端点与重试测试通过")
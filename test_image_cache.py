@@ -0,0 +1,170 @@
+"""
+测试解码图像缓存与内存中的地图组件裁剪 (utils/vision.py)
+"""
+import os
+import sys
+import time
+import base64
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import vision
+
+def write_image(path, value, size=(64, 48)):
+    cv2.imwrite(path, np.full((size[1], size[0], 3), value, dtype=np.uint8))
+
+def test_decode_once_and_invalidate():
+    with tempfile.TemporaryDirectory() as folder:
+        cache = vision.image_cache(max_mb=16)
+        path = os.path.join(folder, "map.png")
+        write_image(path, 100)
+        image = cache.get(path)
+        assert cache.get(path) is image
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+        assert not image.flags.writeable
+
+        # a rewritten file is decoded again.
+        time.sleep(0.01)
+        write_image(path, 200)
+        assert cache.get(path)[0, 0, 0] == 200
+
+def test_shape_reads_header_only():
+    with tempfile.TemporaryDirectory() as folder:
+        cache = vision.image_cache(max_mb=16)
+        path = os.path.join(folder, "map.png")
+        write_image(path, 100, size=(640, 480))
+        assert cache.shape(path) == (480, 640)
+        assert cache.stats()["misses"] == 0 and cache.stats()["images"] == 0
+
+def test_memory_budget():
+    with tempfile.TemporaryDirectory() as folder:
+        image_bytes = 64 * 48 * 3
+        cache = vision.image_cache(max_mb=2.5 * image_bytes / 1024 / 1024)
+        paths = [os.path.join(folder, f"{i}.png") for i in range(3)]
+        for i, path in enumerate(paths):
+            write_image(path, i)
+            cache.get(path)
+        assert cache.stats()["images"] == 2 and cache.size <= cache.max_size
+        cache.get(paths[0])
+        assert cache.stats()["misses"] == 4
+
+def test_saved_crops_are_not_decoded_again():
+    with tempfile.TemporaryDirectory() as folder:
+        image = np.random.randint(0, 255, (100, 120, 3), dtype=np.uint8)
+        crop_path = os.path.join(folder, "legend_0.png")
+        misses = vision.images.stats()["misses"]
+        crop = vision.crop_and_save_image(image, (10, 20, 60, 80), crop_path)
+        assert vision.load_image(crop_path) is crop
+        assert vision.images.stats()["misses"] == misses
+        assert vision.image_size(crop_path) == (60, 50)
+
+def test_crop_persistence_modes():
+    with tempfile.TemporaryDirectory() as folder:
+        image = np.random.randint(0, 255, (100, 120, 3), dtype=np.uint8)
+        paths = {persist: os.path.join(folder, persist, "title_0.png") for persist in ["sync", "async", "off"]}
+        for persist, path in paths.items():
+            vision.save_image(path, vision.crop_image(image, (0, 0, 50, 40)), persist=persist)
+        vision.writer.flush()
+        assert os.path.exists(paths["sync"]) and os.path.exists(paths["async"])
+        assert not os.path.exists(paths["off"]) and vision.image_exists(paths["off"])
+        assert np.array_equal(cv2.imread(paths["async"]), image[:40, :50])
+        # crops on disk are sent from the file, crops only in memory are encoded once from their pixels.
+        assert vision.image_data_url(paths["async"]) is None
+        url = vision.image_data_url(paths["off"])
+        assert url.startswith("data:image/png;base64,") and vision.image_data_url(paths["off"]) is url
+        decoded = cv2.imdecode(np.frombuffer(base64.b64decode(url.split(",", 1)[1]), np.uint8), cv2.IMREAD_COLOR)
+        assert np.array_equal(decoded, image[:40, :50])
+
+def test_superseded_crop_is_not_written():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "index_map_0.png")
+        first = vision.crops.put(path, np.zeros((8, 8, 3), dtype=np.uint8))
+        vision.save_image(path, np.full((8, 8, 3), 255, dtype=np.uint8), persist="sync")
+        vision.writer.submit(first)
+        vision.writer.flush()
+        assert cv2.imread(path)[0, 0, 0] == 255
+
+def test_crops_are_copies_within_a_byte_budget():
+    with tempfile.TemporaryDirectory() as folder:
+        image = np.random.randint(0, 255, (400, 400, 3), dtype=np.uint8)
+        store = vision.crop_store(max_mb=2.5 * 100 * 100 * 3 / 1024 / 1024)
+        paths = [os.path.join(folder, f"crop_{i}.png") for i in range(3)]
+        entries = list()
+        for i, path in enumerate(paths):
+            entries.append(store.put(path, image[i * 100:(i + 1) * 100, :100]))
+            if i < 2:
+                vision.write_encoded(entries[-1])
+        # the map is not kept alive by its crops.
+        assert all(entry.image.base is None for entry in entries)
+        assert store.get(paths[0]) is None and store.stats()["crops"] == 2
+        # encoded bytes count against the budget too, random pixels do not compress.
+        entries[2].data_url()
+        assert store.get(paths[1]) is None and store.size == entries[2].nbytes
+
+def test_unwritten_crops_are_not_evicted():
+    with tempfile.TemporaryDirectory() as folder:
+        image = np.random.randint(0, 255, (400, 400, 3), dtype=np.uint8)
+        store = vision.crop_store(max_mb=1.5 * 100 * 100 * 3 / 1024 / 1024)
+        main_map = os.path.join(folder, "main_map_0.png")
+        # a crop queued for writing is the only copy until the writer is done.
+        entry = store.put(main_map, image[:100, :100])
+        store.mark_pending(entry)
+        off = store.put(os.path.join(folder, "lonlat_0.png"), image[100:200, :100])
+        store.put(os.path.join(folder, "index_map_0.png"), image[200:300, :100])
+        assert store.get(main_map) is entry and store.get(off.path) is off
+        assert store.size > store.max_size and store.stats()["pending"] == 1
+        # once on disk it can go.
+        vision.write_encoded(entry)
+        store.put(os.path.join(folder, "title_0.png"), image[300:, :100])
+        assert store.get(main_map) is None and store.get(off.path) is off
+        assert np.array_equal(cv2.imread(main_map), image[:100, :100])
+
+def test_written_crops_are_released():
+    with tempfile.TemporaryDirectory() as folder:
+        image = np.random.randint(0, 255, (100, 120, 3), dtype=np.uint8)
+        written = os.path.join(folder, "map", "title_0.png")
+        kept = os.path.join(folder, "map", "scale_0.png")
+        entry = vision.save_image(written, vision.crop_image(image, (0, 0, 50, 40)), persist="sync")
+        vision.save_image(kept, vision.crop_image(image, (0, 0, 30, 20)), persist="off")
+        # encoded bytes are dropped once on disk, the data url is read from the file.
+        assert entry.data is None and entry.url is None
+        assert vision.image_data_url(written) is None
+        vision.crops.release_folder(os.path.join(folder, "map"))
+        assert vision.crops.get(written) is None and vision.crops.get(kept) is not None
+        assert np.array_equal(vision.load_image(written), image[:40, :50])
+        # a crop still queued when its map is released is dropped by the writer.
+        queued = vision.crops.put(os.path.join(folder, "map", "lonlat_0.png"), vision.crop_image(image, (0, 0, 20, 20)))
+        vision.crops.release_folder(os.path.join(folder, "map"))
+        assert vision.crops.get(queued.path) is queued
+        vision.writer.submit(queued)
+        vision.writer.flush()
+        assert vision.crops.get(queued.path) is None and os.path.exists(queued.path)
+
+def test_encode_data_url_cached_by_content():
+    image = np.random.default_rng(0).integers(0, 255, (120, 80, 3), dtype=np.uint8)
+    view = image[10:70, 5:65]
+    url = vision.encode_data_url(view)
+    assert url.startswith("data:image/png;base64,")
+    decoded = cv2.imdecode(np.frombuffer(base64.b64decode(url.split(",", 1)[1]), np.uint8), cv2.IMREAD_COLOR)
+    assert np.array_equal(decoded, view)
+    hits = vision.encoded_urls.stats()["hits"]
+    assert vision.encode_data_url(view.copy()) == url
+    assert vision.encoded_urls.stats()["hits"] == hits + 1
+    # views are hashed in place, with the same key as a contiguous copy.
+    assert vision.encoded_urls.key(view, "png", 90) == vision.encoded_urls.key(np.ascontiguousarray(view), "png", 90)
+    assert vision.encoded_urls.key(view, "png", 90) != vision.encoded_urls.key(image[10:70, 6:66], "png", 90)
+
+if __name__ == "__main__":
+    test_decode_once_and_invalidate()
+    test_shape_reads_header_only()
+    test_memory_budget()
+    test_saved_crops_are_not_decoded_again()
+    test_crop_persistence_modes()
+    test_superseded_crop_is_not_written()
+    test_crops_are_copies_within_a_byte_budget()
+    test_unwritten_crops_are_not_evicted()
+    test_written_crops_are_released()
+    test_encode_data_url_cached_by_content()
+    print("[OK] 图像缓存测试通过")
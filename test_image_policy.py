@@ -0,0 +1,41 @@
+"""
+测试发送给模型的图像的缩放与重新编码策略 (utils/vision.py, utils/prompt.py)
+"""
+import os
+import sys
+import json
+import base64
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import vision
+import prompt
+
+def test_resize_keeps_aspect_ratio():
+    image = np.zeros((3000, 4000, 3), dtype=np.uint8)
+    resized, scale = vision.resize_to_fit(image, max_side=1000)
+    assert resized.shape[:2] == (750, 1000) and scale == 0.25
+    resized, scale = vision.resize_to_fit(image, max_pixels=1200 * 900)
+    assert resized.shape[:2] == (900, 1200)
+    # never upscaled.
+    resized, scale = vision.resize_to_fit(image, max_side=8000)
+    assert resized is image and scale == 1.0
+
+def test_policy_data_url():
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "map.png")
+        cv2.imwrite(path, np.random.default_rng(0).integers(0, 255, (2400, 3200, 3), dtype=np.uint8))
+        url, scale = vision.policy_data_url(path, {"format": "jpeg", "max_side": 800, "quality": 80})
+        assert url.startswith("data:image/jpeg;base64,") and scale == 0.25
+        sent = cv2.imdecode(np.frombuffer(base64.b64decode(url.split(",", 1)[1]), np.uint8), cv2.IMREAD_COLOR)
+        assert sent.shape[:2] == vision.scaled_size(2400, 3200, scale) == (600, 800)
+
+def test_policy_lookup_and_grounding_rescale():
+    assert prompt.get_image_policy(question_type="extracting-scale") is prompt.image_policies["extracting"]
+    assert prompt.get_image_policy(component="title") is prompt.image_policies["title"]
+    assert prompt.is_grounding("grounding-title_by_name") and not prompt.is_grounding("extracting-scale")
+    answer = json.dumps({"answer": [10, 20, 30.5, 40], "reason": "XXX"})
+    assert json.loads(prompt.rescale_grounding_answer(answer, 0.25))["answer"] == [40, 80, 122, 160]
+    assert prompt.rescale_grounding_answer("not json", 0.25) == "not json"
@@ -0,0 +1,40 @@
+"""
+测试按需加载 (copilot模块单例与common.lazy_property)
+"""
+import os
+import sys
+import time
+import threading
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from utils import common
+
+def test_import_copilot_loads_nothing_heavy():
+    import copilot
+    assert len(copilot.module_instances) == 0
+    for heavy in ["geopandas", "transformers", "dependencies.ultralytics", "matplotlib.pyplot"]:
+        assert heavy not in sys.modules, heavy
+
+def test_lazy_property_builds_once():
+    class holder:
+        builds = 0
+        @common.lazy_property
+        def model(self):
+            time.sleep(0.05)
+            holder.builds += 1
+            return object()
+
+    instance = holder()
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(instance.model)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert holder.builds == 1
+    assert all(result is results[0] for result in results)
+
+if __name__ == "__main__":
+    test_import_copilot_loads_nothing_heavy()
+    test_lazy_property_builds_once()
+    print("[OK] 按需加载测试通过")
@@ -0,0 +1,70 @@
+"""
+测试图例OCR的合并请求模式 (agents/geologist.py)，模型回答为桩函数
+"""
+import os
+import sys
+import json
+import threading
+import contextlib
+import numpy as np
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "dummy")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+from agents import geologist
+
+@contextlib.contextmanager
+def stub_answers(packed_answer):
+    # each unit image is sent as "unit<i>", its first pixel; single requests answer "Legend: text <i>".
+    calls = list()
+    lock = threading.Lock()
+    def answer_wrapper(messages, structured=False, label=None, **kwargs):
+        units = [item["image_url"]["url"] for item in messages[1]["content"] if item["type"] == "image_url"]
+        with lock:
+            calls.append((label, units))
+        if label == "hie.legend_ocr_packed":
+            return packed_answer(units)
+        return f"Legend: text {units[0][4:]}"
+    previous = geologist.api.answer_wrapper, geologist.api.input_image_to_data_url
+    geologist.api.answer_wrapper = answer_wrapper
+    geologist.api.input_image_to_data_url = lambda image, is_bgr=False: f"unit{int(image[0, 0, 0])}"
+    try:
+        yield calls
+    finally:
+        geologist.api.answer_wrapper, geologist.api.input_image_to_data_url = previous
+
+def units(n):
+    return [np.full((4, 4, 3), i, dtype=np.uint8) for i in range(n)]
+
+def test_partial_answer_falls_back_per_unit():
+    agent = geologist.geologist_agent(ocr_mode="packed")
+    with stub_answers(lambda _: json.dumps({"0": "Q: 第四系", "2": ["x"], "7": "extra"})) as calls:
+        texts = agent.ocr_legend_units(units(3))
+    # missing and non-string units are asked again one by one.
+    assert texts == ["第四系", "text 1", "text 2"]
+    assert [label for label, _ in calls] == ["hie.legend_ocr_packed", "hie.legend_ocr", "hie.legend_ocr"]
+
+def test_malformed_answer_falls_back_to_single_requests():
+    agent = geologist.geologist_agent(ocr_mode="packed")
+    for answer in ['{"0": "Q: 第四系"', '["a", "b"]', None]:
+        with stub_answers(lambda _: answer) as calls:
+            assert agent.ocr_legend_units(units(2)) == ["text 0", "text 1"]
+        assert len(calls) == 3
+
+def test_legends_are_packed_by_pack_size():
+    agent = geologist.geologist_agent(ocr_mode="packed", ocr_pack_size=2)
+    image = np.zeros((10, 50, 3), dtype=np.uint8)
+    legends = list()
+    for i in range(5):
+        image[:, i * 10:(i + 1) * 10] = i
+        legends.append({"text_bndbox": [i * 10, 0, (i + 1) * 10, 10]})
+    legends.append({"text_bndbox": [40, 0, 60, 10]})
+    with stub_answers(lambda sent: json.dumps({str(j): f"packed {unit[4:]}" for j, unit in enumerate(sent)})) as calls:
+        agent.extract_legend_text(image, legends)
+    assert [legend["text"] for legend in legends] == ["packed 0", "packed 1", "packed 2", "packed 3", "packed 4", "unknown"]
+    assert sorted(units for _, units in calls) == [["unit0", "unit1"], ["unit2", "unit3"], ["unit4"]]
+
+if __name__ == "__main__":
+    test_partial_answer_falls_back_per_unit()
+    test_malformed_answer_falls_back_to_single_requests()
+    test_legends_are_packed_by_pack_size()
+    print("[OK] 图例OCR测试通过")
@@ -0,0 +1,71 @@
+"""
+测试调用耗时与令牌统计 (utils/metrics.py)
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import metrics
+import scheduler
+
+def fake_call(label, prompt_tokens=100, completion_tokens=10, attempts=1):
+    call = metrics.call_record(label, images=1)
+    call.attempts = attempts
+    call.queue_time = 0.5
+    call.prompt_tokens = prompt_tokens
+    call.completion_tokens = completion_tokens
+    call.finish(True)
+    metrics.record(call)
+
+def test_rollup_per_label_and_stage():
+    with metrics.collect() as collector:
+        fake_call("hie.title")
+        fake_call("hie.scale", attempts=3)
+        fake_call("peqa.answer", prompt_tokens=1000, completion_tokens=200)
+    summary = collector.summary()
+    assert summary["total"]["calls"] == 3
+    assert summary["stages"]["hie"]["calls"] == 2 and summary["stages"]["hie"]["retries"] == 2
+    assert summary["labels"]["peqa.answer"]["prompt_tokens"] == 1000
+    assert summary["total"]["queue_time"] == 1.5
+    assert "hie.title" in metrics.format_summary(summary)
+
+def test_collectors_follow_worker_threads():
+    with metrics.collect() as outer:
+        scheduler.parallel_map(lambda i: fake_call(f"ocr.{i % 2}"), range(8), max_workers=4)
+        with metrics.collect() as inner:
+            pipeline = scheduler.stage_scheduler(max_workers=2)
+            pipeline.add_stage("a", lambda: fake_call("rai"))
+            pipeline.add_stage("b", lambda a: fake_call("dki.select"), deps=("a",))
+            pipeline.run()
+    assert outer.summary()["total"]["calls"] == 8
+    assert inner.summary()["total"]["calls"] == 2
+    assert metrics.process_summary()["total"]["calls"] >= 10
+
+def test_collector_keeps_running_totals():
+    collector = metrics.collector()
+    for i in range(1000):
+        call = metrics.call_record(f"ocr.{i % 3}")
+        call.prompt_tokens = 10
+        call.finish(i % 10 != 0)
+        collector.add(call)
+    summary = collector.summary()
+    assert summary["total"]["calls"] == 1000 and summary["total"]["failed"] == 100
+    assert summary["stages"]["ocr"]["prompt_tokens"] == 10000 and len(summary["labels"]) == 3
+    # summaries are copies, the running totals are not rounded or changed by them.
+    summary["total"]["calls"] = 0
+    assert collector.summary()["total"]["calls"] == 1000
+
+def test_component_stats_in_process_summary():
+    metrics.register_stats("test_limiter", lambda: {"acquired": 3, "queue_time_max": 0.5})
+    metrics.register_stats("test_pool", lambda: {"hedges": 1, "endpoints": [{"name": "primary", "state": "closed"}]})
+    summary = metrics.process_summary()
+    assert summary["components"]["test_limiter"]["acquired"] == 3
+    text = metrics.format_summary(summary)
+    assert "test_limiter: acquired=3, queue_time_max=0.5" in text and "  primary: state=closed" in text
+
+if __name__ == "__main__":
+    test_rollup_per_label_and_stage()
+    test_collectors_follow_worker_threads()
+    test_collector_keeps_running_totals()
+    test_component_stats_in_process_summary()
+    print("[OK] 调用统计测试通过")
@@ -0,0 +1,112 @@
+"""
+测试YOLOv10版面检测的按类别框仲裁 (dependencies/ultralytics/models/yolov10/arbitration.py)，与原逐类循环实现对比
+"""
+import os
+import importlib.util
+import torch
+
+# loaded by path, the ultralytics package itself needs the full detection environment.
+root = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location("arbitration", os.path.join(root, "dependencies", "ultralytics", "models", "yolov10", "arbitration.py"))
+arbitration = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(arbitration)
+
+try:
+    from torchvision.ops import box_iou
+except ImportError:
+    def box_iou(boxes1, boxes2):
+        area1 = (boxes1[:, 2] - boxes1[:, 0]) * (boxes1[:, 3] - boxes1[:, 1])
+        area2 = (boxes2[:, 2] - boxes2[:, 0]) * (boxes2[:, 3] - boxes2[:, 1])
+        lt = torch.max(boxes1[:, None, :2], boxes2[:, :2])
+        rb = torch.min(boxes1[:, None, 2:], boxes2[:, 2:])
+        wh = (rb - lt).clamp(min=0)
+        inter = wh[:, :, 0] * wh[:, :, 1]
+        return inter / (area1[:, None] + area2 - inter)
+
+def reference_process_boxes(pred):
+    # the former per-class loop of models/yolov10/predict.py.
+    pred = pred.cpu()
+    unique_classes = pred[:, -1].unique()
+    kept_boxes = []
+    for cls in unique_classes:
+        if cls == 7 or cls == 4 or cls == 6 or cls == 5:
+            continue
+        cls_mask = pred[:, -1] == cls
+        cls_boxes = pred[cls_mask][:, :4]
+        if len(cls_boxes) == 0:
+            continue
+        other_classes = unique_classes[unique_classes != cls]
+        if len(other_classes) > 0:
+            other_class_mask = torch.zeros(pred.shape[0], dtype=torch.bool)
+            for oc in other_classes:
+                other_class_mask |= pred[:, -1] == oc
+            other_boxes = pred[other_class_mask][:, :4]
+            ious = box_iou(cls_boxes, other_boxes)
+            min_ious, _ = torch.min(ious, dim=1)
+            min_iou_idx = torch.argmin(min_ious)
+            best_box = cls_boxes[min_iou_idx]
+        else:
+            areas = (cls_boxes[:, 2] - cls_boxes[:, 0]) * (cls_boxes[:, 3] - cls_boxes[:, 1])
+            max_area_idx = torch.argmax(areas)
+            best_box = cls_boxes[max_area_idx]
+        kept_boxes.append(torch.cat([best_box, torch.tensor([cls])]))
+    if kept_boxes:
+        kept_boxes = torch.stack(kept_boxes)
+    else:
+        return pred
+    keep_mask = torch.zeros(pred.shape[0], dtype=torch.bool)
+    for box in kept_boxes:
+        cls = box[-1].item()
+        box_coords = box[:4]
+        mask = (pred[:, -1] == cls) & (torch.all(pred[:, :4] == box_coords, dim=1))
+        keep_mask |= mask
+    for cls in (7, 4, 6, 5):
+        keep_mask |= pred[:, -1] == cls
+    return pred[keep_mask]
+
+def random_pred(generator, n, classes):
+    xy = torch.randint(0, 400, (n, 2), generator=generator).float()
+    wh = torch.randint(1, 300, (n, 2), generator=generator).float()
+    conf = torch.rand(n, generator=generator)
+    cls = torch.tensor(classes, dtype=torch.float32)[torch.randint(0, len(classes), (n,), generator=generator)]
+    return torch.cat([xy, xy + wh, conf[:, None], cls[:, None]], dim=1)
+
+def test_process_boxes_matches_reference():
+    generator = torch.Generator().manual_seed(0)
+    cases = [random_pred(generator, n, list(range(8))) for n in (1, 2, 5, 12, 40, 100) for _ in range(20)]
+    cases += [random_pred(generator, n, [2]) for n in (1, 3, 10)]  # a single class
+    cases += [random_pred(generator, n, [4, 5, 6, 7]) for n in (1, 6)]  # nothing to arbitrate
+    cases += [random_pred(generator, 6, [0, 1]).repeat(2, 1)]  # duplicated boxes
+    cases += [torch.zeros((0, 6))]
+    for pred in cases:
+        assert torch.equal(arbitration.process_boxes(pred), reference_process_boxes(pred))
+
+def test_process_boxes_ties_keep_first():
+    # two disjoint class 0 boxes tie at IoU 0 with the class 1 box, the first one wins like torch.argmin.
+    pred = torch.tensor([
+        [0, 0, 10, 10, 0.9, 0],
+        [20, 20, 30, 30, 0.8, 0],
+        [50, 50, 60, 60, 0.7, 1],
+        [0, 0, 5, 5, 0.6, 4],
+    ])
+    assert torch.equal(arbitration.process_boxes(pred), pred[[0, 2, 3]])
+
+def test_process_boxes_degenerate_boxes():
+    # zero-area boxes give NaN IoUs (0 / 0) against each other, they are picked first like torch.argmin picks NaN.
+    cases = [
+        torch.tensor([[5, 5, 5, 5, 0.9, 0], [0, 0, 10, 10, 0.8, 0], [5, 5, 5, 5, 0.7, 1], [20, 20, 30, 30, 0.6, 1]]),
+        torch.tensor([[5, 5, 5, 5, 0.9, 0], [5, 5, 5, 5, 0.8, 1]]),
+        torch.tensor([[0, 0, 10, 10, 0.9, 0], [5, 5, 5, 9, 0.9, 0], [5, 5, 5, 9, 0.8, 1], [0, 0, 3, 3, 0.8, 1]]),
+        torch.tensor([[5, 5, 5, 5, 0.9, 2], [1, 1, 5, 5, 0.8, 2]]),
+        torch.tensor([[5, 5, 5, 5, 0.9, 0], [0, 0, 10, 10, 0.8, 1], [4, 4, 4, 4, 0.7, 5]]),
+    ]
+    generator = torch.Generator().manual_seed(1)
+    for _ in range(50):
+        pred = random_pred(generator, 12, list(range(8)))
+        flat = torch.rand(12, generator=generator) < 0.4
+        pred[flat, 2] = pred[flat, 0]
+        cases.append(pred)
+    for pred in cases:
+        assert torch.equal(arbitration.process_boxes(pred), reference_process_boxes(pred))
+    # both flat boxes are kept, neither is dropped for its NaN IoU.
+    assert torch.equal(arbitration.process_boxes(cases[1]), cases[1])
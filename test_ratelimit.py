@@ -0,0 +1,46 @@
+"""
+测试请求与令牌限流 (utils/ratelimit.py)
+"""
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from ratelimit import token_bucket, rate_limiter
+
+def test_token_bucket_borrows_and_refills():
+    bucket = token_bucket(rate=10.0, capacity=2)
+    bucket.updated = 0.0
+    assert bucket.reserve(1, now=0.0) == 0.0
+    assert bucket.reserve(1, now=0.0) == 0.0
+    # the third token is borrowed from the future, 1 token at 10 per second.
+    assert abs(bucket.reserve(1, now=0.0) - 0.1) < 1e-9
+    # refilled up to capacity only.
+    bucket.reserve(0, now=10.0)
+    assert bucket.tokens == 2
+
+def test_limiter_queues_above_the_token_rate():
+    limiter = rate_limiter(tokens_per_minute=6000)
+    assert limiter.acquire(6000) == 0.0
+    wait = limiter.acquire(20)
+    assert 0.15 < wait <= 0.2
+    stats = limiter.stats()
+    assert stats["acquired"] == 2 and stats["queue_time_max"] == round(wait, 3)
+
+def test_settle_returns_unused_tokens():
+    limiter = rate_limiter(tokens_per_minute=6000)
+    limiter.acquire(6000)
+    limiter.settle(6000, 5980)
+    assert limiter.acquire(20) < 0.01
+
+def test_pause_blocks_every_request():
+    limiter = rate_limiter(requests_per_minute=6000)
+    limiter.pause(0.2)
+    assert 0.15 < limiter.acquire() <= 0.2
+    assert limiter.acquire() < 0.01
+
+if __name__ == "__main__":
+    test_token_bucket_borrows_and_refills()
+    test_limiter_queues_above_the_token_rate()
+    test_settle_returns_unused_tokens()
+    test_pause_blocks_every_request()
+    print("[OK] 限流测试通过")
@@ -0,0 +1,58 @@
+"""
+测试响应缓存 (utils/cache.py)
+"""
+import os
+import sys
+import time
+import base64
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+from cache import response_cache, normalize_request
+
+def image_message(data):
+    url = "data:image/png;base64," + base64.b64encode(data).decode("utf-8")
+    return [{"role": "user", "content": [{"type": "image_url", "image_url": {"url": url}}, {"type": "text", "text": "OCR"}]}]
+
+def test_hit_and_miss():
+    with tempfile.TemporaryDirectory() as folder:
+        cache = response_cache(os.path.join(folder, "responses.sqlite"))
+        key = cache.key("qwen-vl-max", image_message(b"legend"), 2048, 0.0, False, None)
+        assert cache.get(key) is None
+        cache.put(key, {"type": "text", "value": "Sandstone"})
+        assert cache.get(key) == {"type": "text", "value": "Sandstone"}
+        assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+def test_key_hashes_image_content():
+    with tempfile.TemporaryDirectory() as folder:
+        cache = response_cache(os.path.join(folder, "responses.sqlite"))
+        key1 = cache.key("qwen-vl-max", image_message(b"legend"), 2048, 0.0, False, None)
+        key2 = cache.key("qwen-vl-max", image_message(b"legend"), 2048, 0.0, False, None)
+        key3 = cache.key("qwen-vl-max", image_message(b"title"), 2048, 0.0, False, None)
+        key4 = cache.key("qwen-vl-max", image_message(b"legend"), 2048, 0.0, True, None)
+        assert key1 == key2
+        assert key1 != key3 and key1 != key4
+        assert "sha256:" in str(normalize_request(image_message(b"legend")))
+
+def test_ttl_and_lru_eviction():
+    with tempfile.TemporaryDirectory() as folder:
+        cache = response_cache(os.path.join(folder, "responses.sqlite"), ttl=0.05)
+        cache.put("expired", {"type": "text", "value": "old"})
+        time.sleep(0.1)
+        assert cache.get("expired") is None
+
+        value_size = len('{"type": "text", "value": "%s"}' % ("x" * 1000))
+        cache = response_cache(os.path.join(folder, "lru.sqlite"), max_size_mb=2.5 * value_size / 1024 / 1024)
+        for key in ("a", "b"):
+            cache.put(key, {"type": "text", "value": "x" * 1000})
+            time.sleep(0.01)
+        cache.get("a")
+        cache.put("c", {"type": "text", "value": "x" * 1000})
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+
+if __name__ == "__main__":
+    test_hit_and_miss()
+    test_key_hashes_image_content()
+    test_ttl_and_lru_eviction()
+    print("[OK] 响应缓存测试通过")
@@ -0,0 +1,68 @@
+"""
+测试流式回答的分块重组与部分答案 (utils/api.py, utils/prompt.py)，请求发往本地模拟服务 (mock_server.py)
+"""
+import os
+import sys
+import json
+
+os.environ.setdefault("DASHSCOPE_API_KEY", "dummy")
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import api
+import prompt
+import metrics
+import endpoint
+import ratelimit
+from mock_server import start_mock_server
+
+messages = [{"role": "user", "content": "What is the title of this map?"}]
+expected = json.dumps({"answer": "mock", "reason": "mock response"})
+
+def mock_endpoint(server):
+    return endpoint.endpoint("mock", f"http://127.0.0.1:{server.server_address[1]}/v1", "dummy", "mock")
+
+def test_stream_rebuilds_the_completion():
+    server = start_mock_server(["--port", "0", "--chunk_size", "5"])
+    try:
+        texts = list()
+        response = api.create_completion(mock_endpoint(server), messages, 2048, 0.0, True, None, texts.append, "test.stream")
+        assert response.choices[0].message.content == expected
+        assert response.choices[0].message.role == "assistant" and response.choices[0].finish_reason == "stop"
+        assert response.usage.completion_tokens == len(expected) // 4 and response.model == "mock"
+        # the callback gets the growing answer, one chunk more each time.
+        assert len(texts) == (len(expected) + 4) // 5 and texts[-1] == expected
+        assert all(later.startswith(earlier) and len(later) - len(earlier) <= 5 for earlier, later in zip(texts, texts[1:]))
+    finally:
+        server.shutdown()
+
+def test_streamed_answer_and_partial_answers():
+    server = start_mock_server(["--port", "0", "--chunk_size", "3"])
+    try:
+        pool = endpoint.endpoint_pool([mock_endpoint(server)], hedge_percentile=0)
+        previous = api.endpoints, api.limiter
+        api.endpoints, api.limiter = pool, ratelimit.rate_limiter()
+        texts = list()
+        try:
+            with metrics.collect() as collector:
+                answer = api.answer_wrapper(messages, structured=True, stream=True, stream_callback=texts.append, label="test.stream")
+        finally:
+            api.endpoints, api.limiter = previous
+        assert answer == expected
+        assert collector.summary()["total"]["completion_tokens"] == len(expected) // 4
+        # readable part of the incomplete JSON, the answer until the reason starts.
+        partial = [prompt.get_partial_answer(text) for text in texts]
+        assert partial[0] == "" and partial[-1] == "mock response"
+        assert "mock" in partial and "mock r" in partial
+    finally:
+        server.shutdown()
+
+def test_partial_answer_of_escaped_text():
+    assert prompt.get_partial_answer('{"reason": "line\\') == "line"
+    assert prompt.get_partial_answer('{"reason": "a \\"quoted\\" wo') == 'a "quoted" wo'
+    assert prompt.get_partial_answer('{"answer": "C", "rea') == "C"
+
+if __name__ == "__main__":
+    test_stream_rebuilds_the_completion()
+    test_streamed_answer_and_partial_answers()
+    test_partial_answer_of_escaped_text()
+    print("[OK] 流式回答测试通过")
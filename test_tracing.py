@@ -0,0 +1,54 @@
+"""
+测试分层追踪 (utils/tracing.py)
+"""
+import os
+import sys
+import json
+import time
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import tracing
+import scheduler
+
+@tracing.traced("tool.detect", category="tool")
+def detect(i):
+    time.sleep(0.01)
+    return i
+
+def test_nested_spans_and_chrome_export():
+    with tracing.session("test") as session:
+        with tracing.span("copilot", question_type="extracting-sheet_name"):
+            with tracing.span("HIE.digitalize"):
+                scheduler.parallel_map(detect, range(4), max_workers=2)
+            with tracing.span("PEQA.answer") as span:
+                span.args["tokens"] = 10
+    spans = {s.name: s for s in session.spans}
+    assert spans["HIE.digitalize"].parent_id == spans["copilot"].id
+    # spans in worker threads keep their parent.
+    workers = [s for s in session.spans if s.name == "tool.detect"]
+    assert len(workers) == 4 and all(s.parent_id == spans["HIE.digitalize"].id for s in workers)
+
+    with tempfile.TemporaryDirectory() as folder:
+        trace_path = os.path.join(folder, "trace.json")
+        session.save(trace_path)
+        with open(trace_path, "r", encoding="utf-8") as f:
+            events = json.loads(f.read())["traceEvents"]
+    complete = [e for e in events if e["ph"] == "X"]
+    assert len(complete) == 7
+    assert [e for e in complete if e["name"] == "PEQA.answer"][0]["args"]["tokens"] == 10
+
+    timings = session.timings()
+    assert timings["tool.detect"]["count"] == 4
+    assert timings["copilot"]["self"] < timings["copilot"]["total"]
+    assert "HIE.digitalize" in session.format_timings()
+
+def test_no_session_records_nothing():
+    with tracing.span("idle") as span:
+        pass
+    assert span.session is None
+
+if __name__ == "__main__":
+    test_nested_spans_and_chrome_export()
+    test_no_session_records_nothing()
+    print("[OK] 追踪测试通过")
@@ -0,0 +1,150 @@
+"""
+测试图例颜色提取等向量化的图像工具 (utils/vision.py)，与原实现逐一对比
+"""
+import os
+import sys
+import tempfile
+import numpy as np
+import cv2
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "utils"))
+import vision
+
+root = os.path.dirname(os.path.abspath(__file__))
+
+def reference_calc_image_rgb(image):
+    # the former per-pixel implementation.
+    pixel_list = np.array(list(filter(lambda c: not (c[0] < 16 and c[1] < 16 and c[2] < 16), list(image.reshape(-1, 3)))), dtype=image.dtype)
+    color = np.median(pixel_list, axis=0)
+    return color[::-1]
+
+def sample_legends():
+    # swatches cut from the sample map, and synthetic ones with a border, text and noise.
+    rng = np.random.default_rng(0)
+    image = cv2.imread(os.path.join(root, "images", "sample_usgs.jpg"))
+    height, width = image.shape[:2]
+    for _ in range(20):
+        y, x = rng.integers(0, height - 40), rng.integers(0, width - 80)
+        yield image[y:y+40, x:x+80]
+    for _ in range(20):
+        swatch = np.empty((48, 96, 3), dtype=np.uint8)
+        swatch[:] = rng.integers(0, 256, 3)
+        swatch = np.clip(swatch.astype(np.int16) + rng.integers(-6, 7, swatch.shape), 0, 255).astype(np.uint8)
+        cv2.rectangle(swatch, (0, 0), (95, 47), (0, 0, 0), 2)
+        cv2.putText(swatch, "Qal", (20, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (5, 5, 5), 1)
+        yield swatch
+
+def test_calc_image_rgb_matches_reference():
+    for swatch in sample_legends():
+        assert np.array_equal(vision.calc_image_rgb(swatch), reference_calc_image_rgb(swatch))
+
+def test_calc_image_rgb_dominant_ignores_hatching():
+    swatch = np.full((60, 120, 3), (80, 170, 230), dtype=np.uint8)  # BGR
+    for x in range(0, 120, 6):
+        cv2.line(swatch, (x, 0), (x + 30, 59), (30, 60, 200), 2)  # dense red hatching
+    dominant = vision.calc_image_rgb(swatch, mode="dominant")
+    assert np.array_equal(dominant, [230, 170, 80])
+
+def test_calc_image_rgb_all_dark():
+    swatch = np.full((10, 10, 3), 8, dtype=np.uint8)
+    assert np.array_equal(vision.calc_image_rgb(swatch), [8, 8, 8])
+
+def reference_rock_region_areas(image, legends):
+    # the former per-legend scans of rock_region_seg.
+    _s = 4
+    height, width, _ = image.shape
+    resized_image = cv2.resize(image, (width//_s, height//_s), interpolation=cv2.INTER_NEAREST)
+    resized_image_rgb = cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB)
+    image_area = 1.0 * resized_image_rgb.shape[0] * resized_image_rgb.shape[1]
+    color2thred = vision.cal_color_thred(np.array([legend["color"] for legend in legends]))
+    areas = list()
+    for legend in legends:
+        color = legend["color"]
+        if color != [255, 255, 255]:
+            distances = np.sum(np.abs(resized_image_rgb - np.array(color)), axis=-1)
+            areas.append(round(int(np.sum(distances <= color2thred[vision.color_key(color)])) / image_area, 6))
+        else:
+            areas.append(0)
+    return areas
+
+def test_rock_region_seg_matches_reference():
+    image = cv2.imread(os.path.join(root, "images", "sample_usgs.jpg"))[:1200, :1600]
+    rng = np.random.default_rng(1)
+    pixels = image.reshape(-1, 3)[rng.integers(0, 1200 * 1600, 40)]
+    legends = [{"color": [int(c) for c in pixel[::-1]]} for pixel in pixels]
+    legends.append({"color": [255, 255, 255]})
+    legends.append(dict(legends[0]))  # duplicated color
+    expected = reference_rock_region_areas(image, legends)
+
+    with tempfile.TemporaryDirectory() as folder:
+        seg_path = os.path.join(folder, "seg", "map.npz")
+        seg = vision.rock_region_seg(image, legends, seg_path)
+        assert [legend["area"] for legend in legends] == expected
+        labels = seg["labels"]
+        assert labels.dtype == np.uint8 and labels.shape == (300, 400)
+        # labels point to legends within their threshold.
+        assert ((labels > 0).sum() / labels.size) <= sum(expected) + 1e-4
+
+        # reused from the raster on disk.
+        for legend in legends:
+            del legend["area"]
+        reused = vision.rock_region_seg(None, legends, seg_path)
+        assert [legend["area"] for legend in legends] == expected
+        assert np.array_equal(reused["labels"], labels)
+
+def reference_cal_color_thred(colors):
+    color2thred = dict()
+    for color1 in colors:
+        color2thred[vision.color_key(color1)] = 10
+        min_d = 256 *3
+        for color2 in colors:
+            if vision.color_key(color1) == vision.color_key(color2):
+                continue
+            d = abs(color1[0] - color2[0]) + abs(color1[1] - color2[1]) + abs(color1[2] - color2[2])
+            if d < min_d:
+                min_d = d
+                color2thred[vision.color_key(color1)] = min_d / 2
+    return color2thred
+
+def reference_rgb_to_color_name(rgb):
+    min_distance = float('inf')
+    closest_color_name = "Unknown"
+    for key, value in vision.color_palette.items():
+        distance = sum((a - b) ** 2 for a, b in zip(rgb, key))
+        if distance < min_distance:
+            min_distance = distance
+            closest_color_name = value
+    return closest_color_name
+
+def test_color_thresholds_match_reference():
+    rng = np.random.default_rng(2)
+    for size in (1, 2, 5, 40):
+        colors = rng.integers(0, 256, (size, 3))
+        colors = np.vstack([colors, colors[:1]])  # duplicated color
+        assert vision.cal_color_thred(colors) == reference_cal_color_thred(colors.tolist())
+    # a batch of maps.
+    batch = rng.integers(0, 256, (3, 10, 3))
+    thresholds = vision.color_thresholds(batch)
+    for colors, expected in zip(batch, thresholds):
+        assert np.array_equal(vision.color_thresholds(colors), expected)
+
+def test_rgb_to_color_name_batch():
+    colors = np.random.default_rng(3).uniform(0, 255, (200, 3))
+    assert vision.rgb_to_color_name(colors) == [reference_rgb_to_color_name(color) for color in colors]
+    assert vision.rgb_to_color_name([250, 10, 5]) == "Red"
+    assert vision.rgb_to_color_name([np.nan, 0, 0]) == "Unknown"
+
+def test_annotate_image_with_directions():
+    image = np.full((300, 500, 3), 128, dtype=np.uint8)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "index_map_0.png")
+        canvas = vision.annotate_image_with_directions(image, path)
+        height, width = canvas.shape[:2]
+        pad_y, pad_x = (height - 300) // 2, (width - 500) // 2
+        assert pad_y >= 60 and pad_x >= 100
+        assert np.array_equal(canvas[pad_y:pad_y+300, pad_x:pad_x+500], image)
+        # labels are drawn in the padding, e.g. N above the middle of the image.
+        assert (canvas[:pad_y, pad_x + 200:pad_x + 300] < 128).any()
+        assert np.array_equal(vision.load_image(path), canvas)
+        vision.writer.flush()
+    assert "matplotlib.pyplot" not in sys.modules
@@ -1,5 +1,7 @@
 import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}")
+# Importing the tools is cheap: heavy dependencies (ultralytics and torch, transformers, geopandas) are imported
+# in the tool constructors, and the agents build their tools on first use with common.lazy_property.
 from .map_component_detector import map_component_detector
 from .map_legend_detector import map_legend_detector
 from .k2_knowledge_db import k2_knowledge_db, geological_knwoledge_type
@@ -0,0 +1,36 @@
+import os
+import logging
+import importlib.util
+
+# Exported models are written next to the PyTorch weights by export_detectors.py, fastest CPU backend first.
+# INT8 models from quantize_detectors.py are only loaded when asked for, after their accuracy report was accepted.
+exported_suffixes = {
+    "openvino": "_openvino_model",
+    "onnx": ".onnx",
+    "openvino_int8": "_int8_openvino_model",
+    "onnx_int8": "_int8.onnx",
+}
+auto_backends = ["openvino", "onnx"]
+runtime_modules = {
+    "openvino": "openvino",
+    "onnx": "onnxruntime",
+    "openvino_int8": "openvino",
+    "onnx_int8": "onnxruntime",
+}
+
+def exported_path(model_path, backend):
+    # weights/best.pt -> weights/best_openvino_model, weights/best_int8.onnx, ...
+    return os.path.splitext(model_path)[0] + exported_suffixes[backend]
+
+def resolve_weights(model_path, backend="auto"):
+    # Weights to load for the backend: pytorch, onnx, openvino, onnx_int8, openvino_int8, or auto for the fastest
+    # FP32 exported model whose runtime is installed. Falls back to the PyTorch weights when the export or its runtime is missing.
+    if backend not in exported_suffixes and backend != "auto":
+        return model_path
+    for name in (auto_backends if backend == "auto" else [backend]):
+        path = exported_path(model_path, name)
+        if os.path.exists(path) and importlib.util.find_spec(runtime_modules[name]) is not None:
+            return path
+        if backend != "auto":
+            logging.warning(f"{name} model {path} or its runtime is not available. Using {model_path}...")
+    return model_path
@@ -1,14 +1,28 @@
 import os
 os.sys.path.append(f"{os.path.dirname(os.path.realpath(__file__))}/..")
-from dependencies.ultralytics import YOLOv10
+from tool_pool.detector_backend import resolve_weights
+import cv2
 
 class map_component_detector:
-    def __init__(self, model_path="./dependencies/models/det_component/weights/best.pt"):
-        self.model = YOLOv10(model_path)
+    def __init__(self, model_path="./dependencies/models/det_component/weights/best.pt", backend="pytorch"):
+        # backend: pytorch, onnx, openvino or auto, exported models are loaded through AutoBackend.
+        from dependencies.ultralytics import YOLOv10
+        self.model = YOLOv10(resolve_weights(model_path, backend), task="detect")
 
-    def detect(self, image_path):
-        objs = self.model.predict(source=image_path)[0]
-        return objs
+    def detect(self, image):
+        # image is a path or a decoded BGR array.
+        return self.detect_batch([image])[0]
+
+    def detect_batch(self, images, batch_size=8):
+        # images are paths or decoded BGR arrays, inferred batch_size at a time, regions are returned in the same order.
+        regions = list()
+        for i in range(0, len(images), batch_size):
+            # paths are decoded one batch at a time.
+            batch = [cv2.imread(image) if isinstance(image, str) else image for image in images[i:i+batch_size]]
+            if any(image is None for image in batch):
+                raise ValueError(f"Failed to decode an image of the batch starting at {i}")
+            regions.extend(self.model.predict(source=batch, batch=len(batch)))
+        return regions
 
 if __name__ == "__main__":
     map_component_detector = map_component_detector()
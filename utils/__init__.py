@@ -4,5 +4,11 @@ import api
 import vision
 import common
 import prompt
+import scheduler
+import cache
+import ratelimit
+import endpoint
+import metrics
+import tracing
 
-__all__ = ["api", "prompt", "vision", "common"]
+__all__ = ["api", "prompt", "vision", "common", "scheduler", "cache", "ratelimit", "endpoint", "metrics", "tracing"]
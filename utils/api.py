@@ -2,60 +2,234 @@ import os
 import cv2
 import time
 import random
-import base64
+import json
+import cache
 import common
+import metrics
+import tracing
+import endpoint
+import ratelimit
 import logging
-from io import BytesIO
-from PIL import Image
 from mimetypes import guess_type
 import openai
 from openai import OpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
 
 # 从环境变量获取API配置
 api_key = os.getenv("DASHSCOPE_API_KEY", "")  # 从环境变量获取API密钥
 if not api_key:
     # 如果环境变量未设置，提示用户设置
     print("警告: 未找到DASHSCOPE_API_KEY环境变量。请设置您的API密钥。")
-base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"  # 阿里云兼容OpenAI格式的API端点
+base_url = os.getenv("PEACE_API_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")  # 阿里云兼容OpenAI格式的API端点，可指向本地模拟服务 (mock_server.py)
 model_name = os.getenv("MODEL_NAME", "qwen-vl-max")  # 使用环境变量或默认模型
 
-client = OpenAI(
-    api_key=api_key,
-    base_url=base_url
+# 端点池：默认只有上面配置的一个端点，PEACE_API_ENDPOINTS可追加备用端点(JSON列表)，例如
+# [{"name": "backup", "base_url": "https://...", "api_key_env": "BACKUP_API_KEY", "model": "qwen-vl-plus"}]
+# 重试时按顺序切换到健康的端点，错误率过高的端点会被熔断；主端点过慢时向备用端点发送对冲请求
+endpoints = endpoint.endpoint_pool(
+    [endpoint.endpoint("primary", base_url, api_key, model_name)] + [
+        endpoint.endpoint(
+            config.get("name", f"endpoint_{i}"),
+            config.get("base_url", base_url),
+            os.getenv(config["api_key_env"], "") if "api_key_env" in config else api_key,
+            config.get("model", model_name),
+        ) for i, config in enumerate(json.loads(os.getenv("PEACE_API_ENDPOINTS", "[]")), 1)
+    ],
+    hedge_percentile=float(os.getenv("PEACE_HEDGE_PERCENTILE", "95")),  # 0表示不对冲
+    hedge_delay=float(os.getenv("PEACE_HEDGE_DELAY", "20.0")),  # 延迟样本不足时的对冲等待时间（秒）
+    hedge_min_delay=float(os.getenv("PEACE_HEDGE_MIN_DELAY", "2.0")),
 )
+client = endpoints.endpoints[0].client  # 本地模拟服务不校验密钥，重试由answer_wrapper统一处理
 
-def answer_wrapper(messages, max_tks=2048, temperature=0.0, structured=False, tools=None):
-    models = [model_name]  # 直接使用配置的模型名称
-    max_trial = len(models)
-    current = 0  # 直接使用第一个模型
+# 重试与限流配置，PEACE_RPM/PEACE_TPM为每分钟请求数/令牌数上限，0表示不限制
+max_attempts = max(1, int(os.getenv("PEACE_MAX_ATTEMPTS", "4")))
+backoff_base = float(os.getenv("PEACE_BACKOFF_BASE", "1.0"))
+backoff_max = float(os.getenv("PEACE_BACKOFF_MAX", "30.0"))
+image_token_estimate = 1024
+limiter = ratelimit.rate_limiter(
+    requests_per_minute=float(os.getenv("PEACE_RPM", "0")),
+    tokens_per_minute=float(os.getenv("PEACE_TPM", "0")),
+)
+
+# 可选的响应缓存 (SQLite)，设置PEACE_RESPONSE_CACHE为数据库路径即可启用，例如 .cache/responses.sqlite
+response_cache_path = os.getenv("PEACE_RESPONSE_CACHE", "")
+response_cache = cache.response_cache(
+    response_cache_path,
+    max_size_mb=float(os.getenv("PEACE_RESPONSE_CACHE_MB", "256")),
+    ttl=float(os.getenv("PEACE_RESPONSE_CACHE_TTL", str(30 * 24 * 3600))),
+) if response_cache_path else None
+
+# queueing delay, endpoint health and cache hit rates are shown with metrics.process_summary.
+metrics.register_stats("rate_limiter", limiter.stats)
+metrics.register_stats("endpoints", endpoints.stats)
+if response_cache is not None:
+    metrics.register_stats("response_cache", response_cache.stats)
+
+def answer_wrapper(messages, max_tks=2048, temperature=0.0, structured=False, tools=None, stream=False, stream_callback=None, label=None):
+    # With stream=True, stream_callback receives the accumulated answer text while it is generated.
+    # label names the call site (e.g. "hie.component") in the latency and token accounting of metrics.
+    if not stream or tools is not None:
+        stream_callback = None
+    call = metrics.call_record(label, count_images(messages))
+    with tracing.span(f"llm.{call.label}", category="llm") as span:
+        answer = None
+        try:
+            # Only deterministic requests are cached, keyed by the model that answered. Answers of the models
+            # that may answer now are looked up in priority order.
+            cacheable = response_cache is not None and temperature == 0
+            if cacheable:
+                cached = None
+                for model in endpoints.models():
+                    cached = response_cache.get(response_cache.key(model, messages, max_tks, temperature, structured, tools))
+                    if cached is not None:
+                        break
+                if cached is not None:
+                    call.cached = True
+                    if cached["type"] == "message":
+                        answer = ChatCompletionMessage.model_validate(cached["value"])
+                        return answer
+                    if stream_callback is not None:
+                        stream_callback(cached["value"])
+                    answer = cached["value"]
+                    return answer
+
+            answer = request_answer(messages, max_tks, temperature, structured, tools, stream_callback, call)
+
+            if cacheable and answer is not None and call.model is not None:
+                cache_key = response_cache.key(call.model, messages, max_tks, temperature, structured, tools)
+                if isinstance(answer, str):
+                    response_cache.put(cache_key, {"type": "text", "value": answer})
+                else:
+                    response_cache.put(cache_key, {"type": "message", "value": answer.model_dump()})
+            return answer
+        finally:
+            call.finish(answer is not None)
+            metrics.record(call)
+            span.args.update(cached=call.cached, attempts=call.attempts, queue_time=round(call.queue_time, 3), prompt_tokens=call.prompt_tokens, completion_tokens=call.completion_tokens)
+
+def count_images(messages):
+    images = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, list):
+            images += sum(1 for item in content if item.get("type") == "image_url")
+    return images
+
+def estimate_tokens(messages, max_tks):
+    # Rough prompt size for the token limiter, images count as a fixed budget.
+    tokens = 0
+    for message in messages:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            tokens += len(content) // 4
+        elif isinstance(content, list):
+            for item in content:
+                if item.get("type") == "text":
+                    tokens += len(item["text"]) // 4
+                elif item.get("type") == "image_url":
+                    tokens += image_token_estimate
+    return tokens + max_tks
+
+def retry_after_seconds(e):
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    for header, scale in (("retry-after-ms", 0.001), ("retry-after", 1.0)):
+        value = response.headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(0.0, float(value) * scale)
+        except ValueError:
+            continue
+    return None
+
+def backoff_seconds(attempt, retry_after=None):
+    # Exponential backoff with full jitter, the server's Retry-After wins when given.
+    if retry_after is not None:
+        return retry_after
+    return random.uniform(0, min(backoff_max, backoff_base * 2 ** attempt))
+
+def is_endpoint_failure(e):
+    # Errors caused by the endpoint rather than by the request, they count for the circuit breaker.
+    if isinstance(e, (openai.APIConnectionError, openai.RateLimitError)):
+        return True
+    return isinstance(e, openai.APIStatusError) and e.status_code >= 500
+
+def stream_completion(api_endpoint, kwargs, stream_callback):
+    # Consume a streamed completion and rebuild the complete response from its chunks.
+    chunks = api_endpoint.client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+    response = {"id": "", "object": "chat.completion", "created": 0, "model": kwargs["model"], "usage": None}
+    content = list()
+    finish_reason = "stop"
+    for chunk in chunks:
+        response["id"], response["created"] = chunk.id, chunk.created
+        if chunk.usage is not None:
+            response["usage"] = chunk.usage.model_dump()
+        if len(chunk.choices) == 0:
+            continue
+        if chunk.choices[0].finish_reason is not None:
+            finish_reason = chunk.choices[0].finish_reason
+        if chunk.choices[0].delta.content:
+            content.append(chunk.choices[0].delta.content)
+            stream_callback("".join(content))
+    response["choices"] = [{"index": 0, "message": {"role": "assistant", "content": "".join(content)}, "finish_reason": finish_reason}]
+    return ChatCompletion.model_validate(response)
+
+def create_completion(api_endpoint, messages, max_tks, temperature, structured, tools, stream_callback=None, label=None):
+    kwargs = dict(
+        model=api_endpoint.model,
+        messages=messages,
+        temperature=temperature,
+        max_tokens=max_tks,
+        response_format={"type": "json_object" if structured else "text"},
+    )
+    if tools is not None:
+        kwargs["tools"] = tools
+        kwargs["tool_choice"] = "auto"
+    start = time.monotonic()
+    try:
+        with tracing.span(f"request.{api_endpoint.name}", category="llm"):
+            if stream_callback is not None:
+                response = stream_completion(api_endpoint, kwargs, stream_callback)
+            else:
+                response = api_endpoint.client.chat.completions.create(**kwargs)
+    except Exception as e:
+        api_endpoint.record(not is_endpoint_failure(e))
+        raise
+    api_endpoint.record(True, time.monotonic() - start, label)
+    return response
+
+def request_answer(messages, max_tks=2048, temperature=0.0, structured=False, tools=None, stream_callback=None, call=None):
+    call = call or metrics.call_record(None, count_images(messages))
     answer = None
-    for i in range(max_trial):
+    estimated_tokens = estimate_tokens(messages, max_tks)
+    def acquire():
+        # every request sent, hedged duplicates included, goes through the rate limiter.
+        call.queue_time += limiter.acquire(estimated_tokens)
+    def complete(api_endpoint):
+        return api_endpoint.model, create_completion(api_endpoint, messages, max_tks, temperature, structured, tools, stream_callback, call.label)
+    for attempt in range(max_attempts):
+        call.attempts += 1
+        acquire()
+        retry_after = None
         try:
             response = None
+            # streamed requests are not hedged, two streams would interleave in the callback.
+            call.model, response = endpoints.call(complete, attempt, hedge=stream_callback is None, label=call.label, acquire=acquire)
             if tools is not None:
-                response = client.chat.completions.create(
-                    model=models[current],
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tks,
-                    response_format={"type": "json_object" if structured else "text"},
-                    tools = tools,
-                    tool_choice = "auto",
-                )
                 answer = response.choices[0].message
             else:
-                response = client.chat.completions.create(
-                    model=models[current],
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tks,
-                    response_format={"type": "json_object" if structured else "text"},
-                )
                 answer = response.choices[0].message.content
+            if response.usage is not None:
+                limiter.settle(estimated_tokens, response.usage.total_tokens)
+            call.add_usage(response.usage, image_token_estimate)
         # https://github.com/openai/openai-python/blob/main/openai/error.py
         except openai.RateLimitError as e:
+            retry_after = retry_after_seconds(e)
+            if retry_after is not None:
+                limiter.pause(retry_after)
             logging.warning(f"RateLimitError: {e}. Retrying...")
-            time.sleep(2)
         except openai.BadRequestError as e:
             if e.code == "content_filter":
                 logging.warning(f"BadRequestError:content_filter: {e}. Skipping...")
@@ -68,10 +242,16 @@ def answer_wrapper(messages, max_tks=2048, temperature=0.0, structured=False, to
                 break
         except openai.APITimeoutError as e:
             logging.warning(f"APITimeoutError: {e}. Retrying...")
-            time.sleep(2)
         except openai.APIConnectionError as e:
-            logging.warning(f"Connection aborted: {e}.")
-            time.sleep(2)
+            logging.warning(f"Connection aborted: {e}. Retrying...")
+        except openai.APIStatusError as e:
+            if e.status_code in (408, 409) or e.status_code >= 500:
+                retry_after = retry_after_seconds(e)
+                logging.warning(f"{type(e).__name__}: {e}. Retrying...")
+            else:
+                # authentication, permission and not found errors will not go away by retrying.
+                logging.warning(f"{type(e).__name__}: {e}. Skipping...")
+                break
         except Exception as e:
             if response is not None and response.choices[0].finish_reason == "content_filter":
                 print(messages)
@@ -80,27 +260,34 @@ def answer_wrapper(messages, max_tks=2048, temperature=0.0, structured=False, to
                 break
             else:
                 logging.warning(f"{type(e).__name__}: {e}. Retrying...")
-                time.sleep(2)
         if answer is not None:
             break
+        if attempt + 1 < max_attempts:
+            time.sleep(backoff_seconds(attempt, retry_after))
     return answer
 
-def input_image_to_data_url(image_rgb_array, image_format="PNG") :
-    # Convert numpy array to PIL Image
-    image = Image.fromarray(image_rgb_array)
-    # Convert the image to a bytes object
-    buffered = BytesIO()
-    image.save(buffered, format=image_format)
-    # Guess the MIME type from the image format
-    mime_type, _ = guess_type(f"dummy.{image_format.lower()}")
-    if mime_type is None:
-        mime_type = "application/octet-stream"  # Default MIME type if none is found
-    # Encode the image to base64
-    base64_encoded_data = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    # Construct the data URL
-    return f"data:{mime_type};base64,{base64_encoded_data}"
+def input_image_to_data_url(image_array, image_format="PNG", is_bgr=False):
+    # Arrays are encoded by cv2 without a PIL round-trip, pass BGR arrays (as read by cv2) with is_bgr to avoid a color conversion.
+    import vision  # vision imports common, which imports api
+    if not is_bgr and image_array.ndim == 3 and image_array.shape[2] == 3:
+        image_array = cv2.cvtColor(image_array, cv2.COLOR_RGB2BGR)
+    return vision.encode_data_url(image_array, image_format)
+
+def image_to_data_url(image_path, policy=None):
+    # Data url and scale factor of an image sent under a resolution and format policy (prompt.get_image_policy),
+    # the original file is sent when there is no policy.
+    import vision  # vision imports common, which imports api
+    if policy is None:
+        return local_image_to_data_url(image_path), 1.0
+    return vision.policy_data_url(image_path, policy)
 
 def local_image_to_data_url(image_path):
+    # crops held in memory are encoded from their arrays, they may not be written to disk yet.
+    import vision  # vision imports common, which imports api
+    data_url = vision.image_data_url(image_path)
+    if data_url is not None:
+        return data_url
+
     api_image_size_limit = 50 * 1024 * 1024  # 50MB limit (增加到50MB以支持更大的地质图文件)
     
     # Check file size
@@ -115,12 +302,11 @@ def local_image_to_data_url(image_path):
     
     # Read and encode the image file
     with open(image_path, "rb") as image_file:
-        base64_encoded_data = base64.b64encode(image_file.read()).decode("utf-8")
+        data_url = vision.to_data_url(image_file.read(), mime_type)
     
     # Double check the encoded size
-    encoded_size = len(base64_encoded_data)
+    encoded_size = len(data_url)
     if encoded_size >= api_image_size_limit * 4/3:  # Base64 encoding increases size by ~33%
         raise ValueError(f"图像编码后太大，请使用更小的图像文件")
     
-    # Construct the data URL
-    return f"data:{mime_type};base64,{base64_encoded_data}"
\ No newline at end of file
+    return data_url
\ No newline at end of file
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import base64
+import sqlite3
+import hashlib
+import threading
+
+def normalize_request(obj):
+    # Image data urls are replaced by the hash of their content.
+    if isinstance(obj, str):
+        if obj.startswith("data:") and ";base64," in obj:
+            header, data = obj.split(",", 1)
+            return f"{header},sha256:{hashlib.sha256(base64.b64decode(data)).hexdigest()}"
+        return obj
+    if isinstance(obj, dict):
+        return {key: normalize_request(value) for key, value in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [normalize_request(value) for value in obj]
+    return obj
+
+def request_key(model_name, messages, max_tks, temperature, structured, tools):
+    request = [model_name, normalize_request(messages), max_tks, temperature, structured, tools]
+    request = json.dumps(request, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(request.encode("utf-8")).hexdigest()
+
+class response_cache:
+    # Persistent cache of model responses, keyed by a hash of the request, with a size cap, LRU eviction and TTL.
+    def __init__(self, db_path, max_size_mb=256, ttl=30 * 24 * 3600):
+        if len(os.path.dirname(db_path).strip()) != 0:
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.max_size = int(max_size_mb * 1024 * 1024)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT, size INTEGER, created REAL, accessed REAL)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+        self.conn.commit()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def key(self, model_name, messages, max_tks, temperature, structured, tools):
+        return request_key(model_name, messages, max_tks, temperature, structured, tools)
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, size, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl is not None and now - row[2] > self.ttl:
+                self.conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self.conn.commit()
+                self.size -= row[1]
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self.conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, value):
+        now = time.time()
+        value = json.dumps(value, ensure_ascii=False)
+        size = len(value.encode("utf-8"))
+        with self.lock:
+            row = self.conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.size -= row[0]
+            self.conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)", (key, value, size, now, now))
+            self.size += size
+            # evict least recently used responses until the cache fits again.
+            while self.size > self.max_size:
+                rows = self.conn.execute("SELECT key, size FROM responses ORDER BY accessed LIMIT 64").fetchall()
+                if len(rows) == 0:
+                    break
+                for evicted_key, evicted_size in rows:
+                    self.conn.execute("DELETE FROM responses WHERE key = ?", (evicted_key,))
+                    self.size -= evicted_size
+                    if self.size <= self.max_size:
+                        break
+            self.conn.commit()
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total > 0 else 0.0,
+            "entries": entries,
+            "size_mb": round(self.size / 1024 / 1024, 3),
+        }
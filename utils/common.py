@@ -1,11 +1,26 @@
 import os
 import re
+import json
+import threading
 from datetime import date
 import api
 
 echo = False
 model_name = "qwen3-vl-plus"  # 更新为阿里云模型
 dataset_source = "usgs"
+max_workers = int(os.getenv("PEACE_MAX_WORKERS", "4"))  # 并发线程数上限
+ocr_mode = os.getenv("PEACE_OCR_MODE", "concurrent")  # 图例OCR模式: concurrent (每个图例单元并发请求) 或 packed (多个图例单元合并为一次请求)
+ocr_pack_size = int(os.getenv("PEACE_OCR_PACK_SIZE", "8"))  # packed模式下每次请求的图例单元数
+image_cache_mb = float(os.getenv("PEACE_IMAGE_CACHE_MB", "1024"))  # 解码后图像的内存缓存上限（MB），0表示不缓存
+detector_backend = os.getenv("PEACE_DETECTOR_BACKEND", "auto")  # 版面与图例检测模型的推理后端: auto (优先使用已导出的OpenVINO/ONNX模型), pytorch, onnx 或 openvino
+component_detector_backend = os.getenv("PEACE_COMPONENT_DETECTOR_BACKEND", detector_backend)  # 单独指定版面检测模型的后端, 例如接受量化结果后设为 openvino_int8
+legend_detector_backend = os.getenv("PEACE_LEGEND_DETECTOR_BACKEND", detector_backend)  # 单独指定图例检测模型的后端, 可选 onnx_int8 或 openvino_int8
+legend_color_mode = os.getenv("PEACE_LEGEND_COLOR_MODE", "median")  # 图例颜色提取: median (非黑色像素的中位数) 或 dominant (量化直方图的主色，适合有花纹或文字的图例)
+image_policy = os.getenv("PEACE_IMAGE_POLICY", "adaptive")  # 发送给模型的图像: adaptive (按组件和题型缩放并重新编码，见prompt.image_policies) 或 original (原始文件)
+crop_persist = os.getenv("PEACE_CROP_PERSIST", "async")  # 地图组件裁剪的落盘方式: async (后台写入), sync (立即写入) 或 off (只保存在内存)
+crop_cache_mb = float(os.getenv("PEACE_CROP_CACHE_MB", "256"))  # 内存中地图组件裁剪（像素与编码后数据）的上限（MB），超出时只丢弃已写入磁盘的裁剪
+trace_folder = os.getenv("PEACE_TRACE", "")  # 设置为文件夹路径即启用追踪，每次请求输出Chrome trace JSON
+partial_answer_prefix = "✍️ [PEQA] "  # 流式输出的部分回答通过progress_callback传递时的前缀
 
 # 完全移除GEE依赖，使用简单模拟值
 class MockEarthEngine:
@@ -64,6 +79,14 @@ def create_folder_by_file_path(file_path):
     if not os.path.exists(folder_path) and len(folder_path.strip()) != 0:
         os.makedirs(folder_path)
 
+def save_json(file_path, data):
+    # Written to a temporary file and renamed, readers never see a partial file even when two runs write the same map.
+    create_folder_by_file_path(file_path)
+    tmp_path = f"{file_path}.{os.getpid()}_{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(json.dumps(data, indent=4, ensure_ascii=False))
+    os.replace(tmp_path, file_path)
+
 def is_valid_longitude(lon):
     return -180 <= lon <= +180
 
@@ -73,6 +96,26 @@ def is_valid_latitude(lat):
 def is_valid_bndbox(x0, y0, x1, y1, w, h):
     return 0 <= x0 <= x1 <= w and 0 <= y0 <= y1 <= h
 
+class lazy_property:
+    # Built on first access and then stored on the instance, like functools.cached_property,
+    # but only built once when several threads (e.g. a background warmup) ask for it at the same time.
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        if self.name not in instance.__dict__:
+            with self.lock:
+                if self.name not in instance.__dict__:
+                    instance.__dict__[self.name] = self.func(instance)
+        return instance.__dict__[self.name]
+
 def rai_filter(question):
     instructions = list()
     instructions.append({"type": "text", "text": f"Question: {question}"})
@@ -81,7 +124,7 @@ def rai_filter(question):
         {"role": "system", "content": "You are an expert in sensitive content filter."},
         {"role": "user", "content": instructions},
     ]
-    text = api.answer_wrapper(messages)
+    text = api.answer_wrapper(messages, label="rai")
     if text is None or "true" in text.lower():
         return True
     else:
@@ -0,0 +1,177 @@
+import time
+import threading
+import contextvars
+import collections
+from openai import OpenAI
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class circuit_breaker:
+    # Opens when the recent error rate is too high, lets a single probe call through after a cooldown.
+    def __init__(self, window=20, min_calls=5, failure_rate=0.5, cooldown=30.0):
+        self.results = collections.deque(maxlen=window)
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.cooldown = cooldown
+        self.opened_at = None
+        self.probe_started = None
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if time.monotonic() - self.opened_at >= self.cooldown else "open"
+
+    def allow(self):
+        # In half_open only one probe is let through until it records a result, or until a cooldown passed
+        # without one (the probe was never sent).
+        with self.lock:
+            state = self.state
+            if state == "closed":
+                return True
+            if state == "open":
+                return False
+            now = time.monotonic()
+            if self.probe_started is not None and now - self.probe_started < self.cooldown:
+                return False
+            self.probe_started = now
+            return True
+
+    def record(self, success):
+        with self.lock:
+            if self.state == "half_open":
+                # the probe decides.
+                self.results.clear()
+                self.probe_started = None
+                self.opened_at = None if success else time.monotonic()
+                return
+            self.results.append(success)
+            failures = self.results.count(False)
+            if len(self.results) >= self.min_calls and failures / len(self.results) >= self.failure_rate:
+                self.opened_at = time.monotonic()
+
+class endpoint:
+    def __init__(self, name, base_url, api_key, model, breaker=None):
+        self.name = name
+        self.base_url = base_url
+        self.model = model
+        self.client = OpenAI(api_key=api_key or "EMPTY", base_url=base_url, max_retries=0)
+        self.breaker = breaker or circuit_breaker()
+        # latencies per call-site label, short OCR calls and long answers do not share a percentile.
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=200))
+        self.calls = 0
+        self.failures = 0
+        self.lock = threading.Lock()
+
+    def record(self, success, latency=None, label=None):
+        with self.lock:
+            self.calls += 1
+            self.failures += 0 if success else 1
+            if latency is not None:
+                self.latencies[label].append(latency)
+        self.breaker.record(success)
+
+    def latency_count(self, label=None):
+        with self.lock:
+            return len(self.latencies[label]) if label in self.latencies else 0
+
+    def latency_percentile(self, percentile, label=None):
+        # percentile of one label, of all labels when label is None.
+        with self.lock:
+            if label is None:
+                latencies = sorted(latency for window in self.latencies.values() for latency in window)
+            else:
+                latencies = sorted(self.latencies[label]) if label in self.latencies else []
+        if len(latencies) == 0:
+            return None
+        return latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+
+    def stats(self):
+        return {
+            "name": self.name,
+            "model": self.model,
+            "state": self.breaker.state,
+            "calls": self.calls,
+            "failures": self.failures,
+            "p50": self.latency_percentile(50),
+            "p95": self.latency_percentile(95),
+        }
+
+class endpoint_pool:
+    # Endpoints in priority order, with circuit breaker failover and hedged requests.
+    def __init__(self, endpoints, hedge_percentile=95, hedge_delay=20.0, hedge_min_delay=2.0, hedge_min_samples=10):
+        self.endpoints = list(endpoints)
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = hedge_delay
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_min_samples = hedge_min_samples
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="hedge")
+
+    def available(self, attempt=0):
+        # Endpoints whose breaker is not open, rotated on every retry, all of them when every breaker is open.
+        healthy = [e for e in self.endpoints if e.breaker.state != "open"] or list(self.endpoints)
+        shift = attempt % len(healthy)
+        return healthy[shift:] + healthy[:shift]
+
+    def models(self):
+        # Models that may answer now, in priority order.
+        models = list()
+        for e in self.available():
+            if e.model not in models:
+                models.append(e.model)
+        return models
+
+    def hedge_delay(self, primary, label=None):
+        if primary.latency_count(label) < self.hedge_min_samples:
+            return self.default_hedge_delay
+        return max(self.hedge_min_delay, primary.latency_percentile(self.hedge_percentile, label))
+
+    def call(self, func, attempt=0, hedge=True, label=None, acquire=None):
+        # func(endpoint) performs the request; a duplicate goes to the next endpoint if the first one is slow
+        # compared to the calls of the same label. acquire() is called before the duplicate is sent, e.g. the rate limiter.
+        candidates = self.available(attempt)
+        # a half open endpoint only takes its single probe, the first candidate is used when none allows.
+        primary = next((e for e in candidates if e.breaker.allow()), candidates[0])
+        others = [e for e in candidates if e is not primary]
+        if not hedge or self.hedge_percentile <= 0 or len(others) == 0:
+            return func(primary)
+
+        # the requests run in a copy of the caller's context, e.g. its trace session.
+        primary_future = self.executor.submit(contextvars.copy_context().run, func, primary)
+        done, _ = wait([primary_future], timeout=self.hedge_delay(primary, label))
+        if primary_future in done:
+            return primary_future.result()
+        secondary = next((e for e in others if e.breaker.allow()), None)
+        if secondary is None:
+            return primary_future.result()
+        if acquire is not None:
+            acquire()
+            if primary_future.done():
+                return primary_future.result()
+
+        with self.lock:
+            self.hedges += 1
+        secondary_future = self.executor.submit(contextvars.copy_context().run, func, secondary)
+        pending = {primary_future, secondary_future}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    # the slower request keeps running in the background, its answer is dropped.
+                    if future is secondary_future:
+                        with self.lock:
+                            self.hedge_wins += 1
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def stats(self):
+        return {
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "endpoints": [e.stats() for e in self.endpoints],
+        }
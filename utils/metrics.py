@@ -0,0 +1,140 @@
+import time
+import logging
+import threading
+import contextvars
+
+# Collector of the request being served, thread pools copy the context so their calls are counted too.
+current_collector = contextvars.ContextVar("current_collector", default=None)
+
+class call_record:
+    # One answer_wrapper call.
+    def __init__(self, label, images=0):
+        self.label = label or "other"
+        self.images = images
+        self.start = time.monotonic()
+        self.wall_time = 0.0
+        self.queue_time = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.image_tokens = 0
+        self.attempts = 0
+        self.cached = False
+        self.success = False
+        self.model = None  # model of the endpoint that answered
+
+    @property
+    def retries(self):
+        return max(0, self.attempts - 1)
+
+    def add_usage(self, usage, image_token_estimate=0):
+        # Image tokens are taken from the usage details when the provider reports them, estimated otherwise.
+        if usage is None:
+            return
+        self.prompt_tokens += usage.prompt_tokens or 0
+        self.completion_tokens += usage.completion_tokens or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        image_tokens = getattr(details, "image_tokens", None) if details is not None else None
+        self.image_tokens += image_tokens if image_tokens is not None else self.images * image_token_estimate
+
+    def finish(self, success):
+        self.wall_time = time.monotonic() - self.start
+        self.success = success
+
+class collector:
+    # Running totals of call records per call-site label and per stage (the label prefix before "."),
+    # records are not kept so process-wide collectors stay small.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.start = time.monotonic()
+        self.total = new_rollup()
+        self.labels = dict()
+        self.stages = dict()
+
+    def add(self, record):
+        with self.lock:
+            add_to_rollup(self.total, record)
+            add_to_rollup(self.labels.setdefault(record.label, new_rollup()), record)
+            add_to_rollup(self.stages.setdefault(record.label.split(".")[0], new_rollup()), record)
+
+    def summary(self):
+        with self.lock:
+            total = dict(self.total)
+            labels = {label: dict(rollup) for label, rollup in self.labels.items()}
+            stages = {stage: dict(rollup) for stage, rollup in self.stages.items()}
+        total["elapsed"] = round(time.monotonic() - self.start, 3)
+        for rollup in [total] + list(labels.values()) + list(stages.values()):
+            rollup["wall_time"] = round(rollup["wall_time"], 3)
+            rollup["queue_time"] = round(rollup["queue_time"], 3)
+        return {"total": total, "stages": stages, "labels": labels}
+
+def new_rollup():
+    return {"calls": 0, "cached": 0, "failed": 0, "retries": 0, "wall_time": 0.0, "queue_time": 0.0, "prompt_tokens": 0, "completion_tokens": 0, "image_tokens": 0}
+
+def add_to_rollup(rollup, record):
+    rollup["calls"] += 1
+    rollup["cached"] += int(record.cached)
+    rollup["failed"] += int(not record.success)
+    rollup["retries"] += record.retries
+    rollup["wall_time"] += record.wall_time
+    rollup["queue_time"] += record.queue_time
+    rollup["prompt_tokens"] += record.prompt_tokens
+    rollup["completion_tokens"] += record.completion_tokens
+    rollup["image_tokens"] += record.image_tokens
+
+# Cumulative counters of the whole process.
+process_collector = collector()
+
+def record(call):
+    process_collector.add(call)
+    request_collector = current_collector.get()
+    if request_collector is not None:
+        request_collector.add(call)
+
+class collect:
+    # with metrics.collect() as c: ... ; c.summary() covers every call made inside, including worker threads.
+    def __enter__(self):
+        self.collector = collector()
+        self.token = current_collector.set(self.collector)
+        return self.collector
+
+    def __exit__(self, *exc):
+        current_collector.reset(self.token)
+        return False
+
+# Stats of process-wide components (rate limiter, endpoints, caches), registered by the modules that own them.
+component_stats = dict()
+
+def register_stats(name, stats):
+    # stats() returns a dict, it is shown with the process summary.
+    component_stats[name] = stats
+
+def components_summary():
+    summary = dict()
+    for name, stats in list(component_stats.items()):
+        try:
+            summary[name] = stats()
+        except Exception as e:
+            logging.warning(f"{type(e).__name__}: {e}. Skipping stats of {name}...")
+    return summary
+
+def process_summary():
+    summary = process_collector.summary()
+    summary["components"] = components_summary()
+    return summary
+
+def format_summary(summary):
+    # Plain text table, one row per stage and per call-site label.
+    columns = ["calls", "cached", "failed", "retries", "wall_time", "queue_time", "prompt_tokens", "completion_tokens", "image_tokens"]
+    lines = [f"{'':<24}" + "".join(f"{column:>{len(column) + 2}}" for column in columns)]
+    rows = [("total", summary["total"])]
+    rows += [(f"[{stage}]", rollup) for stage, rollup in sorted(summary["stages"].items())]
+    rows += [(f"  {label}", rollup) for label, rollup in sorted(summary["labels"].items())]
+    for name, rollup in rows:
+        lines.append(f"{name:<24}" + "".join(f"{rollup[column]:>{len(column) + 2}}" for column in columns))
+    if "elapsed" in summary["total"]:
+        lines.append(f"elapsed: {summary['total']['elapsed']}s")
+    for name, stats in summary.get("components", dict()).items():
+        lines.append(f"{name}: " + ", ".join(f"{key}={value}" for key, value in stats.items() if not isinstance(value, (list, dict))))
+        for item in stats.get("endpoints", list()):
+            lines.append(f"  {item['name']}: " + ", ".join(f"{key}={value}" for key, value in item.items() if key != "name"))
+    return "\n".join(lines)
@@ -1,3 +1,5 @@
+import re
+import json
 import common
 from enum import Enum
 
@@ -116,6 +118,48 @@ def ability2instruction(ability, image_size):
     instruction = instruction.replace("$width", f"{width}").replace("$height", f"{height}")
     return instruction
 
+# Resolution and format of the images sent to the model, by question type or category and by component.
+# max_side bounds the long edge and max_pixels the area, images are only downscaled. PNG keeps the exact
+# colors for questions comparing legend and map colors, JPEG is used wherever text and layout are enough.
+image_policies = {
+    # HIE component extraction.
+    "title": {"format": "jpeg", "max_side": 1280, "quality": 90},
+    "scale": {"format": "jpeg", "max_side": 1280, "quality": 90},
+    "lonlat": {"format": "jpeg", "max_side": 1600, "quality": 90},
+    "index_map": {"format": "jpeg", "max_side": 1280, "quality": 90},
+    # PEQA.
+    "extracting": {"format": "jpeg", "max_side": 1024, "quality": 90},
+    "grounding": {"format": "jpeg", "max_side": 1536, "quality": 85},
+    "referring": {"format": "png", "max_pixels": 2048 * 2048},
+    "reasoning": {"format": "png", "max_pixels": 2048 * 2048},
+    "analyzing": {"format": "jpeg", "max_pixels": 2048 * 2048, "quality": 90},
+}
+
+def get_image_policy(component=None, question_type=None):
+    # None means the original file is sent.
+    if common.image_policy == "original":
+        return None
+    if question_type is not None:
+        for key in (question_type, question_type.split("-")[0]):
+            if key in image_policies:
+                return image_policies[key]
+    return image_policies.get(component)
+
+def is_grounding(ability):
+    return question_ability2format.get(ability) == grounding_format
+
+def rescale_grounding_answer(answer, scale):
+    # Boxes answered in the pixels of a downscaled image are mapped back to the original image.
+    try:
+        parsed = json.loads(answer)
+    except (TypeError, ValueError):
+        return answer
+    box = parsed.get("answer") if isinstance(parsed, dict) else None
+    if not isinstance(box, list) or len(box) != 4 or not all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in box):
+        return answer
+    parsed["answer"] = [int(round(v / scale)) for v in box]
+    return json.dumps(parsed, ensure_ascii=False)
+
 def remove_format_requirement(question):
     pattern_cgs = "？"
     pattern_usgs = "?"
@@ -245,3 +289,15 @@ def get_final_answer(answer, question_type):
     else:
         final_answer = str(answer["answer"])
     return final_answer.strip()
+
+def get_partial_answer(text):
+    # Readable part of a streamed, still incomplete JSON answer.
+    for key in ("reason", "answer"):
+        match = re.search(r'"%s"\s*:\s*"((?:[^"\\]|\\.)*)' % key, text, re.S)
+        if match:
+            value = match.group(1)
+            try:
+                return json.loads('"' + value.rstrip("\\") + '"')
+            except ValueError:
+                return value
+    return ""
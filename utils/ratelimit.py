@@ -0,0 +1,65 @@
+import time
+import threading
+
+class token_bucket:
+    # Tokens refill continuously at rate per second up to capacity, reservations may borrow from the future.
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount, now):
+        # Returns the seconds to wait before the reserved amount is available, caller holds the lock.
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= amount
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+class rate_limiter:
+    # Process-wide limiter on requests and tokens per minute, 0 means unlimited.
+    def __init__(self, requests_per_minute=0, tokens_per_minute=0):
+        self.lock = threading.Lock()
+        self.request_bucket = token_bucket(requests_per_minute / 60.0, requests_per_minute) if requests_per_minute > 0 else None
+        self.token_bucket = token_bucket(tokens_per_minute / 60.0, tokens_per_minute) if tokens_per_minute > 0 else None
+        self.blocked_until = 0.0
+        self.acquired = 0
+        self.queue_time_total = 0.0
+        self.queue_time_max = 0.0
+
+    def acquire(self, tokens=0):
+        # Block until a request with the estimated tokens may be sent, returns the queueing delay in seconds.
+        with self.lock:
+            now = time.monotonic()
+            wait = max(0.0, self.blocked_until - now)
+            if self.request_bucket is not None:
+                wait = max(wait, self.request_bucket.reserve(1, now))
+            if self.token_bucket is not None:
+                wait = max(wait, self.token_bucket.reserve(min(tokens, self.token_bucket.capacity), now))
+            self.acquired += 1
+            self.queue_time_total += wait
+            self.queue_time_max = max(self.queue_time_max, wait)
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def settle(self, estimated_tokens, actual_tokens):
+        # Correct the token reservation once the real usage is known.
+        if self.token_bucket is None or actual_tokens is None:
+            return
+        with self.lock:
+            self.token_bucket.tokens -= actual_tokens - estimated_tokens
+
+    def pause(self, seconds):
+        # Honor Retry-After: nobody sends before the provider allows it again.
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "acquired": self.acquired,
+                "queue_time_total": round(self.queue_time_total, 3),
+                "queue_time_mean": round(self.queue_time_total / self.acquired, 3) if self.acquired > 0 else 0.0,
+                "queue_time_max": round(self.queue_time_max, 3),
+            }
@@ -0,0 +1,65 @@
+import tracing
+import common
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+class stage_scheduler:
+    # Run stages of a dependency graph in a thread pool, each stage starts as soon as its dependencies finish.
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers or common.max_workers
+        self.stages = dict()
+        self.stopped_by = None
+        # set when a stage stops the run, long running stages check it to return early.
+        self.cancelled = threading.Event()
+
+    def add_stage(self, name, func, deps=(), stop_if=None):
+        # func is called with the results of deps in order,
+        # stop_if(result) returning True cancels every stage not started yet and sets cancelled,
+        # stages already running keep going until they check it.
+        self.stages[name] = (func, tuple(deps), stop_if)
+
+    def run(self):
+        results = dict()
+        pending = dict(self.stages)
+        futures = dict()
+        self.stopped_by = None
+        self.cancelled.clear()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        try:
+            while pending or futures:
+                for name, (func, deps, _) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        # stages run in a copy of the caller's context, e.g. its metrics collector.
+                        futures[executor.submit(contextvars.copy_context().run, run_stage, name, func, *[results[dep] for dep in deps])] = name
+                        del pending[name]
+                if not futures:
+                    raise ValueError(f"Unresolvable stage dependencies: {list(pending.keys())}")
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    results[name] = future.result()
+                    stop_if = self.stages[name][2]
+                    if stop_if is not None and stop_if(results[name]):
+                        # running stages are not interrupted, they see cancelled and their results are dropped.
+                        self.stopped_by = name
+                        self.cancelled.set()
+                        return results
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+        return results
+
+def run_stage(name, func, *args):
+    with tracing.span(f"stage.{name}"):
+        return func(*args)
+
+def parallel_map(func, items, max_workers=None):
+    # Like map(func, items) with a bounded thread pool, results keep the order of items.
+    items = list(items)
+    max_workers = min(max_workers or common.max_workers, len(items))
+    if max_workers <= 1:
+        return [func(item) for item in items]
+    contexts = [contextvars.copy_context() for _ in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(lambda context, item: context.run(func, item), contexts, items))
@@ -0,0 +1,132 @@
+import os
+import json
+import time
+import threading
+import functools
+import itertools
+import contextvars
+
+# Spans are only recorded inside a session, without one span() costs a context variable lookup.
+current_session = contextvars.ContextVar("current_session", default=None)
+current_span = contextvars.ContextVar("current_span", default=None)
+
+class span:
+    # with tracing.span("HIE.digitalize", image=name) as s: ... ; s.args can be extended until the span ends.
+    def __init__(self, name, category="peace", **args):
+        self.name = name
+        self.category = category
+        self.args = args
+        self.session = None
+
+    def __enter__(self):
+        self.session = current_session.get()
+        if self.session is None:
+            return self
+        parent = current_span.get()
+        self.parent_id = parent.id if parent is not None and parent.session is self.session else None
+        self.id = self.session.next_id()
+        self.thread = threading.current_thread()
+        self.token = current_span.set(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.session is None:
+            return False
+        self.end = time.perf_counter()
+        current_span.reset(self.token)
+        if exc_type is not None:
+            self.args["error"] = f"{exc_type.__name__}: {exc}"
+        self.session.add(self)
+        return False
+
+def traced(name, category="peace"):
+    # Decorator form of span.
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name, category):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class session:
+    # Collects the spans of everything run inside it, including the thread pools of scheduler and api.
+    def __init__(self, name="peace"):
+        self.name = name
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.spans = list()
+        self.start = time.perf_counter()
+
+    def __enter__(self):
+        self.token = current_session.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        current_session.reset(self.token)
+        return False
+
+    def next_id(self):
+        with self.lock:
+            return next(self.ids)
+
+    def add(self, finished_span):
+        with self.lock:
+            self.spans.append(finished_span)
+
+    def chrome_trace(self):
+        # Trace Event Format, open in chrome://tracing or https://ui.perfetto.dev.
+        with self.lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        pid = os.getpid()
+        threads = dict()
+        events = list()
+        for s in spans:
+            tid = threads.setdefault(s.thread.ident, (len(threads) + 1, s.thread.name))[0]
+            events.append({
+                "name": s.name,
+                "cat": s.category,
+                "ph": "X",
+                "ts": round((s.start - self.start) * 1e6, 1),
+                "dur": round((s.end - s.start) * 1e6, 1),
+                "pid": pid,
+                "tid": tid,
+                "args": {key: value if isinstance(value, (int, float, bool, str)) or value is None else str(value) for key, value in s.args.items()},
+            })
+        events.append({"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": self.name}})
+        for tid, thread_name in threads.values():
+            events.append({"name": "thread_name", "ph": "M", "pid": pid, "tid": tid, "args": {"name": thread_name}})
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, path):
+        if len(os.path.dirname(path).strip()) != 0:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self.chrome_trace(), ensure_ascii=False))
+
+    def timings(self):
+        # Flat table per span name: total time and self time, i.e. excluding child spans on the same thread.
+        with self.lock:
+            spans = list(self.spans)
+        child_time = dict()
+        for s in spans:
+            if s.parent_id is not None:
+                child_time[(s.parent_id, s.thread.ident)] = child_time.get((s.parent_id, s.thread.ident), 0.0) + s.end - s.start
+        table = dict()
+        for s in spans:
+            duration = s.end - s.start
+            row = table.setdefault(s.name, {"count": 0, "total": 0.0, "self": 0.0, "max": 0.0})
+            row["count"] += 1
+            row["total"] += duration
+            row["self"] += max(0.0, duration - child_time.get((s.id, s.thread.ident), 0.0))
+            row["max"] = max(row["max"], duration)
+        for row in table.values():
+            row["mean"] = row["total"] / row["count"]
+        return table
+
+    def format_timings(self):
+        lines = [f"{'span':<48}{'count':>8}{'total(s)':>12}{'self(s)':>12}{'mean(s)':>12}{'max(s)':>12}"]
+        for name, row in sorted(self.timings().items(), key=lambda x: -x[1]["total"]):
+            lines.append(f"{name:<48}{row['count']:>8}{row['total']:>12.3f}{row['self']:>12.3f}{row['mean']:>12.3f}{row['max']:>12.3f}")
+        return "\n".join(lines)
@@ -1,28 +1,456 @@
+import os
 import cv2
+import queue
+import atexit
+import base64
+import hashlib
+import logging
+import threading
+import collections
 import numpy as np
+from mimetypes import guess_type
+from PIL import Image
+import common
 #from paddleocr import PaddleOCR
-import matplotlib.pyplot as plt
+
+# geologic map scans are larger than the decompression bomb limit of PIL, which is only used to read headers here.
+Image.MAX_IMAGE_PIXELS = None
+
+class image_cache:
+    # Decoded images shared by the whole pipeline, keyed by path and validated by file size and modification time.
+    # Least recently used images are dropped when the total size exceeds max_mb. Cached arrays are read-only.
+    def __init__(self, max_mb=1024):
+        self.max_size = int(max_mb * 1024 * 1024)
+        self.size = 0
+        self.images = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def signature(self, path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def get(self, path):
+        path = os.path.abspath(path)
+        signature = self.signature(path)
+        with self.lock:
+            entry = self.images.get(path)
+            if entry is not None and entry[0] == signature:
+                self.images.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+        image = cv2.imread(path)
+        if image is None:
+            raise ValueError(f"Failed to decode image {path}")
+        self.put(path, image, signature)
+        return image
+
+    def put(self, path, image, signature=None):
+        # Register an image that was just written to path, so it is not decoded again.
+        path = os.path.abspath(path)
+        signature = signature or self.signature(path)
+        image.setflags(write=False)
+        with self.lock:
+            self.discard(path)
+            if image.nbytes > self.max_size:
+                return
+            self.images[path] = (signature, image)
+            self.size += image.nbytes
+            while self.size > self.max_size:
+                _, (_, evicted) = self.images.popitem(last=False)
+                self.size -= evicted.nbytes
+
+    def discard(self, path):
+        # caller holds the lock.
+        entry = self.images.pop(path, None)
+        if entry is not None:
+            self.size -= entry[1].nbytes
+
+    def peek(self, path):
+        # Cached image or None, nothing is decoded.
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.images.get(path)
+        if entry is not None and entry[0] == self.signature(path):
+            return entry[1]
+        return None
+
+    def shape(self, path):
+        # (height, width) from the decoded image when cached, otherwise from the file header only.
+        path = os.path.abspath(path)
+        with self.lock:
+            entry = self.images.get(path)
+        if entry is not None and entry[0] == self.signature(path):
+            return entry[1].shape[:2]
+        with Image.open(path) as image:
+            width, height = image.size
+        return height, width
+
+    def stats(self):
+        with self.lock:
+            return {"images": len(self.images), "size_mb": round(self.size / 1024 / 1024, 3), "hits": self.hits, "misses": self.misses}
+
+images = image_cache(common.image_cache_mb)
+
+class crop_entry:
+    # A crop held in memory, encoded at most once for both the model request and the disk.
+    def __init__(self, path, image, store=None):
+        self.path = path
+        self.image = image
+        self.data = None
+        self.url = None
+        self.store = store
+        self.counted = 0
+        self.superseded = False
+        self.pending = False
+        self.written = False
+        self.released = False
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.image.nbytes + (self.data.nbytes if self.data is not None else 0) + (len(self.url) if self.url is not None else 0)
+
+    def encoded(self):
+        with self.lock:
+            if self.data is None:
+                ok, buffer = cv2.imencode(os.path.splitext(self.path)[1] or ".png", self.image)
+                if not ok:
+                    raise ValueError(f"Failed to encode image {self.path}")
+                self.data = buffer
+            data = self.data
+        self.resized()
+        return data
+
+    def data_url(self):
+        data = self.encoded()
+        with self.lock:
+            if self.url is None:
+                self.url = to_data_url(data, guess_type(self.path)[0] or "application/octet-stream")
+            url = self.url
+        self.resized()
+        return url
+
+    def drop_encoded(self):
+        # the file on disk holds the same bytes from now on.
+        with self.lock:
+            self.data = None
+            self.url = None
+        self.resized()
+
+    def resized(self):
+        if self.store is not None:
+            self.store.resize(self)
+
+class crop_store:
+    # Crops of the maps being processed, keyed by the path they are persisted to. Crops are copied out of the
+    # decoded map so they do not keep it alive. Above max_mb (pixels and encoded bytes) the least recently used crops
+    # that are on disk are dropped, crops still queued for writing or never persisted stay over budget.
+    # The crops of a map are released once they are on disk (release_folder).
+    def __init__(self, max_mb=256):
+        self.max_size = int(max_mb * 1024 * 1024)
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def put(self, path, image):
+        path = os.path.abspath(path)
+        if image.base is not None:
+            image = image.copy()
+        image.setflags(write=False)
+        entry = crop_entry(path, image, self)
+        with self.lock:
+            previous = self.entries.get(path)
+            if previous is not None:
+                previous.superseded = True
+                self.discard(previous)
+            self.entries[path] = entry
+            entry.counted = entry.nbytes
+            self.size += entry.counted
+            self.evict()
+        return entry
+
+    def get(self, path):
+        with self.lock:
+            entry = self.entries.get(os.path.abspath(path))
+            if entry is not None:
+                self.entries.move_to_end(entry.path)
+            return entry
+
+    def resize(self, entry):
+        with self.lock:
+            if self.entries.get(entry.path) is not entry:
+                return
+            nbytes = entry.nbytes
+            self.size += nbytes - entry.counted
+            entry.counted = nbytes
+            self.evict()
+
+    def mark_pending(self, entry):
+        with self.lock:
+            entry.pending = True
+
+    def mark_written(self, entry):
+        # called by the writer once the file is replaced, drops the crop when its map was released meanwhile.
+        with self.lock:
+            entry.written = True
+            entry.pending = False
+            if entry.released and self.entries.get(entry.path) is entry:
+                self.discard(entry)
+
+    def release_folder(self, folder):
+        # Drop the crops under folder that are on disk, crops still queued are dropped by the writer once written.
+        # Crops that are never persisted (PEACE_CROP_PERSIST=off) are the only copy and stay in memory.
+        folder = os.path.join(os.path.abspath(folder), "")
+        with self.lock:
+            for entry in [e for path, e in self.entries.items() if path.startswith(folder)]:
+                if entry.written:
+                    self.discard(entry)
+                else:
+                    entry.released = True
+
+    def discard(self, entry):
+        # caller holds the lock.
+        self.entries.pop(entry.path, None)
+        self.size -= entry.counted
+        entry.counted = 0
+
+    def evict(self):
+        # caller holds the lock. Only crops on disk can be read again once dropped.
+        if self.size <= self.max_size:
+            return
+        for entry in [e for e in self.entries.values() if e.written]:
+            self.discard(entry)
+            if self.size <= self.max_size:
+                break
+
+    def stats(self):
+        with self.lock:
+            return {"crops": len(self.entries), "size_mb": round(self.size / 1024 / 1024, 3),
+                    "pending": sum(e.pending for e in self.entries.values())}
+
+class crop_writer:
+    # Background writer of crops, the pipeline does not wait for PNG compression and disk I/O.
+    def __init__(self):
+        self.queue = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, entry):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="crop_writer", daemon=True)
+                self.thread.start()
+        if entry.store is not None:
+            entry.store.mark_pending(entry)
+        self.queue.put(entry)
+
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            try:
+                if not entry.superseded:
+                    write_encoded(entry)
+            except Exception as e:
+                logging.warning(f"{type(e).__name__}: {e}. Failed to write {entry.path}...")
+            finally:
+                self.queue.task_done()
+
+    def flush(self):
+        # Block until every submitted crop is on disk.
+        self.queue.join()
+
+crops = crop_store(common.crop_cache_mb)
+writer = crop_writer()
+atexit.register(writer.flush)
+
+def write_encoded(entry):
+    folder = os.path.dirname(entry.path)
+    if not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    with open(entry.path + ".tmp", "wb") as f:
+        f.write(entry.encoded())
+    os.replace(entry.path + ".tmp", entry.path)
+    if entry.store is not None:
+        entry.store.mark_written(entry)
+    else:
+        entry.written = True
+    entry.drop_encoded()
+
+def load_image(image):
+    # Paths are served from the crops in memory or decoded through the shared cache, arrays are returned as they are.
+    if isinstance(image, str):
+        entry = crops.get(image)
+        return entry.image if entry is not None else images.get(image)
+    return image
+
+def save_image(image_path, image, persist=None):
+    # Crops stay in memory as copies, they are written to disk
+    # according to persist (common.crop_persist by default): async, sync or off.
+    persist = persist or common.crop_persist
+    entry = crops.put(image_path, image)
+    if persist == "sync":
+        write_encoded(entry)
+    elif persist == "async":
+        writer.submit(entry)
+    return entry
+
+def image_exists(image_path):
+    return crops.get(image_path) is not None or os.path.exists(image_path)
+
+def image_data_url(image_path):
+    # Data url of a crop held in memory, None when the image is on disk (the file bytes are the same encoding).
+    entry = crops.get(image_path)
+    return entry.data_url() if entry is not None and not entry.written else None
 
 def image_size(image):
     if isinstance(image, str):
-        image = cv2.imread(image)
-    h, w, _ = image.shape
+        entry = crops.get(image)
+        return entry.image.shape[:2] if entry is not None else images.shape(image)
+    h, w = image.shape[:2]
     return h, w
 
+def scaled_size(height, width, scale):
+    return max(1, int(round(height * scale))), max(1, int(round(width * scale)))
+
+def fit_scale(height, width, max_side=None, max_pixels=None):
+    # Largest scale not above 1 that fits the long edge and pixel budget.
+    scale = 1.0
+    if max_side:
+        scale = min(scale, max_side / max(height, width))
+    if max_pixels:
+        scale = min(scale, (max_pixels / (height * width)) ** 0.5)
+    return scale
+
+def resize_to_fit(image, max_side=None, max_pixels=None):
+    # Aspect preserving downscale, returns the resized image and the scale from the original pixels.
+    height, width = image.shape[:2]
+    scale = fit_scale(height, width, max_side, max_pixels)
+    if scale >= 1.0:
+        return image, 1.0
+    target_height, target_width = scaled_size(height, width, scale)
+    return cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_AREA), scale
+
+def load_image_reduced(image_path, scale):
+    # Images in memory are used as they are, others are decoded at 1/2, 1/4 or 1/8 resolution when scale allows.
+    entry = crops.get(image_path)
+    if entry is not None:
+        return entry.image
+    image = images.peek(image_path)
+    if image is not None:
+        return image
+    for factor, flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4), (2, cv2.IMREAD_REDUCED_COLOR_2)):
+        if scale * factor <= 1.0:
+            image = cv2.imread(image_path, flag)
+            if image is not None:
+                return image
+    return images.get(image_path)
+
+def encode_image(image, image_format="png", quality=90):
+    # BGR array straight to the compressed buffer, returns the buffer (a numpy array, not copied to bytes) and its mime type.
+    image_format = image_format.lower().lstrip(".")
+    if image_format in ("jpg", "jpeg"):
+        ext, mime_type, params = ".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    elif image_format == "webp":
+        ext, mime_type, params = ".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    else:
+        ext, mime_type, params = ".png", "image/png", []
+    ok, buffer = cv2.imencode(ext, image, params)
+    if not ok:
+        raise ValueError(f"Failed to encode image as {image_format}")
+    return buffer, mime_type
+
+def to_data_url(data, mime_type):
+    # data is any buffer (bytes, numpy array), base64 reads it in place and the url is assembled in one decode.
+    return (b"data:" + mime_type.encode("ascii") + b";base64," + base64.b64encode(memoryview(data))).decode("ascii")
+
+class data_url_cache:
+    # Data urls of encoded arrays keyed by a hash of the pixels and the encoding, least recently used dropped above max_mb.
+    def __init__(self, max_mb=64):
+        self.max_size = int(max_mb * 1024 * 1024)
+        self.size = 0
+        self.urls = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, image, image_format, quality):
+        # hashing is an order of magnitude faster than compressing. Crops (views) are hashed row by row in place,
+        # their rows are contiguous, only other strided arrays are copied.
+        digest = hashlib.sha256()
+        if image.flags.c_contiguous:
+            digest.update(image.data)
+        elif image.ndim >= 2 and image[0].flags.c_contiguous:
+            for row in image:
+                digest.update(row.data)
+        else:
+            digest.update(np.ascontiguousarray(image).data)
+        return (digest.hexdigest(), image.shape, image.dtype.str, image_format.lower(), quality)
+
+    def get(self, key):
+        with self.lock:
+            url = self.urls.get(key)
+            if url is None:
+                self.misses += 1
+                return None
+            self.urls.move_to_end(key)
+            self.hits += 1
+            return url
+
+    def put(self, key, url):
+        with self.lock:
+            previous = self.urls.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            if len(url) > self.max_size:
+                return
+            self.urls[key] = url
+            self.size += len(url)
+            while self.size > self.max_size:
+                _, evicted = self.urls.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self.lock:
+            return {"urls": len(self.urls), "size_mb": round(self.size / 1024 / 1024, 3), "hits": self.hits, "misses": self.misses}
+
+encoded_urls = data_url_cache()
+
+def encode_data_url(image, image_format="png", quality=90):
+    # The one encoder of arrays sent to the model: BGR array -> cv2.imencode -> base64 -> data url, cached by content.
+    key = encoded_urls.key(image, image_format, quality)
+    url = encoded_urls.get(key)
+    if url is None:
+        buffer, mime_type = encode_image(image, image_format, quality)
+        url = to_data_url(buffer, mime_type)
+        encoded_urls.put(key, url)
+    return url
+
+def policy_data_url(image_path, policy):
+    # Data url of the image resized and encoded according to policy (see prompt.image_policies),
+    # and the scale from the original pixels to the sent ones.
+    height, width = image_size(image_path)
+    scale = fit_scale(height, width, policy.get("max_side"), policy.get("max_pixels"))
+    image = load_image_reduced(image_path, scale)
+    target_height, target_width = scaled_size(height, width, scale)
+    if image.shape[:2] != (target_height, target_width):
+        image = cv2.resize(image, (target_width, target_height), interpolation=cv2.INTER_AREA)
+    return encode_data_url(image, policy.get("format", "png"), policy.get("quality", 90)), scale
+
 def crop_image(image, bndbox):
     x0, y0, x1, y1 = bndbox
-    if isinstance(image, str):
-        image = cv2.imread(image)
+    image = load_image(image)
     cropped_image = image[y0:y1, x0:x1]
     return cropped_image
 
 def crop_and_save_image(image, bndbox, cropped_image_path):
-    cropped_image = crop_image(image, bndbox)
-    cv2.imwrite(cropped_image_path, cropped_image)
+    # the stored copy of the crop is returned, it does not keep the map alive.
+    return save_image(cropped_image_path, crop_image(image, bndbox)).image
 
 def crop_corners_and_save_image(image, cropped_image_path, relative_size=0.1):
-    if isinstance(image, str):
-        image = cv2.imread(image)
+    image = load_image(image)
 
     # Define the relative size of the corner to be cropped (e.g., 10% of height and width)
     height, width, _ = image.shape
@@ -59,18 +487,32 @@ def crop_corners_and_save_image(image, cropped_image_path, relative_size=0.1):
     final_height, final_width = cropped_image.shape[:2]
     if final_height <= 10 or final_width <= 10:
         # If still too small, save the original image region instead
-        cv2.imwrite(cropped_image_path, image)
+        save_image(cropped_image_path, image)
     else:
-        cv2.imwrite(cropped_image_path, cropped_image)
-
-def calc_image_rgb(image):
-    # Return color in RBG order.
-    pixel_list = np.array(list(filter(lambda c: not (c[0] < 16 and c[1] < 16 and c[2] < 16), list(image.reshape(-1, 3)))), dtype=image.dtype)
-    #color, _ = Counter(map(tuple, pixel_list)).most_common(1)[0]
-    #color = np.mean(pixel_list, axis=0)
-    color = np.median(pixel_list, axis=0)
+        save_image(cropped_image_path, cropped_image)
+
+def calc_image_rgb(image, mode="median"):
+    # Return color in RBG order. Near-black pixels (text, borders) are ignored.
+    # median: per channel median of the remaining pixels.
+    # dominant: median of the most frequent color (quantized histogram), robust to hatching and text in the swatch.
+    pixels = image.reshape(-1, 3)
+    keep = (pixels >= 16).any(axis=1)
+    if keep.any():
+        pixels = pixels[keep]
+    if mode == "dominant":
+        pixels = dominant_pixels(pixels)
+    color = np.median(pixels, axis=0)
     return color[::-1]
 
+def dominant_pixels(pixels, bits=3):
+    # Pixels in the most populated cell of a 2^(8-bits) levels per channel histogram and its neighbor cells.
+    quantized = (pixels >> bits).astype(np.int32)
+    levels = 256 >> bits
+    index = (quantized[:, 0] * levels + quantized[:, 1]) * levels + quantized[:, 2]
+    peak = np.bincount(index, minlength=levels ** 3).argmax()
+    center = np.array([peak // (levels * levels), peak // levels % levels, peak % levels])
+    return pixels[(np.abs(quantized - center) <= 1).all(axis=1)]
+
 """
 ocr = PaddleOCR(use_angle_cls=True, lang="ch")
 #ocr = PaddleOCR(use_angle_cls=True, lang="en")
@@ -87,18 +529,23 @@ def image_ocr(img, need_det=False):
 """
 
 def annotate_image_with_directions(image, output_path, font_size=24, offset=50):
-    if isinstance(image, str):
-        image = cv2.imread(image)
-
-    img_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-
-    fig, ax = plt.subplots(figsize=(8, 8))
-    ax.imshow(img_rgb)
+    # The image on a white canvas padded by 20% on every side, with the eight directions drawn offset pixels
+    # outside its edges and corners. Font size is in points of the former 8 inch, 100 dpi rendering.
+    image = load_image(image)
+    height, width = image.shape[:2]
 
-    height, width, _ = img_rgb.shape
+    # label height relative to the long side of the canvas, as the figure rendered it.
+    text_height = max(8, int(round(font_size * 100 / 72 / 616 * 1.4 * max(width, height))))
+    thickness = max(1, text_height // 8)
+    font = cv2.FONT_HERSHEY_SIMPLEX
+    font_scale = cv2.getFontScaleFromHeight(font, text_height, thickness)
+    (text_width, _), _ = cv2.getTextSize("NW", font, font_scale, thickness)
 
-    ax.set_xlim([-width * 0.2, width * 1.2])
-    ax.set_ylim([height * 1.2, -height * 0.2])
+    # labels are kept inside the canvas even when offset exceeds the 20% padding.
+    pad_x = max(int(round(width * 0.2)), offset + text_width // 2 + thickness)
+    pad_y = max(int(round(height * 0.2)), offset + text_height // 2 + thickness)
+    canvas = np.full((height + 2 * pad_y, width + 2 * pad_x, 3), 255, dtype=np.uint8)
+    canvas[pad_y:pad_y+height, pad_x:pad_x+width] = image[..., :3] if image.ndim == 3 else image[..., None]
 
     directions = {
         "N": (width // 2, -offset),
@@ -112,56 +559,56 @@ def annotate_image_with_directions(image, output_path, font_size=24, offset=50):
     }
 
     for direction, (x, y) in directions.items():
-        ax.text(x, y, direction, fontsize=font_size, fontweight="bold", ha="center", va="center", color="black")
+        (w, h), _ = cv2.getTextSize(direction, font, font_scale, thickness)
+        origin = (pad_x + x - w // 2, pad_y + y + h // 2)
+        cv2.putText(canvas, direction, origin, font, font_scale, (0, 0, 0), thickness, cv2.LINE_AA)
 
-    ax.axis("off")
-    plt.savefig(output_path, bbox_inches="tight", pad_inches=0)
-    # plt.show()
+    save_image(output_path, canvas)
+    return canvas
 
-def rgb_to_color_name(rgb):
-    color_map = {
-        (255, 0, 0): "Red",
-        (0, 255, 0): "Green",
-        (0, 0, 255): "Blue",
-        (255, 255, 0): "Yellow",
-        (0, 255, 255): "Cyan",
-        (255, 0, 255): "Magenta",
-        (255, 255, 255): "White",
-        (0, 0, 0): "Black",
-        (128, 128, 128): "Gray",
-        (128, 0, 0): "Maroon",
-        (128, 128, 0): "Olive",
-        (0, 128, 0): "Dark Green",
-        (128, 0, 128): "Purple",
-        (0, 128, 128): "Teal",
-        (0, 0, 128): "Navy",
-        (255, 192, 203): "Pink",
-        (255, 165, 0): "Orange",
-        (0, 255, 127): "Spring Green",
-        (255, 105, 180): "Hot Pink",
-        (255, 69, 0): "Red-Orange",
-        (102, 205, 170): "Medium Aquamarine",
-        (173, 216, 230): "Light Blue",
-        (240, 230, 140): "Khaki",
-        (255, 20, 147): "Deep Pink",
-        (255, 99, 71): "Tomato"
-    }
- 
-    min_distance = float('inf')
-    closest_color_name = "Unknown"
-    for key, value in color_map.items():
-        distance = sum((a - b) ** 2 for a, b in zip(rgb, key))
-        if distance < min_distance:
-            min_distance = distance
-            closest_color_name = value
+color_palette = {
+    (255, 0, 0): "Red",
+    (0, 255, 0): "Green",
+    (0, 0, 255): "Blue",
+    (255, 255, 0): "Yellow",
+    (0, 255, 255): "Cyan",
+    (255, 0, 255): "Magenta",
+    (255, 255, 255): "White",
+    (0, 0, 0): "Black",
+    (128, 128, 128): "Gray",
+    (128, 0, 0): "Maroon",
+    (128, 128, 0): "Olive",
+    (0, 128, 0): "Dark Green",
+    (128, 0, 128): "Purple",
+    (0, 128, 128): "Teal",
+    (0, 0, 128): "Navy",
+    (255, 192, 203): "Pink",
+    (255, 165, 0): "Orange",
+    (0, 255, 127): "Spring Green",
+    (255, 105, 180): "Hot Pink",
+    (255, 69, 0): "Red-Orange",
+    (102, 205, 170): "Medium Aquamarine",
+    (173, 216, 230): "Light Blue",
+    (240, 230, 140): "Khaki",
+    (255, 20, 147): "Deep Pink",
+    (255, 99, 71): "Tomato"
+}
+palette_colors = np.array(list(color_palette.keys()), dtype=np.float64)
+palette_names = np.array(list(color_palette.values()) + ["Unknown"], dtype=object)
 
-    return closest_color_name
+def rgb_to_color_name(rgb):
+    # Closest palette color (squared euclidean). A single color gives its name, an (N, 3) batch the list of names.
+    colors = np.asarray(rgb, dtype=np.float64)
+    distances = np.nan_to_num(np.sum((colors[..., None, :] - palette_colors) ** 2, axis=-1), nan=np.inf)
+    # colors with NaN channels are Unknown.
+    index = np.where(np.isinf(distances).all(axis=-1), len(palette_colors), distances.argmin(axis=-1))
+    names = palette_names[index]
+    return names.tolist() if colors.ndim > 1 else str(names)
 
 def fault_line_det(image):
     length_threshold = 10
 
-    if isinstance(image, str):
-        image = cv2.imread(image)
+    image = load_image(image)
 
     color_ranges = ((np.array([0, 150, 150]), np.array([15, 255, 255])), (np.array([165, 150, 150]), np.array([180, 255, 255])))
     
@@ -202,39 +649,98 @@ def hex_to_rgb(hex_color):
 def color_key(color):
     return f"{color[0]}_{color[1]}_{color[2]}"
 
+def color_thresholds(colors):
+    # Half of the L1 distance to the nearest other legend color, 10 when there is none; identical colors are not
+    # compared. colors is (L, 3) or a batch (..., L, 3) of maps with the same number of legends.
+    colors = np.asarray(colors, dtype=np.int64)
+    if colors.shape[-2] == 0:
+        return np.zeros(colors.shape[:-1], dtype=np.float64)
+    distances = np.abs(colors[..., :, None, :] - colors[..., None, :, :]).sum(axis=-1)
+    distances = np.where(distances == 0, np.iinfo(np.int64).max, distances)
+    min_d = distances.min(axis=-1)
+    return np.where(min_d == np.iinfo(np.int64).max, 10.0, min_d / 2)
+
 def cal_color_thred(colors):
-    color2thred = dict()
-    for color1 in colors:
-        color2thred[color_key(color1)] = 10
-        min_d = 256 *3
-        for color2 in colors:
-            if color_key(color1) == color_key(color2):
-                continue
-            d = abs(color1[0] - color2[0]) + abs(color1[1] - color2[1]) + abs(color1[2] - color2[2])
-            if d < min_d:
-                min_d = d
-                color2thred[color_key(color1)] = min_d / 2
-    return color2thred
-
-def rock_region_seg(image, legends):
-    if isinstance(image, str):
-        image = cv2.imread(image)
+    colors = np.asarray(colors).reshape(-1, 3)
+    thresholds = color_thresholds(colors)
+    return {color_key(color): float(threshold) for color, threshold in zip(colors, thresholds)}
 
-    _s = 4
-    height, width, _ = image.shape
-    new_dimensions = (width//_s, height//_s)
-    resized_image = cv2.resize(image, new_dimensions, interpolation=cv2.INTER_NEAREST)
-    resized_image_rgb = cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB)
-    image_area = 1.0 * resized_image_rgb.shape[0] * resized_image_rgb.shape[1]
-    
-    colors = np.array([legend["color"] for legend in legends])
-    color2thred = cal_color_thred(colors)
+def legend_label_map(image_rgb, colors, thresholds, excluded=None, chunk=16384):
+    # Nearest legend color within its threshold (L1) for every pixel, in one pass over the unique colors of the image.
+    # Returns the label raster (0: no legend, i: colors[i-1]) and the number of pixels within the threshold of each
+    # legend, counted independently like the former per-legend scans.
+    colors = np.asarray(colors, dtype=np.int16).reshape(-1, 3)
+    # distances are integers, so d <= threshold is d <= floor(threshold).
+    thresholds = np.floor(np.asarray(thresholds, dtype=np.float64)).astype(np.int16)
+    excluded = np.zeros(len(colors), dtype=bool) if excluded is None else np.asarray(excluded, dtype=bool)
+    dtype = np.uint8 if len(colors) < 255 else np.uint16
+    if len(colors) == 0:
+        return np.zeros(image_rgb.shape[:2], dtype=dtype), np.zeros(0, dtype=np.int64)
+
+    keys = (image_rgb[..., 0].astype(np.int32) << 16) | (image_rgb[..., 1].astype(np.int32) << 8) | image_rgb[..., 2]
+    counts = np.bincount(keys.ravel(), minlength=1 << 24)
+    present = np.flatnonzero(counts)
+    unique_colors = np.stack([present >> 16, (present >> 8) & 255, present & 255], axis=1).astype(np.uint8)
+
+    # |value - legend channel| for every channel value, distances are then three table lookups per color and legend.
+    tables = [np.abs(np.arange(256, dtype=np.int16)[:, None] - colors[None, :, k]) for k in range(3)]
+    unique_labels = np.zeros(len(present), dtype=dtype)
+    legend_counts = np.zeros(len(colors), dtype=np.int64)
+    for start in range(0, len(present), chunk):
+        block = unique_colors[start:start+chunk]
+        distances = tables[0][block[:, 0]] + tables[1][block[:, 1]] + tables[2][block[:, 2]]
+        within = (distances <= thresholds) & ~excluded
+        legend_counts += counts[present[start:start+chunk]] @ within
+        nearest = np.where(within, distances, np.iinfo(np.int16).max).argmin(axis=1)
+        unique_labels[start:start+chunk] = np.where(within.any(axis=1), nearest + 1, 0)
+
+    lookup = np.zeros(1 << 24, dtype=dtype)
+    lookup[present] = unique_labels
+    return lookup[keys], legend_counts
+
+def rock_region_seg(image, legends, seg_path=None):
+    # Sets color_hex and area (fraction of the main map) of every legend. The label raster of the downscaled map is
+    # saved to seg_path (.npz) and reused from there as long as the legend colors are the same.
+    colors = np.array([legend["color"] for legend in legends], dtype=np.int32).reshape(-1, 3)
     for legend in legends:
-        color = legend["color"]
-        legend["color_hex"] = rgb_to_hex(color)
-        if color != [255, 255, 255]:
-            thred = color2thred[color_key(color)]
-            distances = np.sum(np.abs(resized_image_rgb - np.array(color)), axis=-1)
-            legend["area"] = round(int(np.sum(distances <= thred)) / image_area, 6)
-        else:
-            legend["area"] = 0
+        legend["color_hex"] = rgb_to_hex(legend["color"])
+
+    seg = load_rock_region_seg(seg_path) if seg_path is not None and os.path.exists(seg_path) else None
+    if seg is None or not np.array_equal(seg["colors"], colors):
+        image = load_image(image)
+
+        _s = 4
+        height, width, _ = image.shape
+        new_dimensions = (width//_s, height//_s)
+        resized_image = cv2.resize(image, new_dimensions, interpolation=cv2.INTER_NEAREST)
+        resized_image_rgb = cv2.cvtColor(resized_image, cv2.COLOR_BGR2RGB)
+        image_area = 1.0 * resized_image_rgb.shape[0] * resized_image_rgb.shape[1]
+
+        thresholds = color_thresholds(colors)
+        excluded = [list(legend["color"]) == [255, 255, 255] for legend in legends]
+        labels, counts = legend_label_map(resized_image_rgb, colors, thresholds, excluded)
+        areas = np.array([round(int(count) / image_area, 6) for count in counts])
+        seg = {"labels": labels, "colors": colors, "areas": areas, "scale": _s}
+        if seg_path is not None:
+            save_rock_region_seg(seg_path, seg)
+
+    for legend, area in zip(legends, seg["areas"]):
+        legend["area"] = 0 if list(legend["color"]) == [255, 255, 255] else float(area)
+    return seg
+
+def save_rock_region_seg(seg_path, seg):
+    folder = os.path.dirname(seg_path)
+    if folder and not os.path.exists(folder):
+        os.makedirs(folder, exist_ok=True)
+    with open(seg_path + ".tmp", "wb") as f:
+        np.savez_compressed(f, **seg)
+    os.replace(seg_path + ".tmp", seg_path)
+
+def load_rock_region_seg(seg_path):
+    # labels: uint8/uint16 raster at 1/scale of the main map, labels[y, x] = i means legends[i-1], 0 means none.
+    try:
+        with np.load(seg_path) as data:
+            return {key: data[key] for key in ("labels", "colors", "areas", "scale")}
+    except Exception as e:
+        logging.warning(f"{type(e).__name__}: {e}. Skipping {seg_path}...")
+        return None